@@ -1,60 +1,196 @@
+import io
 import json
+import sys
+from collections import defaultdict
+import cache
 import config
+import events
+import render
+import stats
 from handlers import handlers
+from utils import json_default
 
 
 def pretty_print(obj, indent=0):
-    padding = ' ' * indent * 2
+    """:return: info as indented text (see render.write_text())"""
+    out = io.StringIO()
+    render.write_text(obj, out, indent)
 
-    if isinstance(obj, dict):
-        if obj.get('type', '') == 'file_list':
-            # File list.
-            files = obj['value']
+    return out.getvalue()
 
-            longest_path = max(len(file['path']) for file in files.values())
-            path_padding = min(40, longest_path + 1)
 
-            pretty = ''
-            for file in files.values():
-                pretty += '{}{:<{}}({}, crc32: {}, sector: {}, {} bytes)\n'.format(padding, file['path'], path_padding,
-                                                                                   file['date'], file['crc32'],
-                                                                                   file['sector'], file['size'])
+class SignatureTable:
+    """
+    The signatures of handler classes (see Signature), compiled to match the header of a file against all of them at
+    once: signatures of bytes at an offset are looked up in a dict per (offset, size).
+    """
 
-            return pretty
+    def __init__(self, handler_classes):
+        self.handler_classes = list(handler_classes)
+        self.header_size = 0
 
-        else:
-            pretty = ''
-            for key, value in obj.items():
-                pretty_value = pretty_print(value, indent + 1)
-                if '\n' in pretty_value:
-                    pretty += '{}{}:\n{}\n'.format(padding, key, pretty_value)
+        self.exact = defaultdict(lambda: defaultdict(set))  # (offset, size): {data: set of handler classes}
+        self.other = []  # (handler class, signature) of the other signatures
+        self.unfiltered = set()  # Handler classes without signatures
+
+        for handler_class in self.handler_classes:
+            if handler_class.signatures is None:
+                self.unfiltered.add(handler_class)
+                continue
+
+            for signature in handler_class.signatures:
+                if isinstance(signature.data, bytes) and signature.file_name is None:
+                    self.exact[signature.offset, len(signature.data)][signature.data].add(handler_class)
                 else:
-                    pretty += '{}{}: {}\n'.format(padding, key, pretty_value.lstrip())
+                    self.other.append((handler_class, signature))
 
-            return pretty
-    else:
-        return '{}{}'.format(padding, obj)
+                if signature.offset is not None:
+                    size = len(signature.data) if isinstance(signature.data, bytes) else signature.size
+                    self.header_size = max(self.header_size, signature.offset + size)
+
+    def candidates(self, header, file_name):
+        """
+        :param header: the first header_size bytes of the file (or all of it, if it is smaller)
+        :return: the handler classes that may handle the file, in order
+        """
+        matched = set(self.unfiltered)
+
+        for (offset, size), table in self.exact.items():
+            matched.update(table.get(header[offset:offset + size], ()))
+
+        for handler_class, signature in self.other:
+            if handler_class not in matched and self.matches(signature, header, file_name):
+                matched.add(handler_class)
+
+        return [handler_class for handler_class in self.handler_classes if handler_class in matched]
+
+    @staticmethod
+    def matches(signature, header, file_name):
+        if signature.file_name is not None and not signature.file_name.match(file_name):
+            return False
+
+        if isinstance(signature.data, bytes):
+            return header[signature.offset:signature.offset + len(signature.data)] == signature.data
+        elif signature.data is not None:
+            return signature.data.search(header, signature.offset, signature.offset + signature.size) is not None
+
+        return True
+
+
+_signature_table = None
 
 
 def find_handler(file, file_name):
-    for handler_class in handlers:
+    """
+    Find the handler of a file. The start of the file is read once and matched against the signatures of all handlers,
+    only the handlers that match are tested, and they read what they need from that header.
+
+    :return: handler which test() passed, or None
+    """
+    global _signature_table
+
+    if _signature_table is None:
+        _signature_table = SignatureTable(handlers)
+
+    header = file[0:_signature_table.header_size]
+
+    for handler_class in _signature_table.candidates(header, file_name):
         handler = handler_class(file=file, file_name=file_name)
+        handler.header = header
         if handler.test():
             return handler
 
     return None
 
 
+def get_info(file, file_name):
+    """
+    :return: info of the file, from the result cache if possible, or None if the file is unknown
+    """
+    result_cache = cache.open_cache()
+    if result_cache is None:
+        return _get_info(file, file_name)[0]
+
+    with result_cache:
+        info = None if config.refresh else result_cache.get(file_name)
+        if info is None:
+            info, opened_files = _get_info(file, file_name)
+            if info is not None:
+                result_cache.put(file_name, info, opened_files)
+        else:
+            events.replay(info)
+
+    return info
+
+
+def _get_info(file, file_name):
+    """
+    :return: (info or None, paths of the files opened to get it)
+    """
+    with cache.OpenedFiles() as opened_files:
+        with stats.stage('detect'):
+            # Images in archives are known by their own name, e.g. disc.gdi in game.zip (see archive.ArchiveFile).
+            handler = find_handler(file, getattr(file, 'image_name', file_name))
+        if not handler:
+            return None, opened_files
+
+        with stats.stage('get_info'):
+            handler.get_info()
+        events.emit_rest(handler.info)
+
+    return handler.info, opened_files
+
+
 def analyze_file(file, file_name):
-    handler = find_handler(file, file_name)
-    if not handler:
-        print('Unknown file')
+    if config.stats:
+        stats.enable()
+        stats.reset()
+
+    if events.streaming():
+        # The info is written as the analysis goes.
+        events.image = file_name
+        events.emit('image')
+
+        with stats.stage('analyze_file'):
+            info = get_info(file, file_name)
+
+        if info is None:
+            events.emit('unknown')
+
+        if config.stats:
+            events.emit('stats', stats=stats.collect())
+
+        events.emit('end')
         return
 
-    handler.get_info()
+    with stats.stage('analyze_file'):
+        info = get_info(file, file_name)
+
+        with stats.stage('output'):
+            write_info(info)
+
+    if config.stats:
+        write_stats(stats.collect())
+
+
+def write_info(info):
+    if info is None:
+        print('Unknown file')
+        return
 
-    # TODO
     if config.output_format == 'text':
-        print(pretty_print(handler.info))
+        render.write_text(info, sys.stdout)
+        print()
+    elif config.output_format == 'wiki':
+        render.write_wiki(info, sys.stdout)
     elif config.output_format == 'json':
-        print(json.dumps(handler.info, default=lambda obj: str(obj)))
+        print(json.dumps(info, default=json_default))
+
+
+def write_stats(figures):
+    """Write the stats of the stages (see stats.collect()) after the info."""
+    if config.output_format == 'json':
+        print(json.dumps({'Stats': figures}))
+    else:
+        print('Stats:')
+        print(json.dumps(figures, indent=2))
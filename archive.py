@@ -0,0 +1,595 @@
+"""
+Random access to images in compressed files (gzip, xz, zip, ECM), without extracting them.
+
+An ArchiveFile reads like a MmappedFile. Reads are served from blocks of decompressed data, which are decoded from the
+nearest seek point before them, and a few of which are kept in memory, so that a sequential scan streams through the
+archive with bounded memory.
+
+Seek points are where decoding can start afresh: the members of a gzip file, the blocks of an xz file, the data of a
+zip member and the items of the records of an ECM file (see ecm.index()). Finding them takes a pass over gzip files
+(their size is only known once they are decompressed) and over the record headers of ECM files, so the seek points and
+the size of an archive (its index) are saved in the cache directory and reused while the archive is unchanged. zlib
+can't resume decoding within a deflate stream from a saved position, so a single-member gzip file (or a deflated zip
+member) has a single seek point on disk. While it is open, copies of its decoder are kept every snapshot_interval
+bytes, so that random reads still only decode from the nearest one. Files compressed in independent blocks (bgzip,
+xz -T or --block-size) have seek points all along.
+
+Image names: disc.iso.gz is the image disc.iso compressed (likewise disc.bin.xz and disc.bin.ecm), game.zip/disc.gdi is
+the member disc.gdi of game.zip, and game.zip alone is its main member (see main_member()). Tracks of GDI and CUE images
+are looked up the same way, in the archive of the image, or compressed next to it (track03.bin.gz for track03.bin).
+"""
+import hashlib
+import json
+import lzma
+import os
+import struct
+import threading
+import zipfile
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+import cache
+import config
+import ecm
+import stats
+from utils import MmappedFile, split_path
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+ZIP_MAGIC = b'PK\x03\x04'
+
+# Compressed files by extension, and the extensions of images compressed next to their descriptor (e.g. GDI tracks).
+EXTENSIONS = ('.gz', '.xz', '.ecm', '.zip')
+COMPRESSED_EXTENSIONS = ('.gz', '.xz', '.ecm')
+
+INPUT_SIZE = 64 * 1024  # Compressed data fed to a decoder at a time.
+
+INDEX_VERSION = 1
+
+# Indexes of the archives opened by this process, by (path, member).
+_indexes = {}
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def is_archive(file_name):
+    path, member = split_path(file_name)
+
+    return member is not None or path.lower().endswith(EXTENSIONS)
+
+
+def find_file(file_name):
+    """
+    :return: name of the file to open for an image: the name itself, or that of the image compressed next to it
+    """
+    if not os.path.exists(file_name):
+        for extension in COMPRESSED_EXTENSIONS:
+            if os.path.isfile(file_name + extension):
+                return file_name + extension
+
+    return file_name
+
+
+def open_file(file_name, **kwargs):
+    """Open an image: an ArchiveFile if it is compressed or in an archive, a MmappedFile otherwise."""
+    file_name = find_file(file_name)
+
+    if is_archive(file_name):
+        path, member = split_path(file_name)
+        return ArchiveFile(path, member, **kwargs)
+
+    return MmappedFile(file_name, **kwargs)
+
+
+def file_size(file_name):
+    """:return: size of an image (once decompressed), see open_file()"""
+    file_name = find_file(file_name)
+
+    if not is_archive(file_name):
+        return os.path.getsize(file_name)
+
+    with open_file(file_name) as file:
+        return len(file)
+
+
+def main_member(infos):
+    """
+    The member of a zip file analyzed when the zip file is given: its only file, otherwise a GDI or CUE sheet (its
+    tracks being in the zip file too), otherwise the largest file.
+
+    :param infos: list of ZipInfo
+    :return: member name, or None if there are no files
+    """
+    files = [info for info in infos if not info.filename.endswith('/')]
+    if not files:
+        return None
+
+    for info in files:
+        if len(files) > 1 and info.filename.lower().endswith(('.gdi', '.cue')):
+            return info.filename
+
+    return max(files, key=lambda info: info.file_size).filename
+
+
+class ZlibDecoder:
+    """Decodes a deflate stream (a gzip member or a zip member) from a seek point or a snapshot."""
+
+    def __init__(self, data, offset, stop, wbits, decompressor=None):
+        """
+        :param data: the compressed file
+        :param offset: offset of the stream in data
+        :param stop: end of the compressed data
+        """
+        self.data = data
+        self.offset = offset
+        self.stop = stop
+        self.wbits = wbits
+        self.decompressor = decompressor or zlib.decompressobj(wbits)
+        self.tail = b''
+
+    def read(self, size):
+        """:return: up to size bytes of decompressed data, fewer only at the end of the stream"""
+        pieces = []
+        while size > 0 and not self.decompressor.eof:
+            if self.tail:
+                data = self.tail
+            elif self.offset < self.stop:
+                data = self.data.view(self.offset, min(self.offset + INPUT_SIZE, self.stop))
+                self.offset += len(data)
+            else:
+                raise ArchiveError('Truncated deflate stream')
+
+            try:
+                piece = self.decompressor.decompress(data, size)
+            except zlib.error as e:
+                raise ArchiveError('Corrupt deflate stream: {}'.format(e))
+
+            self.tail = self.decompressor.unconsumed_tail
+            pieces.append(piece)
+            size -= len(piece)
+
+        return b''.join(pieces)
+
+    @property
+    def eof(self):
+        return self.decompressor.eof
+
+    def end(self):
+        """:return: offset of the end of the stream, once it is decoded (e.g. the next gzip member)"""
+        return self.offset - len(self.decompressor.unused_data)
+
+    def snapshot(self):
+        """:return: a copy of this decoder, at its current position"""
+        decoder = ZlibDecoder(self.data, self.offset - len(self.tail), self.stop, self.wbits,
+                              self.decompressor.copy())
+
+        return decoder
+
+
+class XzDecoder:
+    """Decodes the blocks of an xz stream, from any block."""
+
+    def __init__(self, data, header, offset, stop):
+        """
+        :param header: offset of the stream header
+        :param offset: offset of the first block to decode
+        :param stop: end of the blocks (start of the stream index)
+        """
+        self.data = data
+        self.offset = offset
+        self.stop = stop
+        self.decompressor = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+        # The blocks are decoded as if they followed the stream header.
+        self.pending = data[header:header + 12]
+
+    def read(self, size):
+        pieces = []
+        while size > 0:
+            data = b''
+            if self.decompressor.needs_input:
+                if self.pending:
+                    data, self.pending = self.pending, b''
+                elif self.offset < self.stop:
+                    data = self.data.view(self.offset, min(self.offset + INPUT_SIZE, self.stop))
+                    self.offset += len(data)
+                else:
+                    break  # The index follows the blocks, the stream is done.
+
+            try:
+                piece = self.decompressor.decompress(data, size)
+            except lzma.LZMAError as e:
+                raise ArchiveError('Corrupt xz stream: {}'.format(e))
+
+            pieces.append(piece)
+            size -= len(piece)
+
+        return b''.join(pieces)
+
+    def snapshot(self):
+        return None  # LZMADecompressor can't be copied.
+
+
+def xz_streams(data):
+    """
+    Find the blocks of an xz file from the indexes of its streams, which are at their ends.
+
+    :param data: the xz file
+    :return: list of seek points (see ArchiveFile.index), and the size of the decompressed data
+    """
+    streams = []
+    position = len(data)
+    while position > 0:
+        # Streams may be followed by padding.
+        if data[position - 4:position] == b'\0\0\0\0':
+            position -= 4
+            continue
+
+        footer = data[position - 12:position]
+        if len(footer) != 12 or footer[10:12] != b'YZ':
+            raise ArchiveError('Invalid xz stream footer')
+
+        index_size = (struct.unpack('<I', footer[4:8])[0] + 1) * 4
+        index_start = position - 12 - index_size
+        index = data[index_start:index_start + index_size]
+        if index[:1] != b'\0' or zlib.crc32(index[:-4]) != struct.unpack('<I', index[-4:])[0]:
+            raise ArchiveError('Invalid xz index')
+
+        count, offset = read_varint(index, 1)
+        blocks = []
+        for _ in range(count):
+            unpadded_size, offset = read_varint(index, offset)
+            uncompressed_size, offset = read_varint(index, offset)
+            blocks.append(((unpadded_size + 3) // 4 * 4, uncompressed_size))
+
+        header = index_start - sum(size for size, _ in blocks) - 12
+        if header < 0 or data[header:header + 6] != XZ_MAGIC:
+            raise ArchiveError('Invalid xz stream header')
+
+        streams.append((header, index_start, blocks))
+        position = header
+
+    points = []
+    size = 0
+    for header, index_start, blocks in reversed(streams):
+        offset = header + 12
+        for compressed_size, uncompressed_size in blocks:
+            if uncompressed_size:
+                points.append([size, offset, index_start, header])
+
+            offset += compressed_size
+            size += uncompressed_size
+
+    return points, size
+
+
+def read_varint(data, offset):
+    """:return: (value of the xz variable-length integer at offset, offset after it)"""
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ArchiveError('Invalid xz index')
+
+        byte = data[offset]
+        value |= (byte & 0x7f) << shift
+        offset += 1
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+class ArchiveFile:
+    """
+    An image in a gzip, xz, zip or ECM file (see the module documentation). Reads, views and len() work as those of a
+    MmappedFile. Stored zip members are read from the zip file directly, nothing is decompressed or copied.
+    """
+
+    block_size = 2**20
+    cached_blocks = 16  # Blocks kept in memory.
+    snapshot_interval = 32 * 2**20
+
+    def __init__(self, file_name, member=None, **kwargs):
+        """
+        :param file_name: path of the compressed file
+        :param member: name of the image in a zip file (its main member if None, see main_member())
+        """
+        self.file = MmappedFile(file_name, **kwargs)
+        self.file_name = file_name
+        self.member = member
+        self.kwargs = kwargs
+
+        self.index = None
+        self.blocks = OrderedDict()  # Block number: decompressed data
+        self.snapshots = {}  # Snapshot interval number: (decompressed position, decoder)
+        self.decoder = None
+        self.point = None  # Seek point of the decoder.
+        self.position = 0  # Position of the decoder in the decompressed data.
+        self.lock = threading.Lock()
+
+    @property
+    def image_name(self):
+        """The name of the image itself, by which handlers know it, e.g. disc.iso for disc.iso.gz."""
+        if self.member is not None:
+            return self.file_name + '/' + self.member
+
+        root, extension = os.path.splitext(self.file_name)
+        if extension.lower() in COMPRESSED_EXTENSIONS:
+            return root
+
+        return self.file_name
+
+    def __enter__(self):
+        self.file.__enter__()
+
+        try:
+            self.index = self.load_index()
+        except (ArchiveError, ecm.EcmError) as e:
+            self.file.__exit__(None, None, None)
+            raise SystemExit('Could not open {}: {}'.format(self.file_name, e))
+
+        self.starts = [point[0] for point in self.index['points']]
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.blocks.clear()
+        self.snapshots.clear()
+        self.decoder = None
+
+        return self.file.__exit__(exc_type, exc_val, exc_tb)
+
+    def load_index(self):
+        """
+        :return: the index of the archive: a dict of format, size (of the image) and points, the seek points, as lists
+                 of (decompressed position, compressed offset, end of the compressed data, offset of the xz stream
+                 header or None), or as in ecm.index() for ECM files
+        """
+        header = self.file[0:6]
+        if header.startswith(ZIP_MAGIC):
+            return self.zip_index()  # Zip files have an index of their own.
+
+        key = (os.path.realpath(self.file_name), self.member)
+        state = cache.file_state(self.file_name)
+
+        index = _indexes.get(key)
+        if index is not None and index['file'] == state:
+            return index
+
+        index_path = None
+        if config.cache:
+            name = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+            index_path = os.path.join(config.cache_dir or cache.default_directory(), 'index', name + '.json')
+
+            try:
+                with open(index_path) as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = None
+
+        if index is None or index.get('file') != state or index.get('version') != INDEX_VERSION:
+            if header.startswith(GZIP_MAGIC):
+                index = self.gzip_index()
+            elif header.startswith(XZ_MAGIC):
+                points, size = xz_streams(self.file)
+                index = {'format': 'xz', 'size': size, 'points': points}
+            elif header.startswith(ecm.MAGIC):
+                points, size = ecm.index(self.file, self.block_size)
+                index = {'format': 'ecm', 'size': size, 'points': points}
+            else:
+                raise ArchiveError('Unknown compressed file format')
+
+            index.update(file=state, version=INDEX_VERSION)
+
+            if index_path is not None:
+                save_index(index_path, index)
+
+        _indexes[key] = index
+
+        return index
+
+    def gzip_index(self):
+        """Find the members of a gzip file, decompressing it (and taking snapshots along the way)."""
+        points = []
+        position = offset = 0
+        while self.file[offset:offset + 2] == GZIP_MAGIC:
+            points.append([position, offset, len(self.file), None])
+
+            decoder = ZlibDecoder(self.file, offset, len(self.file), 31)
+            while True:
+                data = decoder.read(self.block_size)
+                if not data:
+                    break
+
+                position += len(data)
+                self.take_snapshot(position, decoder)
+
+            offset = decoder.end()
+
+        if not points:
+            raise ArchiveError('Invalid gzip file')
+
+        return {'format': 'gzip', 'size': position, 'points': points}
+
+    def zip_index(self):
+        with zipfile.ZipFile(self.file_name) as archive:
+            if self.member is None:
+                self.member = main_member(archive.infolist())
+
+            try:
+                info = archive.getinfo(self.member or '')
+            except KeyError:
+                raise ArchiveError('No member {} in the zip file'.format(self.member))
+
+        if info.flag_bits & 0x1:
+            raise ArchiveError('Encrypted member: {}'.format(self.member))
+
+        if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise ArchiveError('Unsupported compression method of {}: {}'.format(self.member, info.compress_type))
+
+        # The data follows the local header, which has fields of its own.
+        local_header = self.file[info.header_offset:info.header_offset + 30]
+        if not local_header.startswith(ZIP_MAGIC):
+            raise ArchiveError('Invalid local header of {}'.format(self.member))
+
+        name_size, extra_size = struct.unpack('<HH', local_header[26:30])
+        offset = info.header_offset + 30 + name_size + extra_size
+
+        return {'format': 'stored' if info.compress_type == zipfile.ZIP_STORED else 'deflate',
+                'size': info.file_size,
+                'points': [[0, offset, offset + info.compress_size, None]]}
+
+    def new_decoder(self, point):
+        if self.index['format'] == 'ecm':
+            return ecm.EcmDecoder(self.file, *point[1:])
+
+        position, offset, stop, header = point
+        if self.index['format'] == 'xz':
+            return XzDecoder(self.file, header, offset, stop)
+
+        return ZlibDecoder(self.file, offset, stop, 31 if self.index['format'] == 'gzip' else -15)
+
+    def take_snapshot(self, position, decoder):
+        """Keep a copy of the decoder every snapshot_interval bytes, to decode from later."""
+        interval = position // self.snapshot_interval
+        if interval not in self.snapshots:
+            snapshot = decoder.snapshot()
+            if snapshot is not None:
+                self.snapshots[interval] = (position, snapshot)
+
+    def seek(self, position):
+        """Move the decoder to a position, from the nearest seek point or snapshot (or from where it is)."""
+        point = bisect_right(self.starts, position) - 1
+        start, decoder = self.starts[point], None
+
+        for interval in range(position // self.snapshot_interval, start // self.snapshot_interval - 1, -1):
+            snapshot_position, snapshot = self.snapshots.get(interval, (None, None))
+            if snapshot_position is not None and start < snapshot_position <= position:
+                start, decoder = snapshot_position, snapshot.snapshot()
+                break
+
+        if self.decoder is None or not start <= self.position <= position:
+            self.decoder = decoder or self.new_decoder(self.index['points'][point])
+            self.point = point
+            self.position = start
+
+        while self.position < position:
+            self.decode(min(self.block_size, position - self.position))
+
+    def decode(self, size):
+        """:return: the next size bytes of decompressed data (fewer at the end of the image)"""
+        pieces = []
+        while size > 0 and self.position < self.index['size']:
+            data = self.decoder.read(size)
+            if not data:
+                # The end of a gzip member or of an xz stream: the next one has a seek point.
+                point = bisect_right(self.starts, self.position) - 1
+                if self.starts[point] != self.position or point == self.point:
+                    raise ArchiveError('Unexpected end of data at {}'.format(self.position))
+
+                self.decoder = self.new_decoder(self.index['points'][point])
+                self.point = point
+                continue
+
+            pieces.append(data)
+            self.position += len(data)
+            size -= len(data)
+
+            self.take_snapshot(self.position, self.decoder)
+
+        data = b''.join(pieces)
+        if stats.enabled:
+            stats.count(decompressed_bytes=len(data))
+
+        return data
+
+    def block(self, number):
+        """:return: the decompressed data of a block"""
+        with self.lock:
+            data = self.blocks.get(number)
+            if data is not None:
+                self.blocks.move_to_end(number)
+                return data
+
+            self.seek(number * self.block_size)
+            data = self.decode(self.block_size)
+
+            self.blocks[number] = data
+            if len(self.blocks) > self.cached_blocks:
+                self.blocks.popitem(last=False)
+
+        return data
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = self.bounds(key.start, key.stop)
+            data = bytes(self.view(start, stop))
+
+            return data[::key.step] if key.step is not None else data
+
+        if not 0 <= key < len(self):
+            raise IndexError('index out of range')
+
+        return self.view(key, key + 1)[0]
+
+    def view(self, start, stop):
+        """Return a memoryview of the data between start and stop. It is only copied if it spans several blocks."""
+        start, stop = self.bounds(start, stop)
+        if start == stop:
+            return memoryview(b'')
+
+        if self.index['format'] == 'stored':
+            offset = self.index['points'][0][1]
+            return self.file.view(offset + start, offset + stop)
+
+        first, last = start // self.block_size, (stop - 1) // self.block_size
+        if first == last:
+            offset = first * self.block_size
+            return memoryview(self.block(first))[start - offset:stop - offset]
+
+        pieces = []
+        for number in range(first, last + 1):
+            offset = number * self.block_size
+            pieces.append(memoryview(self.block(number))[max(start - offset, 0):stop - offset])
+
+        return memoryview(b''.join(pieces))
+
+    def bounds(self, start, stop):
+        start = 0 if start is None else min(start, len(self))
+        stop = len(self) if stop is None else max(start, min(stop, len(self)))
+
+        return start, stop
+
+    @property
+    def random_access(self):
+        """
+        Whether any part of the image can be read without decoding much of the rest. Otherwise (a gzip file or a
+        deflated zip member) reading it again in another process would mean decoding it from the start again.
+        """
+        return self.index['format'] in ('stored', 'xz', 'ecm')
+
+    def open_args(self):
+        """Arguments for opening the same file again in another process (see reopen())."""
+        return ArchiveFile, (self.file_name, self.member), self.kwargs
+
+    def ranges(self):
+        yield 0, 0, len(self)
+
+    def __len__(self):
+        return self.index['size']
+
+
+def save_index(path, index):
+    """Save an index atomically, or not at all if the cache directory can't be written."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary_path, 'w') as f:
+            json.dump(index, f)
+
+        os.replace(temporary_path, path)
+    except OSError:
+        pass
@@ -0,0 +1,176 @@
+"""
+Analyze many images in one run, optionally several at once in worker processes.
+
+The output of each image is captured and written in one piece when the image is done, so that results never
+interleave. By default results are written in the order of the file names, as a sequential run would; they can also be
+written as soon as they are ready. A failure (unreadable file, bad image, handler bug) is reported and the batch goes
+on.
+"""
+import io
+import os
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import archive
+import cache
+import config
+from analyze import analyze_file
+from utils import redirect_output
+
+Result = namedtuple('Result', 'file_name size output error')
+
+# Options that worker processes need to analyze an image like the main process would.
+_worker_options = ('extract', 'output_format', 'skip_sector_errors', 'verify', 'hashes', 'sector_cache_size',
+                   'stats', 'cache', 'refresh', 'cache_dir', 'cache_size', 'cache_fingerprint',
+                   'checkpoint', 'checkpoint_interval', 'time_limit')
+
+
+def file_names():
+    """
+    The file names given on the command line, followed by the ones read from config.files_from, which is read lazily
+    so that a batch can start while the list is still being written.
+    """
+    yield from config.files
+
+    if config.files_from is None:
+        return
+
+    if config.files_from == '-':
+        yield from _read_file_names(sys.stdin)
+    else:
+        with open(config.files_from) as f:
+            yield from _read_file_names(f)
+
+
+def _read_file_names(f):
+    for line in f:
+        file_name = line.rstrip('\r\n')
+        if file_name.strip():
+            yield file_name
+
+
+def error_message(e):
+    if isinstance(e, SystemExit):
+        return str(e.code)
+
+    return '{}: {}'.format(type(e).__name__, e)
+
+
+def analyze(file_name, options=None):
+    """
+    Analyze an image, capturing its output. Errors are caught and returned, so that one bad image doesn't stop a batch.
+
+    :param options: dict of config values to use, when run in a worker process
+    :return: Result, with the total size of the files opened (e.g. the tracks of a GDI, or the archive of an image)
+    """
+    if options is not None:
+        for name, value in options.items():
+            setattr(config, name, value)
+
+        # The images are what runs in parallel, not their sector checks.
+        config.jobs = 1
+
+    output = io.StringIO()
+
+    try:
+        # Status lines are hidden, those of several images would garble each other and the error messages.
+        with redirect_output(output, io.StringIO()), cache.OpenedFiles() as opened_files:
+            with archive.open_file(file_name) as file:
+                analyze_file(file, file_name)
+
+        size = sum(os.path.getsize(path) for path in set(opened_files))
+    except KeyboardInterrupt:
+        raise
+    except (Exception, SystemExit) as e:
+        return Result(file_name, 0, output.getvalue(), error_message(e))
+
+    return Result(file_name, size, output.getvalue(), None)
+
+
+def analyze_files(file_names, jobs=1, ordered=True):
+    """
+    Analyze images, jobs at a time.
+
+    :param file_names: iterable of file names, consumed as the batch progresses
+    :param ordered: yield results in the order of file_names, otherwise as soon as they are ready
+    :return: generator of Result
+    """
+    if jobs <= 1:
+        for file_name in file_names:
+            yield analyze(file_name)
+
+        return
+
+    options = {name: getattr(config, name) for name in _worker_options}
+
+    # Keep a few images queued per worker, but don't submit the whole list: it can be long, or still being read.
+    window = 2 * jobs
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if ordered:
+            pending = deque()
+            for file_name in file_names:
+                pending.append((executor.submit(analyze, file_name, options), file_name))
+
+                if len(pending) >= window:
+                    yield _result(*pending.popleft())
+
+            while pending:
+                yield _result(*pending.popleft())
+
+        else:
+            pending = {}
+            for file_name in file_names:
+                pending[executor.submit(analyze, file_name, options)] = file_name
+
+                if len(pending) >= window:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield _result(future, pending.pop(future))
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield _result(future, pending.pop(future))
+
+
+def _result(future, file_name):
+    try:
+        return future.result()
+    except Exception as e:
+        # The worker itself failed (e.g. it was killed).
+        return Result(file_name, 0, '', error_message(e))
+
+
+def run(file_names, jobs=1, ordered=True):
+    """
+    Analyze images and write their results to stdout, errors and a throughput summary to stderr.
+
+    :return: number of images that failed
+    """
+    start = time.perf_counter()
+    n_images = n_failed = total_size = 0
+
+    for result in analyze_files(file_names, jobs=jobs, ordered=ordered):
+        n_images += 1
+
+        if result.error is None:
+            total_size += result.size
+            sys.stdout.write(result.output)
+            sys.stdout.flush()
+        else:
+            n_failed += 1
+            print('{}: {}'.format(result.file_name, result.error), file=sys.stderr)
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    megabytes = total_size / 2**20
+
+    summary = 'Analyzed {} images ({:.1f} MB) in {:.1f}s: {:.2f} images/s, {:.1f} MB/s'.format(
+        n_images, megabytes, elapsed, n_images / elapsed, megabytes / elapsed)
+    if n_failed:
+        summary += ', {} failed'.format(n_failed)
+
+    print(summary, file=sys.stderr)
+
+    return n_failed
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Count the bytes copied out of the image while analyzing it, with and without zero-copy views.
+
+Without views, every read of the image is a copy. With views (MmappedFile.view()), the sector checks, hashing and
+extraction work on the mapped pages directly and only small reads (headers, directories) are copied.
+
+Usage: benchmarks/bench_copies.py [IMAGE ...]  (data tracks or ISO images)
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyze import find_handler
+from utils import MmappedFile
+
+DEFAULT_IMAGE = 'tests/handlers/dreamcast/namco_museum/track01.bin'
+
+
+class CountingFile:
+    """Wrap a file, counting the bytes that are copied from it."""
+
+    def __init__(self, file):
+        self.file = file
+        self.copied = 0
+        self.viewed = 0
+
+    def __getitem__(self, key):
+        data = self.file[key]
+        self.copied += len(data)
+
+        return data
+
+    def ranges(self):
+        return self.file.ranges()
+
+    def __len__(self):
+        return len(self.file)
+
+
+class CountingViewFile(CountingFile):
+    def view(self, start, stop):
+        data = self.file.view(start, stop)
+        self.viewed += len(data)
+
+        return data
+
+
+def measure(file_name, file_class):
+    with MmappedFile(file_name) as mmapped_file:
+        file = file_class(mmapped_file)
+        handler = find_handler(file, file_name)
+        if handler is None:
+            raise SystemExit('Unknown file: {}'.format(file_name))
+
+        start = time.perf_counter()
+        with contextlib.redirect_stderr(io.StringIO()):  # Hide status lines.
+            handler.get_info()
+        elapsed = time.perf_counter() - start
+
+    return file.copied, file.viewed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('images', metavar='IMAGE', nargs='*', default=[DEFAULT_IMAGE])
+    args = parser.parse_args()
+
+    for file_name in args.images:
+        size = os.path.getsize(file_name)
+        print('{} ({:.1f} MB)'.format(file_name, size / 2**20))
+
+        for label, file_class in (('copies', CountingFile), ('views', CountingViewFile)):
+            copied, viewed, elapsed = measure(file_name, file_class)
+            print('  {:<6}  copied: {:>10} bytes ({:5.2f}x image)  viewed: {:>10} bytes  {:.2f}s'.format(
+                label, copied, copied / size, viewed, elapsed))
+
+
+if __name__ == '__main__':
+    main()
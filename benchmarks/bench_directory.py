@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Compare directory traversal speed and memory: decoding records field by field into a dict of dicts (unpack_record())
+vs with struct.Struct into a FileList table (decode_record(), as used by ISO9660Handler.files()).
+
+Usage: benchmarks/bench_directory.py [--files N] [IMAGE ...]  (data tracks or ISO images, default: synthetic tree)
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collections import OrderedDict
+
+from analyze import find_handler
+from benchmarks.synthetic import build_iso
+from handlers.iso9660 import FileList
+from utils import MmappedFile
+
+
+def unpacked_files(handler, sector=None, size=None, path=''):
+    """The directory traversal as it was before decode_record(): one unpack_record() call per record."""
+    offset = 0
+    if sector is None:
+        sector = handler.pvd_sector
+        offset = 156
+
+    else:
+        offset += handler.unpack_record(offset, sector)['record_size']
+        offset += handler.unpack_record(offset, sector)['record_size']
+
+    size_left = size
+    while size is None or offset < size_left:
+        record = handler.unpack_record(offset, sector)
+
+        if record['record_size'] == 0:
+            if size is not None:
+                size_left -= handler.data_size(sector)
+            offset = 0
+            sector += 1
+            continue
+
+        if sector != handler.pvd_sector:
+            record['path'] = path + '/' + record['name']
+        else:
+            record['path'] = path
+
+        yield record
+
+        if record['is_directory']:
+            yield from unpacked_files(handler, sector=record['sector'], size=record['size'], path=record['path'])
+
+        offset += record['record_size']
+
+        if sector == handler.pvd_sector:
+            break
+
+
+def unpacked_file_list(handler):
+    return OrderedDict((record['path'], record) for record in unpacked_files(handler) if record['name'] != '')
+
+
+def decoded_file_list(handler):
+    file_list = FileList()
+    for _ in handler.files(file_list):
+        pass
+
+    return file_list
+
+
+def measure(walk, handler):
+    """
+    :param walk: function returning the file list of the image
+    :return: (records, seconds, bytes of memory held per record)
+    """
+    start = time.perf_counter()
+    file_list = walk(handler)
+    elapsed = time.perf_counter() - start
+
+    # Measure memory in a second run, tracing slows it down.
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    traced = walk(handler)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return list(file_list.values()), elapsed, size / len(traced)
+
+
+def bench(file_name):
+    with MmappedFile(file_name) as file:
+        handler = find_handler(file, file_name)
+        if handler is None:
+            raise SystemExit('Unknown file: {}'.format(file_name))
+
+        # Normally found by get_info(), the first volume descriptor is the primary one on all common images.
+        handler.pvd_sector = 16
+
+        results = [('unpack_record',) + measure(unpacked_file_list, handler),
+                   ('decode_record',) + measure(decoded_file_list, handler)]
+        assert results[0][1] == results[1][1]
+
+    for label, records, elapsed, memory in results:
+        print('  {:<14} {:8.3f}s  {:>10.0f} entries/s  {:>6.0f} bytes/entry'.format(
+            label, elapsed, len(records) / elapsed, memory))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('images', metavar='IMAGE', nargs='*')
+    parser.add_argument('--files', type=int, default=50000, help='number of files in the synthetic tree')
+    args = parser.parse_args()
+
+    if args.images:
+        for file_name in args.images:
+            print(file_name)
+            bench(file_name)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, 'synthetic.iso')
+        with open(file_name, 'wb') as f:
+            f.write(build_iso(args.files))
+
+        print('synthetic tree, {} files'.format(args.files))
+        bench(file_name)
+
+
+if __name__ == '__main__':
+    main()
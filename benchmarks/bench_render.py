@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Compare text rendering of a large file list: building the text by string concatenation (pretty_print() as it was) vs
+writing it to the output stream (render.write_text()).
+
+Usage: benchmarks/bench_render.py [--files N]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collections import OrderedDict
+
+import config
+import render
+from handlers.iso9660 import FileList
+from utils import MultiHash
+
+
+def concatenated_text(obj, indent=0):
+    """The text renderer as it was before render.write_text()."""
+    padding = ' ' * indent * 2
+
+    if isinstance(obj, dict):
+        if obj.get('type', '') == 'file_list':
+            files = obj['value']
+
+            longest_path = max(len(file['path']) for file in files.values())
+            path_padding = min(40, longest_path + 1)
+
+            pretty = ''
+            for file in files.values():
+                digests = ''.join('{}: {}, '.format(name, file[name]) for name in config.hash_algorithms if name in file)
+                pretty += '{}{:<{}}({}, {}sector: {}, {} bytes)\n'.format(padding, file['path'], path_padding,
+                                                                          file['date'], digests,
+                                                                          file['sector'], file['size'])
+
+            return pretty
+
+        else:
+            pretty = ''
+            for key, value in obj.items():
+                pretty_value = concatenated_text(value, indent + 1)
+                if '\n' in pretty_value:
+                    pretty += '{}{}:\n{}\n'.format(padding, key, pretty_value)
+                else:
+                    pretty += '{}{}: {}\n'.format(padding, key, pretty_value.lstrip())
+
+            return pretty
+    else:
+        return '{}{}'.format(padding, obj)
+
+
+def synthetic_info(n_files, per_directory=100):
+    """Info of an image with n_files files, per_directory to a directory, with their CRC32 hashes."""
+    files = FileList()
+    date = FileList.pack_date(2017, 1, 14, 12, 30, 15)
+    root = files.add(-1, '', 18, 2048, 34, 2, date)
+
+    directory = None
+    for i in range(n_files):
+        if i % per_directory == 0:
+            directory = files.add(root, 'D{:05d}'.format(i // per_directory), 18, 2048, 40, 2, date)
+
+        index = files.add(directory, 'F{:06d}.BIN;1'.format(i), 100 + i, i, 46, 0, date)
+
+        digest = MultiHash(('crc32',))
+        digest.update(i.to_bytes(4, 'little'))
+        files.set_hashes(index, digest.hexdigests())
+
+    info = OrderedDict()
+    info['Volume'] = OrderedDict([('System', 'ROMINFO'), ('Name', 'SYNTHETIC')])
+    info['Files'] = {'type': 'file_list', 'value': files}
+
+    return info
+
+
+def measure(render_text, info):
+    """
+    :param render_text: function writing the text of info to a stream
+    :return: (text, seconds, peak memory in bytes)
+    """
+    out = io.StringIO()
+    start = time.perf_counter()
+    render_text(info, out)
+    elapsed = time.perf_counter() - start
+
+    # Measure memory in a second run, to a stream that doesn't keep the text, tracing slows it down.
+    with open(os.devnull, 'w') as devnull:
+        tracemalloc.start()
+        render_text(info, devnull)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return out.getvalue(), elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=200000, help='number of files in the file list')
+    args = parser.parse_args()
+
+    info = synthetic_info(args.files)
+    print('synthetic file list, {} files'.format(args.files))
+
+    results = [('concatenated',) + measure(lambda info, out: out.write(concatenated_text(info)), info),
+               ('write_text',) + measure(render.write_text, info)]
+    assert results[0][1] == results[1][1]
+
+    for label, text, elapsed, peak in results:
+        print('  {:<14} {:8.3f}s  {:>10.0f} entries/s  {:>8.1f} MB peak'.format(
+            label, elapsed, args.files / elapsed, peak / 2**20))
+
+
+if __name__ == '__main__':
+    main()
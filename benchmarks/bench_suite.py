@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Benchmark the stages of an analysis on synthetic images, and compare the results with a saved baseline.
+
+Images are generated with benchmarks/synthetic.py: a plain ISO image (iso), raw Mode 1 and Mode 2 images (mode1,
+mode2) and a Dreamcast GDI with a mixed-mode track 3+5 (gdi). The stages of the single-track images:
+
+- directory: directory traversal (ISO9660Handler.files()), in entries/s.
+- sectors: sector checks (find_sector_errors()), in sectors/s and MB/s of the image.
+- crc: hashing the files, without sector checks, in MB/s of the files.
+- extract: extracting the files, without sector checks, in MB/s of the files.
+- analyze: the whole analysis, as rominfo runs it, in sectors/s and MB/s of the image.
+
+Only the analyze stage runs on the GDI. Each stage runs in a new process, so that its peak RSS is its own. Mapped pages
+of the image count towards the RSS, so stages that read the whole image have a peak of at least the image size.
+
+Usage: benchmarks/bench_suite.py [--files N] [--file-size MIN[:MAX]] [--save BASELINE] [--compare BASELINE] ...
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import resource
+except ImportError:  # Not on Windows.
+    resource = None
+
+import config
+from analyze import find_handler
+from benchmarks.synthetic import build_gdi, build_iso, raw_image
+from handlers.iso9660 import FileList
+from utils import MmappedFile
+
+FORMATS = ('iso', 'mode1', 'mode2', 'gdi')
+STAGES = ('directory', 'sectors', 'crc', 'extract', 'analyze')
+
+# Metrics of a result, and whether more is better.
+METRICS = (('sectors/s', True), ('MB/s', True), ('entries/s', True), ('peak RSS MB', False))
+
+
+def peak_rss():
+    """Peak resident set size of this process and its children (e.g. sector check workers), in MB."""
+    if resource is None:
+        return None
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+def file_bytes(file_list):
+    return sum(entry['size'] for entry in file_list.values() if not entry['is_directory'])
+
+
+def run_stage(stage, file_name, jobs):
+    """
+    Run a stage on an image. Called in a new process.
+
+    :return: dict of seconds and the work done: entries, sectors and/or bytes
+    """
+    config.jobs = jobs
+    config.hashes = ('crc32',)
+    config.skip_sector_errors = stage != 'analyze'
+
+    extract_dir = None
+    if stage == 'extract':
+        extract_dir = tempfile.mkdtemp(dir=os.path.dirname(file_name))
+        config.extract = extract_dir
+
+    with MmappedFile(file_name) as file, contextlib.redirect_stderr(io.StringIO()):  # Hide status lines.
+        handler = find_handler(file, file_name)
+        if handler is None:
+            raise ValueError('Unknown file: {}'.format(file_name))
+
+        start = time.perf_counter()
+
+        if stage == 'directory':
+            # Normally found by get_info(), the synthetic images have their primary volume descriptor at sector 16.
+            handler.pvd_sector = 16
+            file_list = FileList()
+            for _ in handler.files(file_list):
+                pass
+
+            work = {'entries': len(file_list)}
+
+        elif stage == 'sectors':
+            errors = handler.find_sector_errors()
+            work = {'sectors': handler.sector_count(), 'bytes': len(file), 'errors': len(errors)}
+
+        elif stage in ('crc', 'extract'):
+            handler.get_info()
+            work = {'bytes': file_bytes(handler.info['Files']['value'])}
+
+        else:
+            handler.get_info()
+            if 'Tracks' in handler.info:
+                size = sum(os.path.getsize(os.path.join(os.path.dirname(file_name), track['file_name']))
+                           for track in handler.tracks)
+            else:
+                size = len(file)
+
+            # A GDI has no sector size of its own, its tracks have raw sectors.
+            work = {'sectors': size // getattr(handler, 'sector_size', 2352), 'bytes': size}
+
+        work['seconds'] = time.perf_counter() - start
+
+    if extract_dir is not None:
+        shutil.rmtree(extract_dir)
+
+    work['peak RSS MB'] = peak_rss()
+
+    return work
+
+
+def rates(work):
+    """Turn the work done in a stage into the reported metrics."""
+    result = {'seconds': work['seconds'], 'peak RSS MB': work['peak RSS MB']}
+    if 'sectors' in work:
+        result['sectors/s'] = work['sectors'] / work['seconds']
+    if 'bytes' in work:
+        result['MB/s'] = work['bytes'] / 2**20 / work['seconds']
+    if 'entries' in work:
+        result['entries/s'] = work['entries'] / work['seconds']
+
+    return result
+
+
+def generate(directory, image_format, args):
+    """
+    Write a synthetic image in the given format.
+
+    :return: (path of the image, sectors with injected errors)
+    """
+    rng = random.Random(args.seed)
+    file_size = tuple(args.file_size) if len(args.file_size) == 2 else args.file_size[0]
+
+    if image_format == 'gdi':
+        # Errors go in the files of track 3, past its system area and directories.
+        errors = sorted(rng.sample(range(64, 64 + args.files // 2), min(args.errors, args.files // 2)))
+        return build_gdi(directory, args.files, file_size, args.depth, args.per_directory, args.seed, errors), errors
+
+    data = build_iso(args.files, file_size, args.depth, args.per_directory, args.seed)
+    file_name = os.path.join(directory, 'synthetic.' + image_format)
+
+    errors = []
+    if image_format != 'iso':
+        errors = sorted(rng.sample(range(len(data) // 2048), min(args.errors, len(data) // 2048)))
+        data = raw_image(data, mode=1 if image_format == 'mode1' else 2, errors=errors)
+
+    with open(file_name, 'wb') as f:
+        f.write(data)
+
+    return file_name, errors
+
+
+def run(args):
+    """
+    :return: dict of 'format/stage': metrics
+    """
+    results = {}
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for image_format in args.formats:
+            format_directory = os.path.join(directory, image_format)
+            os.mkdir(format_directory)
+
+            start = time.perf_counter()
+            file_name, errors = generate(format_directory, image_format, args)
+            size = sum(os.path.getsize(os.path.join(format_directory, name)) for name in os.listdir(format_directory))
+            print('{}: {:.1f} MB, {} injected sector errors (generated in {:.1f}s)'.format(
+                image_format, size / 2**20, len(errors), time.perf_counter() - start))
+
+            for stage in args.stages:
+                if image_format == 'gdi' and stage != 'analyze':
+                    continue
+
+                # Best time of the repeats, each in a new process.
+                best = None
+                for _ in range(args.repeat):
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        work = executor.submit(run_stage, stage, file_name, args.jobs).result()
+
+                    if stage == 'sectors' and work['errors'] != len(errors):
+                        raise AssertionError('{}: found {} sector errors, expected {}'.format(
+                            image_format, work['errors'], len(errors)))
+
+                    if best is None or work['seconds'] < best['seconds']:
+                        best = work
+
+                results['{}/{}'.format(image_format, stage)] = rates(best)
+
+    return results
+
+
+def print_results(results, baseline=None, threshold=0.1):
+    """
+    Print the results, with their change from the baseline.
+
+    :param threshold: relative change beyond which a metric counts as a regression
+    :return: list of regressions, as (result, metric, change)
+    """
+    regressions = []
+
+    print('{:<18} {:>9} {:>14} {:>14} {:>14} {:>14}'.format('stage', 'seconds', *[name for name, _ in METRICS]))
+    for key, result in results.items():
+        columns = []
+        for name, more_is_better in METRICS:
+            value = result.get(name)
+            if value is None:
+                columns.append('-')
+                continue
+
+            column = '{:.1f}'.format(value)
+
+            old = (baseline or {}).get(key, {}).get(name)
+            if old:
+                change = value / old - 1
+                column += ' {:+.0%}'.format(change)
+
+                if (change < -threshold) if more_is_better else (change > threshold):
+                    regressions.append((key, name, change))
+                    column += '!'
+
+            columns.append(column)
+
+        print('{:<18} {:>9.3f} {:>14} {:>14} {:>14} {:>14}'.format(key, result['seconds'], *columns))
+
+    return regressions
+
+
+def sizes(value):
+    try:
+        return [int(size) for size in value.split(':', 1)]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid file size: {} (use SIZE or MIN:MAX)'.format(value))
+
+
+def names(choices):
+    def parse(value):
+        values = [name.strip() for name in value.split(',') if name.strip()]
+        for name in values:
+            if name not in choices:
+                raise argparse.ArgumentTypeError('unknown name: {} (choose from {})'.format(name, ', '.join(choices)))
+
+        return values
+
+    return parse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--formats', type=names(FORMATS), default=list(FORMATS), metavar='FORMATS',
+                        help='image formats, comma-separated (default: {})'.format(','.join(FORMATS)))
+    parser.add_argument('--stages', type=names(STAGES), default=list(STAGES), metavar='STAGES',
+                        help='stages, comma-separated (default: {})'.format(','.join(STAGES)))
+    parser.add_argument('--files', type=int, default=2000, metavar='N', help='number of files (default: 2000)')
+    parser.add_argument('--file-size', type=sizes, default=[0, 32768], metavar='MIN[:MAX]',
+                        help='file size, or random file sizes between MIN and MAX (default: 0:32768)')
+    parser.add_argument('--depth', type=int, default=2, metavar='N', help='levels of subdirectories (default: 2)')
+    parser.add_argument('--per-directory', type=int, default=100, metavar='N',
+                        help='entries per directory (default: 100)')
+    parser.add_argument('--errors', type=int, default=16, metavar='N',
+                        help='sector errors to inject into raw images (default: 16)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated images (default: 0)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N', help='worker processes (default: 1)')
+    parser.add_argument('--repeat', type=int, default=3, metavar='N',
+                        help='run each stage N times, keeping the best time (default: 3)')
+    parser.add_argument('--save', metavar='BASELINE', help='save the results as a baseline (JSON)')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare the results with a saved baseline, exit with status 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=10, metavar='PERCENT',
+                        help='change that counts as a regression when comparing (default: 10)')
+    args = parser.parse_args()
+
+    settings = {name: getattr(args, name) for name in ('files', 'file_size', 'depth', 'per_directory', 'errors', 'seed',
+                                                       'jobs')}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+
+        baseline = saved['results']
+        if saved['settings'] != settings:
+            print('Warning: the baseline was made with different settings: {}'.format(saved['settings']))
+
+    results = run(args)
+    print()
+    regressions = print_results(results, baseline, args.threshold / 100)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print()
+        for key, name, change in regressions:
+            print('Regression: {} {} {:+.0%}'.format(key, name, change))
+
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,419 @@
+"""
+Build synthetic disc images for benchmarks.
+
+The images are small but valid: an ISO 9660 file system with a configurable number of files, file sizes and
+directory depth, as a plain image (2048-byte sectors), as raw Mode 1 or Mode 2 sectors with valid EDC and ECC, or as a
+Dreamcast GDI with a mixed-mode high-density area. Sector errors can be injected into raw images, which can also be
+encoded as ECM files.
+"""
+import os
+import random
+import struct
+from datetime import datetime
+
+import edc_ecc
+
+SECTOR = 2048
+RAW_SECTOR = 2352
+
+SYNC = b'\x00' + b'\xff' * 10 + b'\x00'
+MODE2_FORM1_SUBHEADER = bytes([0, 0, 0x08, 0]) * 2
+
+# Start of the high-density area of a GD-ROM.
+HIGH_DENSITY_AREA = 45000
+
+DATE = datetime(2017, 1, 14, 12, 30, 15)
+
+
+def both_endian(fmt, value):
+    return struct.pack('<' + fmt, value) + struct.pack('>' + fmt, value)
+
+
+def record_date(date):
+    return bytes([date.year - 1900, date.month, date.day, date.hour, date.minute, date.second, 0])
+
+
+def volume_date(date):
+    return date.strftime('%Y%m%d%H%M%S00').encode('ascii') + b'\x00'
+
+
+def directory_record(name, sector, size, is_directory, date=DATE):
+    """Encode a directory record (http://wiki.osdev.org/ISO_9660#Directories)."""
+    padding = b'\x00' if len(name) % 2 == 0 else b''
+    record_size = 33 + len(name) + len(padding)
+
+    return (bytes([record_size, 0]) + both_endian('I', sector) + both_endian('I', size) + record_date(date) +
+            bytes([2 if is_directory else 0, 0, 0]) + both_endian('H', 1) + bytes([len(name)]) + name + padding)
+
+
+class Directory:
+    def __init__(self, name):
+        self.name = name
+        self.directories = []
+        self.files = []  # (name, (sector, size))
+
+        self.sector = None
+        self.size = None
+
+    def walk(self):
+        yield self
+        for directory in self.directories:
+            yield from directory.walk()
+
+
+def make_tree(n_files, depth=2, per_directory=100):
+    """
+    Spread n_files over a tree of directories, at most per_directory entries per directory and depth levels of
+    subdirectories.
+    """
+    root = Directory(b'\x00')
+    counter = [0]
+
+    def fill(directory, level, remaining):
+        if level == depth or remaining <= per_directory:
+            n = min(remaining, per_directory)
+            directory.files = [('F{:06d}.BIN;1'.format(counter[0] + i).encode('ascii'), None) for i in range(n)]
+            counter[0] += n
+            return n
+
+        filled = 0
+        for i in range(per_directory):
+            if filled == remaining:
+                break
+
+            subdirectory = Directory('D{:03d}'.format(i).encode('ascii'))
+            directory.directories.append(subdirectory)
+            filled += fill(subdirectory, level + 1, remaining - filled)
+
+        return filled
+
+    fill(root, 0, n_files)
+
+    return root
+
+
+def directory_records(directory, parent):
+    """Encode the records of a directory, including the self and parent records."""
+    records = [directory_record(b'\x00', directory.sector, directory.size, True),
+               directory_record(b'\x01', parent.sector, parent.size, True)]
+
+    entries = [(d.name, d.sector, d.size, True) for d in directory.directories]
+    entries += [(name, sector, size, False) for name, (sector, size) in directory.files]
+    entries.sort()
+
+    records += [directory_record(name, sector, size, is_directory) for name, sector, size, is_directory in entries]
+
+    return records
+
+
+def pack_records(records):
+    """Pack records into sectors, without letting a record cross a sector boundary."""
+    data = bytearray()
+    for record in records:
+        if len(data) % SECTOR + len(record) > SECTOR:
+            data += bytes(SECTOR - len(data) % SECTOR)
+
+        data += record
+
+    return bytes(data) + bytes(-len(data) % SECTOR)
+
+
+def primary_volume_descriptor(root, volume_sectors, name=b'SYNTHETIC'):
+    pvd = bytearray(SECTOR)
+    pvd[0:7] = b'\x01CD001\x01'
+    pvd[8:40] = b'ROMINFO'.ljust(32)
+    pvd[40:72] = name.ljust(32)
+    pvd[80:88] = both_endian('I', volume_sectors)
+    pvd[120:124] = both_endian('H', 1)
+    pvd[124:128] = both_endian('H', 1)
+    pvd[128:132] = both_endian('H', SECTOR)
+    pvd[156:190] = directory_record(b'\x00', root.sector, root.size, True)
+    pvd[190:318] = name.ljust(128)
+    pvd[318:446] = b'HIDDEN PALACE'.ljust(128)
+    pvd[446:574] = b'ROMINFO SYNTHETIC'.ljust(128)
+    pvd[574:702] = b'ROMINFO'.ljust(128)
+    pvd[813:830] = volume_date(DATE)
+    pvd[830:847] = volume_date(DATE)
+    pvd[847:864] = b'0000000000000000\x00'
+    pvd[864:881] = volume_date(DATE)
+    pvd[881] = 1
+
+    return bytes(pvd)
+
+
+def build_iso(n_files, file_size=0, depth=2, per_directory=100, seed=0, header=b'', sector_base=0, gap=None):
+    """
+    Build an ISO 9660 image (2048-byte sectors).
+
+    :param file_size: size of each file, or a (minimum, maximum) tuple for random sizes
+    :param header: data of the system area (sectors 0-15), e.g. a Dreamcast header
+    :param sector_base: sector number of the first sector of the image, added to the sectors in the records (the
+                        sector of its track on a multi-track disc)
+    :param gap: (files, sectors): leave a gap of sectors after the first files, e.g. for the other tracks between the
+                two data tracks of a GD-ROM's high-density area
+    :return: image data, or with a gap, (image data before the gap, image data after the gap)
+    """
+    rng = random.Random(seed)
+    root = make_tree(n_files, depth, per_directory)
+    directories = list(root.walk())
+
+    # The size of a directory extent only depends on the names in it, so lay out the directories first.
+    sector = 18
+    for directory in directories:
+        directory.sector, directory.size = 0, 0
+        directory.files = [(name, (0, 0)) for name, _ in directory.files]
+
+    parents = {}
+    for directory in directories:
+        for subdirectory in directory.directories:
+            parents[subdirectory] = directory
+
+    for directory in directories:
+        directory.size = len(pack_records(directory_records(directory, parents.get(directory, directory))))
+        directory.sector = sector_base + sector
+        sector += directory.size // SECTOR
+
+    # Then the files.
+    contents = []
+    gap_sector = None
+    for directory in directories:
+        files = []
+        for name, _ in directory.files:
+            if isinstance(file_size, tuple):
+                size = rng.randint(*file_size)
+            else:
+                size = file_size
+
+            if gap is not None and len(contents) == gap[0]:
+                gap_sector = sector
+                sector += gap[1]
+
+            files.append((name, (sector_base + sector, size)))
+            contents.append((sector, rng.getrandbits(8 * size).to_bytes(size, 'little') if size else b''))
+            sector += -(-size // SECTOR)
+
+        directory.files = files
+
+    image = bytearray()
+    image += header + bytes(16 * SECTOR - len(header))
+    image += primary_volume_descriptor(root, sector)
+    image += b'\xffCD001\x01'.ljust(SECTOR, b'\x00')
+
+    for directory in directories:
+        image += pack_records(directory_records(directory, parents.get(directory, directory)))
+
+    if gap is None:
+        for _, data in contents:
+            image += data + bytes(-len(data) % SECTOR)
+
+        return bytes(image)
+
+    # The files after the gap go to the second part.
+    parts = [image, bytearray()]
+    for file_sector, data in contents:
+        part = parts[gap_sector is not None and file_sector >= gap_sector]
+        part += data + bytes(-len(data) % SECTOR)
+
+    return bytes(parts[0]), bytes(parts[1])
+
+
+def raw_image(data, mode=1, first_sector=0, errors=(), batch=1024):
+    """
+    Convert an image of 2048-byte sectors to raw 2352-byte sectors, in Mode 1 or Mode 2 Form 1, with valid EDC and ECC.
+
+    :param first_sector: address of the first sector (the sector of its track)
+    :param errors: indexes of sectors to corrupt. Their stored EDC is changed, which makes all three checks fail but
+                   leaves the user data (and so the file system) intact.
+    :return: raw image data
+    """
+    count = len(data) // SECTOR
+    data_offset = 0x10 if mode == 1 else 0x18
+    edc_offset = data_offset + SECTOR
+
+    image = bytearray()
+    for start in range(0, count, batch):
+        n = min(batch, count - start)
+        buf = bytearray(n * RAW_SECTOR)
+
+        for i in range(n):
+            offset = i * RAW_SECTOR
+            buf[offset:offset + 12] = SYNC
+            buf[offset + 12:offset + 15] = address(first_sector + start + i)
+            buf[offset + 15] = mode
+            if mode == 2:
+                buf[offset + 0x10:offset + 0x18] = MODE2_FORM1_SUBHEADER
+            buf[offset + data_offset:offset + edc_offset] = data[(start + i) * SECTOR:(start + i + 1) * SECTOR]
+
+        edc_ecc.encode(buf, n, mode)
+        image += buf
+
+    for sector in errors:
+        image[sector * RAW_SECTOR + edc_offset] ^= 0x01
+
+    return bytes(image)
+
+
+def ecm_image(image, batch=1024):
+    """
+    Encode a raw image as an ECM file, as ecm by Neill Corlett does: the codes of sectors with valid codes are left
+    out, other sectors are stored as they are. The sync pattern and header of Mode 2 sectors are stored as they are too.
+
+    :return: ECM file data
+    """
+    records = []  # [type, count, stored data]
+
+    def add(record_type, stored):
+        if records and records[-1][0] == record_type:
+            records[-1][1] += 1 if record_type else len(stored)
+            records[-1][2].append(stored)
+        else:
+            records.append([record_type, 1 if record_type else len(stored), [stored]])
+
+    count = len(image) // RAW_SECTOR
+    for start in range(0, count, batch):
+        n = min(batch, count - start)
+        sectors = image[start * RAW_SECTOR:(start + n) * RAW_SECTOR]
+
+        # The codes that the sectors would have, in each mode and form.
+        encoded = {}
+        for mode, form in ((1, 1), (2, 1), (2, 2)):
+            encoded[mode, form] = bytearray(sectors)
+            edc_ecc.encode(encoded[mode, form], n, mode, form)
+
+        for i in range(n):
+            sector = sectors[i * RAW_SECTOR:(i + 1) * RAW_SECTOR]
+            form = 2 if sector[0x12] & 0x20 else 1
+
+            if sector[:12] == SYNC and sector[15] == 1 and sector[0x814:0x81c] == bytes(8) and \
+                    encoded[1, 1][i * RAW_SECTOR:(i + 1) * RAW_SECTOR] == sector:
+                add(1, sector[0x0c:0x0f] + sector[0x10:0x810])
+            elif sector[0x10:0x14] == sector[0x14:0x18] and \
+                    encoded[2, form][i * RAW_SECTOR:(i + 1) * RAW_SECTOR] == sector:
+                add(0, sector[:0x10])
+                add(1 + form, sector[0x14:0x818 if form == 1 else 0x92c])
+            else:
+                add(0, sector)
+
+    if len(image) > count * RAW_SECTOR:
+        add(0, image[count * RAW_SECTOR:])
+
+    data = bytearray(b'ECM\x00')
+    for record_type, record_count, stored in records:
+        number = record_count - 1
+        data.append((0x80 if number >> 5 else 0) | (number & 0x1f) << 2 | record_type)
+        number >>= 5
+        while number:
+            data.append((0x80 if number >> 7 else 0) | number & 0x7f)
+            number >>= 7
+
+        data += b''.join(stored)
+
+    # The end of the records, and the EDC of the whole image.
+    data += bytes([0xfc, 0xff, 0xff, 0xff, 0x3f])
+    data += struct.pack('<I', ecm_checksum(image))
+
+    return bytes(data)
+
+
+def ecm_checksum(image):
+    """
+    The EDC of a whole image, as at the end of an ECM file. It is computed from the EDC of every 2352 bytes (computed
+    in batches), since the EDC of two pieces of data is that of the first one shifted by the size of the second one,
+    xor that of the second one.
+    """
+    def update(crc, data):
+        for byte in data:
+            crc = (crc >> 8) ^ edc_ecc.EDC_TABLE[(crc ^ byte) & 0xff]
+        return crc
+
+    # The EDC of a single bit, shifted by a sector of zeros, and of each byte of the CRC, by combining those.
+    bits = [update(1 << bit, bytes(RAW_SECTOR)) for bit in range(32)]
+    shift = [[0] * 256 for _ in range(4)]
+    for lane in range(4):
+        for value in range(256):
+            for bit in range(8):
+                if value >> bit & 1:
+                    shift[lane][value] ^= bits[lane * 8 + bit]
+
+    crc = 0
+    count = len(image) // RAW_SECTOR
+    for start in range(0, count, 1024):
+        n = min(1024, count - start)
+        for value in edc_ecc.edc(image[start * RAW_SECTOR:(start + n) * RAW_SECTOR], n, 0, RAW_SECTOR):
+            crc = shift[0][crc & 0xff] ^ shift[1][crc >> 8 & 0xff] ^ shift[2][crc >> 16 & 0xff] ^ \
+                  shift[3][crc >> 24] ^ value
+
+    return update(crc, image[count * RAW_SECTOR:])
+
+
+def address(sector):
+    """Encode the address of a sector as BCD minutes, seconds and frames (with the 2-second lead-in)."""
+    minutes, frames = divmod(sector + 150, 60 * 75)
+    seconds, frames = divmod(frames, 75)
+
+    return bytes((value // 10) << 4 | value % 10 for value in (minutes, seconds, frames))
+
+
+def dreamcast_header(name=b'SYNTHETIC'):
+    """The start of a Dreamcast system area (IP.BIN), as read by DCDataTrackHandler."""
+    header = bytearray(b' ' * 0x100)
+    header[0x00:0x10] = b'SEGA SEGAKATANA '
+    header[0x10:0x20] = b'SEGA ENTERPRISES'
+    header[0x20:0x24] = b'0000'
+    header[0x25:0x2e] = b'GD-ROM1/1'
+    header[0x30:0x33] = b'JUE'
+    header[0x38:0x3f] = b'0000000'
+    header[0x40:0x4a] = b'T0000N    '
+    header[0x4a:0x50] = b'V1.000'
+    header[0x50:0x58] = DATE.strftime('%Y%m%d').encode('ascii')
+    header[0x60:0x6c] = b'1ST_READ.BIN'
+    header[0x70:0x7d] = b'HIDDEN PALACE'
+    header[0x80:0x80 + len(name)] = name
+
+    return bytes(header)
+
+
+def build_gdi(directory, n_files, file_size=0, depth=2, per_directory=100, seed=0, errors=(), audio_sectors=300):
+    """
+    Write a Dreamcast GDI and its tracks: a data track 1 with a few files, an audio track 2, and the high-density
+    area, with its file system spread over data track 3 and data track 5 (mixed mode) around an audio track 4.
+
+    :param errors: sectors of the high-density area to corrupt, counted from the start of track 3 (as the errors of
+                   track 3+5 are reported)
+    :return: path of the GDI file
+    """
+    rng = random.Random(seed)
+    header = dreamcast_header()
+
+    track1 = build_iso(4, 2048, seed=seed, header=header)
+    track3, track5 = build_iso(n_files, file_size, depth, per_directory, seed, header=header,
+                               sector_base=HIGH_DENSITY_AREA, gap=(n_files // 2, audio_sectors))
+
+    track3_sectors = len(track3) // SECTOR
+    tracks = [(len(track1) // SECTOR + 150, 0, 'track02.raw', None),
+              (HIGH_DENSITY_AREA, 4, 'track03.bin', track3),
+              (HIGH_DENSITY_AREA + track3_sectors, 0, 'track04.raw', None),
+              (HIGH_DENSITY_AREA + track3_sectors + audio_sectors, 4, 'track05.bin', track5)]
+
+    lines = ['1 0 4 {} track01.bin 0'.format(RAW_SECTOR)]
+    with open(os.path.join(directory, 'track01.bin'), 'wb') as f:
+        f.write(raw_image(track1))
+
+    for index, (sector, track_type, file_name, data) in enumerate(tracks, 2):
+        lines.append('{} {} {} {} {} 0'.format(index, sector, track_type, RAW_SECTOR, file_name))
+
+        with open(os.path.join(directory, file_name), 'wb') as f:
+            if data is None:
+                f.write(rng.getrandbits(8 * RAW_SECTOR * audio_sectors).to_bytes(RAW_SECTOR * audio_sectors, 'little'))
+                continue
+
+            first = sector - HIGH_DENSITY_AREA
+            track_errors = [error - first for error in errors if 0 <= error - first < len(data) // SECTOR]
+
+            f.write(raw_image(data, first_sector=sector, errors=track_errors))
+
+    file_name = os.path.join(directory, 'disc.gdi')
+    with open(file_name, 'w') as f:
+        f.write('\n'.join([str(len(lines))] + lines) + '\n')
+
+    return file_name
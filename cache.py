@@ -0,0 +1,193 @@
+"""
+On-disk cache of analysis results (handler.info), so that re-running over an unchanged archive skips straight to output.
+
+Results are stored in an SQLite database, keyed by the image path and the options that change the result (sector
+checks, hashes). A result is only used if every file read to produce it (e.g. the tracks of a GDI) still has the same
+size and modification time, optionally the same content fingerprint, and if it was made by the same version of the
+code. The least recently used results are evicted when the cache grows beyond its size limit.
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+import zlib
+import config
+import utils
+
+FINGERPRINT_SIZE = 64 * 2352  # Read at the start and at the end of each file.
+
+_version = None
+
+
+def version():
+    """The version of the code: a hash of its source files, so that any change invalidates the cache."""
+    global _version
+
+    if _version is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha1()
+        for path in sorted(glob.glob(os.path.join(root, '*.py')) + glob.glob(os.path.join(root, 'handlers', '*.py'))):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+
+        _version = digest.hexdigest()
+
+    return _version
+
+
+def default_directory():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'rominfo')
+
+
+def fingerprint(path):
+    """Hash of the first and last sectors of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_SIZE))
+
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - FINGERPRINT_SIZE, 0))
+        digest.update(f.read(FINGERPRINT_SIZE))
+
+    return digest.hexdigest()
+
+
+def file_state(path, with_fingerprint=False):
+    """
+    :return: [size, modification time, fingerprint (or None)], or None if the file can't be read
+    """
+    try:
+        stat = os.stat(path)
+
+        return [stat.st_size, stat.st_mtime_ns, fingerprint(path) if with_fingerprint else None]
+    except OSError:
+        return None
+
+
+class ResultCache:
+    def __init__(self, directory=None, max_size=1024 * 2**20, with_fingerprint=False):
+        """
+        :param max_size: size limit of the stored results, in bytes
+        :param with_fingerprint: also check the content fingerprint of files, not just their size and modification time
+        """
+        directory = directory or default_directory()
+        os.makedirs(directory, exist_ok=True)
+
+        self.max_size = max_size
+        self.with_fingerprint = with_fingerprint
+
+        # Batch workers share the database, wait for each other's writes.
+        self.db = sqlite3.connect(os.path.join(directory, 'cache.sqlite'), timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version TEXT, files TEXT, '
+                        'info BLOB, size INTEGER, accessed REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def key(file_name):
+        """The image path and the options that change its result."""
+        path, member = utils.split_path(file_name)
+        path = os.path.realpath(path)
+        if member is not None:
+            path += '/' + member  # An image in a zip file (see archive.ArchiveFile).
+
+        return json.dumps([path, config.skip_sector_errors, config.verify, config.hashes])
+
+    def get(self, file_name):
+        """
+        :return: cached info of the image, or None
+        """
+        key = self.key(file_name)
+        row = self.db.execute('SELECT version, files, info FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        stored_version, files, info = row
+        if stored_version != version():
+            return None
+
+        for path, state in json.loads(files):
+            if file_state(path, self.with_fingerprint or state[2] is not None) != state:
+                return None
+
+        with self.db:
+            self.db.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+
+        return pickle.loads(zlib.decompress(info))
+
+    def put(self, file_name, info, files):
+        """
+        :param files: paths of the files that were read to produce info
+        """
+        # The file on disk, e.g. the zip file of game.zip/disc.gdi.
+        image_path = utils.split_path(file_name)[0]
+
+        states = []
+        for path in [image_path] + [path for path in files if path != image_path]:
+            state = file_state(path, self.with_fingerprint)
+            if state is None:
+                return
+
+            states.append([os.path.realpath(path), state])
+
+        data = zlib.compress(pickle.dumps(info, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        if len(data) > self.max_size:
+            return
+
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                            (self.key(file_name), version(), json.dumps(states), data, len(data), time.time()))
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used results until the cache fits in max_size."""
+        total, = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()
+        if total <= self.max_size:
+            return
+
+        for key, size in self.db.execute('SELECT key, size FROM results ORDER BY accessed').fetchall():
+            self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_size:
+                break
+
+
+def open_cache():
+    """
+    :return: the ResultCache configured by the options, or None if caching is off (results of extraction runs aren't
+             cached either, the files have to be written)
+    """
+    if not config.cache or config.extract is not None:
+        return None
+
+    return ResultCache(config.cache_dir, max_size=config.cache_size * 2**20, with_fingerprint=config.cache_fingerprint)
+
+
+class OpenedFiles:
+    """Context manager recording the paths of the files opened (with MmappedFile) within it."""
+
+    def __enter__(self):
+        self.previous = utils.opened_files
+        self.paths = utils.opened_files = []
+
+        return self.paths
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        utils.opened_files = self.previous
+
+        # The files are also opened within an enclosing context.
+        if self.previous is not None:
+            self.previous.extend(self.paths)
@@ -12,19 +12,121 @@ class TerseHelpFormatter(argparse.HelpFormatter):
 
         return '{} {}'.format(', '.join(action.option_strings), args_string)
 
-output_formats = ('text', 'wiki', 'json')
+output_formats = ('text', 'wiki', 'json', 'ndjson')
+hash_algorithms = ('crc32', 'md5', 'sha1')
+
+# Defaults for when the handlers are used without parse_args() (e.g. from tests).
+files = []
+files_from = None
+unordered = False
+extract = None
+output_format = 'text'
+skip_sector_errors = False
+jobs = 1
+hashes = None
+cache = False
+refresh = False
+cache_dir = None
+cache_size = 1024
+cache_fingerprint = False
+checkpoint = False
+checkpoint_interval = 60
+time_limit = None
+verify = None
+sector_cache_size = 256
+stats = False
+
+
+def hash_list(value):
+    names = [name.strip().lower() for name in value.split(',') if name.strip()]
+
+    for name in names:
+        if name not in hash_algorithms:
+            raise argparse.ArgumentTypeError('unknown hash: {} (choose from {})'.format(name, ', '.join(hash_algorithms)))
+
+    return names
+
+
+def verify_mode(value):
+    """
+    Parse a --verify value: full, or sample:N[:SEED].
+
+    :return: None for full verification, (N, SEED) for sampled verification
+    """
+    if value == 'full':
+        return None
+
+    parts = value.split(':')
+    try:
+        if parts[0] != 'sample' or len(parts) not in (2, 3):
+            raise ValueError
+
+        n = int(parts[1])
+        seed = int(parts[2]) if len(parts) == 3 else 0
+        if n < 0:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid verification mode: {} (use full or sample:N[:SEED])'.format(value))
+
+    return n, seed
 
 
 def parse_args(args=None):
     parser = argparse.ArgumentParser(formatter_class=TerseHelpFormatter)
 
-    parser.add_argument('files', metavar='FILE', nargs='+', help='ROMs, discs, etc.')
+    parser.add_argument('files', metavar='FILE', nargs='*', help='ROMs, discs, etc.')
+    parser.add_argument('--files-from', action='store', metavar='LIST',
+                        help='also analyze the files listed in LIST, one per line (- for standard input)')
 
     parser.add_argument('-x', '--extract', action='store', help='extract files from disc data tracks', metavar='DIR')
     parser.add_argument('-f', '--format', action='store', default='text', choices=output_formats, metavar='FORMAT',
-                        help='use output format: text (default), wiki, json', dest='output_format')
+                        help='use output format: text (default), wiki, json, ndjson (JSON events, streamed)',
+                        dest='output_format')
 
     parser.add_argument('--skip-sector-errors', action='store_true', help='skip sector error checks')  # TODO temporary
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=1, metavar='N',
+                        help='use N worker processes: to analyze several files at once, '
+                             'or to check the sectors of a single file')
+    parser.add_argument('--unordered', action='store_true',
+                        help='when analyzing several files, print results as soon as they are ready')
+    parser.add_argument('--verify', action='store', type=verify_mode, metavar='MODE',
+                        help='check all sectors (full, default), or a random sample of N sectors plus the system area, '
+                             'directories and file boundaries (sample:N[:SEED]), checking all if errors are found')
+    parser.add_argument('--sector-cache', action='store', type=int, default=256, metavar='N',
+                        dest='sector_cache_size',
+                        help='keep N sectors in memory while reading metadata (default 256, 0 to disable)')
+    parser.add_argument('--stats', action='store_true',
+                        help='after the output, write the time, bytes read and sectors visited in each stage of the '
+                             'analysis (as JSON)')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='save the progress of sector checks to FILE.rominfo-checkpoint, and resume from it')
+    parser.add_argument('--checkpoint-interval', action='store', type=float, default=60, metavar='SECONDS',
+                        help='save the progress every SECONDS seconds (default: 60)')
+    parser.add_argument('--time-limit', action='store', type=float, metavar='SECONDS',
+                        help='stop sector checks after SECONDS seconds, to be resumed by the next run '
+                             '(implies --checkpoint)')
+    parser.add_argument('--hash', action='store', type=hash_list, metavar='HASHES', dest='hashes',
+                        help='compute these hashes of files and tracks: crc32, md5, sha1 (comma-separated)')
 
+    parser.add_argument('--no-cache', action='store_false', dest='cache',
+                        help="don't read or write the result cache")
+    parser.add_argument('--refresh', action='store_true', help='analyze again, replacing cached results')
+    parser.add_argument('--cache-dir', action='store', metavar='DIR',
+                        help='keep the result cache in DIR (default: ~/.cache/rominfo)')
+    parser.add_argument('--cache-size', action='store', type=int, default=1024, metavar='MB',
+                        help='evict the least recently used results beyond MB megabytes (default: 1024)')
+    parser.add_argument('--cache-fingerprint', action='store_true',
+                        help='also check the first and last sectors of files before using cached results, '
+                             'not just their size and modification time')
+
+    # Parse into a new namespace: argparse doesn't apply defaults to attributes that the namespace already has, and
+    # the module has defaults of its own.
     current_module = sys.modules[__name__]
-    parser.parse_args(namespace=current_module, args=args)
+    for name, value in vars(parser.parse_args(args=args)).items():
+        setattr(current_module, name, value)
+
+    if time_limit is not None:
+        current_module.checkpoint = True
+
+    if not files and files_from is None:
+        parser.error('the following arguments are required: FILE')
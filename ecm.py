@@ -0,0 +1,233 @@
+"""
+Decoding of ECM files (Error Code Modeler, .ecm), on the fly.
+
+ECM shrinks raw CD images by leaving out what can be computed again: the sync pattern, the mode byte, and the EDC and
+ECC of the sectors that had valid codes. The file is a sequence of records, each holding count items of one type:
+
+- 0: bytes, stored as they are (including sectors with invalid codes)
+- 1: Mode 1 sectors (2352 bytes), stored as their address and user data
+- 2: Mode 2 Form 1 sectors without their sync pattern and header (2336 bytes), stored as their subheader and user data
+- 3: Mode 2 Form 2 sectors, likewise
+
+Every item of a record has the same size, so that decoding can start at any item, given its offset in the file (see
+index()). The codes of the sectors are generated a batch at a time with edc_ecc.encode().
+
+Format reference: ecm.c and unecm.c by Neill Corlett
+"""
+from collections import deque
+import edc_ecc
+
+MAGIC = b'ECM\x00'
+
+SECTOR_SIZE = 2352
+
+# Size of an item of each record type, as stored and as decoded.
+STORED_SIZES = (1, 3 + 0x800, 0x804, 0x918)
+DECODED_SIZES = (1, SECTOR_SIZE, 0x920, 0x920)
+
+LITERAL_SIZE = 2**20  # Stored bytes decoded at a time.
+
+# Sectors as generated, before their stored parts are filled in: Mode 1 sectors have a sync pattern and a mode byte.
+_MODE1_SECTOR = b'\x00' + b'\xff' * 10 + b'\x00' + bytes(3) + b'\x01' + bytes(SECTOR_SIZE - 16)
+_MODE2_SECTOR = bytes(SECTOR_SIZE)
+
+
+class EcmError(ValueError):
+    pass
+
+
+def read_record(data, offset):
+    """
+    Read the header of a record.
+
+    :param data: the ECM file
+    :return: (type, count, offset of its items), or (None, None, offset of the checksum) at the end of the records
+    """
+    header = data[offset:offset + 5]  # The count takes up to 32 bits, in up to 5 bytes.
+    for size in range(1, len(header) + 1):
+        if not header[size - 1] & 0x80:
+            break
+    else:
+        raise EcmError('Invalid record header at {}'.format(offset))
+
+    number = (header[0] >> 2) & 0x1f
+    for i in range(1, size):
+        number |= (header[i] & 0x7f) << (5 + 7 * (i - 1))
+
+    if number == 0xffffffff:
+        return None, None, offset + size
+
+    return header[0] & 3, number + 1, offset + size
+
+
+def index(data, interval):
+    """
+    Find the seek points of an ECM file, about every interval bytes of decoded data. Only the record headers are read.
+
+    :param data: the ECM file
+    :return: (list of seek points: lists of (decoded position, offset in the file, record type, items left in the
+             record), size of the decoded data)
+    """
+    if data[0:4] != MAGIC:
+        raise EcmError('Not an ECM file')
+
+    points = []
+    position = 0
+    offset = 4
+    next_point = 0
+    while True:
+        type, count, offset = read_record(data, offset)
+        if type is None:
+            break
+
+        stored_size, decoded_size = STORED_SIZES[type], DECODED_SIZES[type]
+        stop = position + count * decoded_size
+
+        while next_point < stop:
+            # The first item starting at or after the point.
+            item = max(0, -(-(next_point - position) // decoded_size))
+            if item >= count:
+                break
+
+            points.append([position + item * decoded_size, offset + item * stored_size, type, count - item])
+            next_point = position + item * decoded_size + interval
+
+        position = stop
+        offset += count * stored_size
+
+    if offset + 4 > len(data):
+        raise EcmError('Truncated ECM file')
+
+    return points, position
+
+
+class EcmDecoder:
+    """
+    Decodes an ECM file from a seek point (see index()). Sectors are decoded batch_size at a time, and their data is
+    returned as views of the file and of the generated sectors, so the stored data is only copied once.
+    """
+
+    batch_size = 1024  # As in find_sector_errors().
+
+    def __init__(self, data, offset, type=None, count=0):
+        """
+        :param data: the ECM file
+        :param offset: offset of an item (or of a record header, if count is 0)
+        :param type: type of the record of the item
+        :param count: items left in the record, from the item on
+        """
+        self.data = data
+        self.offset = offset
+        self.type = type
+        self.count = count
+        self.pending = deque()  # Decoded data not read yet.
+        self.end = False
+
+    def read(self, size):
+        """:return: up to size bytes of decoded data, fewer only at the end"""
+        pieces = []
+        while size > 0:
+            if not self.pending:
+                if self.end:
+                    break
+
+                self.pending.extend(self.decode())
+                continue
+
+            piece = self.pending.popleft()
+            if len(piece) > size:
+                self.pending.appendleft(piece[size:])
+                piece = piece[:size]
+
+            pieces.append(piece)
+            size -= len(piece)
+
+        return b''.join(pieces)
+
+    def decode(self):
+        """
+        Decode the next batch of items: up to batch_size sectors (of any records), or LITERAL_SIZE stored bytes.
+
+        :return: list of memoryviews of the decoded data, in order
+        """
+        layout = []  # Stored bytes (memoryviews) and runs of sectors, as (type, first sector, count).
+        sectors = ([], [], [], [])  # Stored data of the sectors to generate, by type.
+        batch = 0
+        while batch < self.batch_size:
+            if not self.count:
+                self.type, self.count, self.offset = read_record(self.data, self.offset)
+                if self.type is None:
+                    self.end = True
+                    break
+
+            if self.type == 0:
+                count = min(self.count, LITERAL_SIZE)
+                batch += count // SECTOR_SIZE + 1
+            else:
+                count = min(self.count, self.batch_size - batch)
+                batch += count
+
+            stored_size = STORED_SIZES[self.type]
+            stop = self.offset + count * stored_size
+            stored = self.data.view(self.offset, stop)
+            if len(stored) != stop - self.offset:
+                raise EcmError('Truncated record at {}'.format(self.offset))
+
+            if self.type == 0:
+                layout.append(stored)
+            else:
+                layout.append((self.type, len(sectors[self.type]), count))
+                sectors[self.type].extend(stored[i * stored_size:(i + 1) * stored_size] for i in range(count))
+
+            self.offset = stop
+            self.count -= count
+
+        generated = [generate(type, sectors[type]) if sectors[type] else None for type in range(4)]
+
+        pieces = []
+        for item in layout:
+            if isinstance(item, memoryview):
+                pieces.append(item)
+                continue
+
+            type, first, count = item
+            view = memoryview(generated[type])
+            if type == 1:
+                pieces.append(view[first * SECTOR_SIZE:(first + count) * SECTOR_SIZE])
+            else:
+                # Mode 2 sectors are decoded without their sync pattern and header.
+                pieces.extend(view[i * SECTOR_SIZE + 0x10:(i + 1) * SECTOR_SIZE] for i in range(first, first + count))
+
+        return pieces
+
+    def snapshot(self):
+        return None  # There are seek points all along.
+
+
+def generate(type, stored):
+    """
+    Rebuild sectors from their stored data, and generate their EDC and ECC.
+
+    :param type: record type of the sectors (1, 2 or 3)
+    :param stored: list of the stored data of each sector
+    :return: bytearray of the raw sectors (2352 bytes each)
+    """
+    count = len(stored)
+    sectors = bytearray((_MODE1_SECTOR if type == 1 else _MODE2_SECTOR) * count)
+
+    for i, data in enumerate(stored):
+        start = i * SECTOR_SIZE
+        if type == 1:
+            sectors[start + 0x0c:start + 0x0f] = data[:3]
+            sectors[start + 0x10:start + 0x810] = data[3:]
+        else:
+            # The subheader is stored once, it is written twice.
+            sectors[start + 0x10:start + 0x14] = data[:4]
+            sectors[start + 0x14:start + 0x14 + len(data)] = data
+
+    if type == 1:
+        edc_ecc.encode(sectors, count, mode=1)
+    else:
+        edc_ecc.encode(sectors, count, mode=2, form=1 if type == 2 else 2)
+
+    return sectors
@@ -0,0 +1,210 @@
+"""
+Batched EDC and ECC computation for raw 2352-byte CD sectors.
+
+ISO9660Handler.edc(), ecc() and rs_encode() compute the codes of a single sector byte by byte, which is easy to
+follow but slow. The functions here compute the same codes for a whole batch of sectors at once. The batch is first
+transposed, so that each byte position of a sector becomes a contiguous run holding that byte of every sector. Each
+step of the CRC or of the Reed-Solomon encoder is then a single bytes.translate() (a table lookup) or a big integer
+XOR over the whole run, and the Python-level loop only runs once per byte position instead of once per byte.
+
+Source: ECMA-130, 14.3 (EDC field) and Annex A (CIRC).
+See also: ecm by Neill Corlett
+"""
+import re
+import struct
+
+SECTOR_SIZE = 2352
+
+ECC_P_OFFSET = 0x81c
+ECC_Q_OFFSET = 0x8c8
+
+_ECC_START = 0x0c  # The ECC covers the sector from the header onwards.
+_ADDRESS = range(0x0c, 0x10)
+
+
+def _edc_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for j in range(8):
+            subtract = crc & 1
+            crc >>= 1
+            if subtract:
+                crc ^= 0xd8018001
+
+        table.append(crc)
+
+    return table
+
+
+def _gf_mul2(x):
+    """Multiply value by 2 in GF(2^8)."""
+    y = x << 1
+
+    if y & 0x100:
+        y ^= 0x11d
+
+    return y
+
+
+EDC_TABLE = _edc_table()
+
+# The EDC table split into four byte lanes, so that a lookup can be done with bytes.translate().
+_EDC_LANES = [bytes((value >> shift) & 0xff for value in EDC_TABLE) for shift in (0, 8, 16, 24)]
+
+# Multiplication by 2 and division by 3 in GF(2^8).
+_GF_MUL2 = bytes(_gf_mul2(i) for i in range(256))
+_GF_DIV3 = bytes(sorted(range(256), key=lambda x: _gf_mul2(x) ^ x))
+
+# Sector positions of the P- and Q-vectors, in the order they are fed to the encoder: message position (minor) first,
+# then vector (major). See ISO9660Handler.ecc() for the definition of the vectors.
+_P_POSITIONS = [_ECC_START + major + minor*86 for minor in range(24) for major in range(86)]
+_Q_POSITIONS = [_ECC_START + (minor*88 + major//2*86) % (52*43) + (major & 1)
+                for minor in range(43) for major in range(52)]
+
+_NONZERO = re.compile(b'[^\x00]')
+
+
+def _int(data):
+    return int.from_bytes(data, 'little')
+
+
+def _bytes(value, size):
+    return value.to_bytes(size, 'little')
+
+
+def transpose(buf, count, positions, stride=SECTOR_SIZE, zero_address=False):
+    """
+    Gather the bytes at the given sector positions from count consecutive sectors in buf (bytes or a memoryview).
+
+    The result holds position-major runs: result[i*count + s] == buf[s*stride + positions[i]].
+
+    :param zero_address: treat the sector address (0x0c-0x0f) as zeros, as Mode 2 ECC does.
+    """
+    stop = count * stride
+    zeros = bytes(count)
+
+    return b''.join([zeros if zero_address and position in _ADDRESS else bytes(buf[position:stop:stride])
+                     for position in positions])
+
+
+def edc(buf, count, start, stop, stride=SECTOR_SIZE):
+    """
+    Compute the EDC of bytes start:stop of count consecutive sectors in buf.
+
+    The CRC register of every sector is kept as four byte lanes, so that the table-driven update
+    crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff] becomes four table lookups and three XORs over the whole batch.
+
+    :return: list of EDC values, one per sector
+    """
+    end = count * stride
+    lane0 = lane1 = lane2 = lane3 = 0
+    table0, table1, table2, table3 = _EDC_LANES
+
+    for position in range(start, stop):
+        index = _bytes(lane0 ^ _int(buf[position:end:stride]), count)
+        lane0 = lane1 ^ _int(index.translate(table0))
+        lane1 = lane2 ^ _int(index.translate(table1))
+        lane2 = lane3 ^ _int(index.translate(table2))
+        lane3 = _int(index.translate(table3))
+
+    # Interleave the lanes into little-endian 32-bit words.
+    words = bytearray(4 * count)
+    for i, lane in enumerate((lane0, lane1, lane2, lane3)):
+        words[i::4] = _bytes(lane, count)
+
+    return list(struct.unpack('<{}I'.format(count), words))
+
+
+def _rs_encode(rows, size):
+    """
+    Compute the two Reed-Solomon parity symbols of many messages at once.
+
+    rows[i] holds the i-th symbol of every message. This is the same code as ISO9660Handler.rs_encode(), computed the
+    way ecm does it: the first accumulator is multiplied by 2 after every symbol, the second one is a plain XOR sum,
+    and the parity follows from both at the end.
+
+    :return: (first parity symbols, second parity symbols)
+    """
+    a = b = 0
+    for row in rows:
+        value = _int(row)
+        b ^= value
+        a = _int(_bytes(a ^ value, size).translate(_GF_MUL2))
+
+    a = _int(_bytes(_int(_bytes(a, size).translate(_GF_MUL2)) ^ b, size).translate(_GF_DIV3))
+
+    return _bytes(a, size), _bytes(a ^ b, size)
+
+
+def _ecc(buf, count, positions, majors, minors, stride, zero_address):
+    data = transpose(buf, count, positions, stride, zero_address)
+    size = majors * count
+    rows = [data[minor*size:(minor+1)*size] for minor in range(minors)]
+
+    return b''.join(_rs_encode(rows, size))
+
+
+def ecc_p(buf, count, stride=SECTOR_SIZE, zero_address=False):
+    """
+    Compute the P parity of count consecutive sectors in buf.
+
+    :return: transposed parity, 172 runs of count bytes (see transpose())
+    """
+    return _ecc(buf, count, _P_POSITIONS, 86, 24, stride, zero_address)
+
+
+def ecc_q(buf, count, stride=SECTOR_SIZE, zero_address=False):
+    """
+    Compute the Q parity of count consecutive sectors in buf. The Q-vectors cover the P parity, so buf must already
+    contain it.
+
+    :return: transposed parity, 104 runs of count bytes (see transpose())
+    """
+    return _ecc(buf, count, _Q_POSITIONS, 52, 43, stride, zero_address)
+
+
+def mismatches(computed, stored, count):
+    """Return the set of sector indexes whose transposed codes differ."""
+    if computed == stored:
+        return set()
+
+    diff = _bytes(_int(computed) ^ _int(stored), len(computed))
+
+    return {match.start() % count for match in _NONZERO.finditer(diff)}
+
+
+def scatter(buf, count, positions, runs, stride=SECTOR_SIZE):
+    """
+    The reverse of transpose(): store position-major runs (e.g. computed parity) at the given sector positions of
+    count consecutive sectors in buf (a bytearray or writable memoryview).
+    """
+    stop = count * stride
+    for i, position in enumerate(positions):
+        buf[position:stop:stride] = runs[i*count:(i+1)*count]
+
+
+def encode(buf, count, mode=1, form=1, stride=SECTOR_SIZE):
+    """
+    Compute and store the EDC and ECC of count consecutive sectors in buf (a bytearray or writable memoryview). The
+    sync pattern, header, subheader and user data of the sectors must already be filled in.
+
+    :param mode: sector mode, 1 or 2
+    :param form: form of Mode 2 sectors, 1 or 2 (Form 2 sectors have no ECC)
+    """
+    if mode == 1:
+        start, edc_offset = 0, 0x810
+    elif form == 1:
+        start, edc_offset = 0x10, 0x818
+    else:
+        start, edc_offset = 0x10, 0x92c
+
+    for i, value in enumerate(edc(buf, count, start, edc_offset, stride)):
+        struct.pack_into('<I', buf, i*stride + edc_offset, value)
+
+    if mode == 2 and form == 2:
+        return
+
+    zero_address = (mode == 2)
+    scatter(buf, count, range(ECC_P_OFFSET, ECC_P_OFFSET + 86*2), ecc_p(buf, count, stride, zero_address), stride)
+    scatter(buf, count, range(ECC_Q_OFFSET, ECC_Q_OFFSET + 52*2), ecc_q(buf, count, stride, zero_address), stride)
@@ -0,0 +1,149 @@
+"""
+Streaming output (the ndjson output format): instead of one document written once the whole analysis is done, an image
+is written as a sequence of events, one JSON object per line, each written as soon as its stage of the analysis is
+complete. A consumer can start working on the first files of an image while its sectors are still being checked.
+
+Every event has an "event" and an "image" key. The events of an image, in order:
+
+- image: the analysis of the image starts.
+- header: the header of a Dreamcast data track.
+- volume: the primary volume descriptor of an ISO 9660 file system.
+- file: a directory record, with its hashes. Files are written as their hashes are known, which is in sector order
+  rather than directory order.
+- verification: result of a sampled verification (see --verify).
+- errors: a run of consecutive sectors with the same errors, from first_sector to last_sector.
+- track: summary of a track of a multi-track image, once the track is done.
+- info: the rest of the image info (e.g. that of a Megadrive ROM).
+- unknown: the image is not in a known format.
+- stats: the time spent in each stage of the analysis (see --stats and stats.collect()).
+- end: the analysis of the image is done.
+
+Events of data tracks and volumes have a "track" key, which is empty for single-track images. The tracks of an image
+can be analyzed at the same time (see GDIHandler), then their events interleave. Images analyzed with the ndjson
+format are still cached; the events of a cached image are replayed from its info.
+"""
+import json
+import sys
+import threading
+import config
+from utils import json_default
+
+# The image being analyzed.
+image = None
+
+# Tracks of an image can be analyzed in threads (see GDIHandler), keep their events whole.
+_lock = threading.Lock()
+
+# Info keys that are written as their own events, the others are written in the info event.
+streamed_keys = ('Header', 'Volume', 'Files', 'Verification', 'Errors', 'Tracks')
+
+
+def streaming():
+    return config.output_format == 'ndjson'
+
+
+def emit(event, **fields):
+    """Write an event, if the output is streamed."""
+    if not streaming():
+        return
+
+    record = {'event': event, 'image': image}
+    record.update(fields)
+
+    line = json.dumps(record, default=json_default) + '\n'
+    with _lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+
+def emit_file(track_name, entry):
+    if not streaming():
+        return
+
+    emit('file', track=track_name, **dict(entry.items()))
+
+
+def emit_errors(track_name, errors):
+    """Write the sector errors (a dict of sector: error list) as runs of consecutive sectors with the same errors."""
+    if not streaming():
+        return
+
+    for first_sector, last_sector, codes in error_ranges(errors):
+        emit('errors', track=track_name, first_sector=first_sector, last_sector=last_sector, errors=codes)
+
+
+def error_ranges(errors):
+    """
+    :param errors: dict of sector: error list
+    :return: generator of (first sector, last sector, error list)
+    """
+    first_sector = last_sector = codes = None
+    for sector in sorted(errors):
+        if codes is not None and sector == last_sector + 1 and errors[sector] == codes:
+            last_sector = sector
+            continue
+
+        if codes is not None:
+            yield first_sector, last_sector, codes
+
+        first_sector = last_sector = sector
+        codes = errors[sector]
+
+    if codes is not None:
+        yield first_sector, last_sector, codes
+
+
+def track_summary(info):
+    """
+    :param info: info of a track, as in the Tracks of a GDI
+    :return: dict of the track event fields
+    """
+    if not isinstance(info, dict):
+        return {'type': info}
+
+    summary = {'type': info.get('Type', 'Data track')}
+    if 'Files' in info:
+        summary['files'] = len(info['Files']['value'])
+        summary['errors'] = len(info.get('Errors', ()))
+    if 'Hashes' in info:
+        summary['hashes'] = info['Hashes']
+
+    return summary
+
+
+def emit_rest(info):
+    rest = {key: value for key, value in info.items() if key not in streamed_keys}
+    if rest:
+        emit('info', info=rest)
+
+
+def replay(info):
+    """Write the events of an image from its info, e.g. when it was cached."""
+    if 'Tracks' in info:
+        for track_name, track_info in info['Tracks'].items():
+            if isinstance(track_info, dict):
+                replay_track(track_name, track_info)
+
+            emit('track', track=track_name, **track_summary(track_info))
+    else:
+        replay_track('', info)
+
+    emit_rest(info)
+
+
+def replay_track(track_name, info):
+    if 'Header' in info:
+        emit('header', track=track_name, header=info['Header'])
+
+    if 'Volume' in info:
+        emit('volume', track=track_name, volume=info['Volume'])
+
+    if 'Files' in info:
+        for entry in info['Files']['value'].values():
+            emit_file(track_name, entry)
+
+    if 'Verification' in info:
+        emit('verification', track=track_name, verification=info['Verification'])
+
+    if 'Errors' in info:
+        emit_errors(track_name, info['Errors'])
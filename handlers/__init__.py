@@ -1,5 +1,6 @@
 from .megadrive import MegadriveHandler
 from .iso9660 import ISO9660Handler
 from .dreamcast import DCDataTrackHandler, GDIHandler
+from .cue import CueHandler
 
-handlers = [MegadriveHandler, DCDataTrackHandler, ISO9660Handler, GDIHandler]
+handlers = [MegadriveHandler, DCDataTrackHandler, ISO9660Handler, GDIHandler, CueHandler]
@@ -1,11 +1,35 @@
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+
+# A cheap check of whether a file can be handled by a handler class, see analyze.SignatureTable. It matches when data
+# (bytes, or a compiled regex searched within size bytes) is at offset of the file, and the file name matches the
+# file_name regex. Fields that are None aren't checked.
+Signature = namedtuple('Signature', 'offset data size file_name')
+Signature.__new__.__defaults__ = (None, None, None, None)
 
 
 class BaseHandler:
+    # Signatures of the files the handler can handle, at least one of them has to match for test() to be called. None
+    # means test() is always called.
+    signatures = None
+
     def __init__(self, file, file_name):
         self.file = file
         self.file_name = file_name  # TODO: rename file_name to path
         self.info = OrderedDict()
+        self.header = None  # The start of the file, if it was read to detect its handler (see analyze.find_handler()).
 
     def read(self, offset, size):
+        if self.header is not None and offset + size <= len(self.header):
+            return self.header[offset:offset + size]
+
         return self.file[offset:offset + size]
+
+    def read_view(self, offset, size):
+        """Like read(), but return a memoryview, which doesn't copy the data if the file supports views."""
+        if self.header is not None and offset + size <= len(self.header):
+            return memoryview(self.header)[offset:offset + size]
+
+        if not hasattr(self.file, 'view'):
+            return memoryview(self.file[offset:offset + size])
+
+        return self.file.view(offset, offset + size)
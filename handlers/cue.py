@@ -0,0 +1,202 @@
+"""
+Handle CUE sheets (BIN/CUE images).
+
+Format reference: https://www.gnu.org/software/ccd2cue/manual/html_node/CUE-sheet-format.html
+"""
+import os.path
+import re
+import archive
+from .base_handler import Signature
+from .dreamcast import DCDataTrackHandler, GDIHandler
+from .iso9660 import ISO9660Handler
+from utils import FileSlice
+
+
+class CueParseError(ValueError):
+    pass
+
+
+# Sector sizes of the track modes.
+TRACK_MODES = {
+    'AUDIO': 2352,
+    'CDG': 2448,
+    'MODE1/2048': 2048,
+    'MODE1/2352': 2352,
+    'MODE2/2048': 2048,
+    'MODE2/2324': 2324,
+    'MODE2/2336': 2336,
+    'MODE2/2352': 2352,
+    'CDI/2336': 2336,
+    'CDI/2352': 2352,
+}
+
+# File types with the sectors stored as they are. Tracks in other files (e.g. WAVE) are hashed, but not analyzed.
+RAW_FILE_TYPES = ('BINARY', 'MOTOROLA')
+
+
+def frames(msf):
+    """:return: the number of sectors (frames, 75 per second) in a mm:ss:ff time"""
+    match = re.match(r'^(\d+):(\d+):(\d+)$', msf)
+    if not match:
+        raise CueParseError('Invalid time: {}'.format(msf))
+
+    minutes, seconds, frames = (int(value) for value in match.groups())
+
+    return (minutes * 60 + seconds) * 75 + frames
+
+
+class CueHandler(GDIHandler):
+    """
+    The tracks of a CUE sheet, in one or more BIN files. Each track is read from its part of its file (a FileSlice),
+    so that the BIN files are analyzed where they are, the same as on their own. Data tracks are analyzed by
+    ISO9660Handler (or DCDataTrackHandler), audio tracks are only hashed.
+    """
+    signatures = [Signature(file_name=re.compile(r'^.*\.cue$', re.IGNORECASE))]
+
+    max_size = 64 * 1024  # Bigger files aren't CUE sheets.
+
+    def test(self):
+        if not re.match(r'^.*\.cue$', self.file_name, re.IGNORECASE) or len(self.file) > self.max_size:
+            return False
+
+        try:
+            self.tracks = self.parse()
+        except CueParseError:
+            return False
+
+        return True
+
+    def parse(self):
+        """
+        :return: list of tracks: dicts of index (track number), mode, type (as in a GDI: 4 for data, 0 for audio),
+                 sector_size, file_name, file_type, file_number, indexes (dict of index number: sector in the file),
+                 pregap and postgap (sectors which aren't in the file)
+        """
+        data = self.read(0, len(self.file))
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            text = data.decode('latin-1')
+
+        tracks = []
+        file_name = file_type = None
+        file_number = -1
+
+        for line in text.lstrip('\ufeff').splitlines():
+            command, _, arguments = line.strip().partition(' ')
+            command = command.upper()
+            arguments = arguments.strip()
+
+            if command == 'FILE':
+                match = re.match(r'^(?:"([^"]*)"|(\S+))\s+(\S+)$', arguments)
+                if not match:
+                    raise CueParseError('Invalid FILE: {}'.format(arguments))
+
+                file_name = match.group(1) if match.group(1) is not None else match.group(2)
+                file_type = match.group(3).upper()
+                file_number += 1
+
+            elif command == 'TRACK':
+                match = re.match(r'^(\d+)\s+(\S+)$', arguments)
+                if not match or file_name is None:
+                    raise CueParseError('Invalid TRACK: {}'.format(arguments))
+
+                mode = match.group(2).upper()
+                if mode not in TRACK_MODES:
+                    raise CueParseError('Unknown track mode: {}'.format(mode))
+
+                tracks.append({'index': int(match.group(1)), 'mode': mode, 'type': 0 if mode == 'AUDIO' else 4,
+                               'sector_size': TRACK_MODES[mode], 'file_name': file_name, 'file_type': file_type,
+                               'file_number': file_number, 'indexes': {}, 'pregap': 0, 'postgap': 0})
+
+            elif command in ('INDEX', 'PREGAP', 'POSTGAP'):
+                if not tracks:
+                    raise CueParseError('{} outside of a track'.format(command))
+
+                if command == 'INDEX':
+                    match = re.match(r'^(\d+)\s+(\S+)$', arguments)
+                    if not match:
+                        raise CueParseError('Invalid INDEX: {}'.format(arguments))
+
+                    tracks[-1]['indexes'][int(match.group(1))] = frames(match.group(2))
+                else:
+                    tracks[-1][command.lower()] = frames(arguments)
+
+        if not tracks:
+            raise CueParseError('No tracks')
+
+        for track in tracks:
+            if 1 not in track['indexes']:
+                raise CueParseError('Track {} has no INDEX 01'.format(track['index']))
+
+        return tracks
+
+    def layout(self, tracks):
+        """
+        Find the part of its file of each track, from its first index (the pregap, if it is in the file) to the next
+        track, and the sector of its INDEX 01 on the disc. Sets path, start, data_start (the offset of INDEX 01), stop,
+        file_size and sector of each track.
+        """
+        directory = os.path.dirname(self.file_name)
+
+        disc_sector = 0  # Sector of the start of the current file on the disc.
+        gaps = 0  # Pregap and postgap sectors so far, which aren't in the files.
+
+        for file_number in sorted(set(track['file_number'] for track in tracks)):
+            file_tracks = [track for track in tracks if track['file_number'] == file_number]
+            path = os.path.join(directory, file_tracks[0]['file_name'])
+            file_size = archive.file_size(path)
+
+            # Index times are sectors of the file, which are the sectors of the tracks before them.
+            base_sector, base_offset, base_size = 0, 0, file_tracks[0]['sector_size']
+            for track in file_tracks:
+                first_sector = min(track['indexes'].values())
+
+                track['path'] = path
+                track['file_size'] = file_size
+                track['start'] = base_offset + (first_sector - base_sector) * base_size
+                track['data_start'] = track['start'] + (track['indexes'][1] - first_sector) * track['sector_size']
+
+                gaps += track['pregap']
+                track['sector'] = disc_sector + track['indexes'][1] + gaps
+                gaps += track['postgap']
+
+                base_sector, base_offset, base_size = first_sector, track['start'], track['sector_size']
+
+            for track, next_track in zip(file_tracks, file_tracks[1:] + [None]):
+                track['stop'] = next_track['start'] if next_track is not None else file_size
+
+            disc_sector += base_sector + (file_size - base_offset) // base_size
+
+    def get_info(self):
+        tracks = self.tracks or self.parse()
+        self.layout(tracks)
+
+        track_jobs = []
+        for track in tracks:
+            if track['start'] == 0 and track['stop'] == track['file_size']:
+                track_file = track['file_name']
+            else:
+                # A part of a file with several tracks.
+                track_file = '{} [{}:{}]'.format(track['file_name'], track['start'], track['stop'])
+
+            if track['file_type'] not in RAW_FILE_TYPES:
+                track = dict(track, type=None)
+
+            file = FileSlice(track['path'], track['start'], track['stop'], opener=archive.open_file)
+            track_jobs.append((track, 'Track {}'.format(track['index']), [track_file], file))
+
+        self.info['Tracks'] = self.analyze_tracks(track_jobs)
+
+    def data_track_handler(self, track, track_name, file):
+        # Sector 0 of a data track is at its INDEX 01, after the pregap.
+        if track['data_start'] > track['start']:
+            file = file.slice(track['data_start'] - track['start'])
+
+        for handler_class in (DCDataTrackHandler, ISO9660Handler):
+            handler = handler_class(file=file, file_name=track['file_name'], sector_offset=track['sector'],
+                                    track_name=track_name)
+            if handler.test():
+                return handler
+
+        return None
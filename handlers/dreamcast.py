@@ -2,9 +2,15 @@ import mmap
 import os.path
 import re
 from collections import OrderedDict
-from .base_handler import BaseHandler
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import archive
+import config
+import events
+import stats
+from .base_handler import BaseHandler, Signature
 from .iso9660 import ISO9660Handler
-from utils import MmappedFile, ConcatenatedFile
+from utils import ConcatenatedFile, MultiHash
 
 
 class GDIParseError(ValueError):
@@ -12,12 +18,19 @@ class GDIParseError(ValueError):
 
 
 class GDIHandler(BaseHandler):
+    signatures = [Signature(file_name=re.compile('^.*\.gdi', re.IGNORECASE))]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.tracks = None  # Parsed by test().
+
     def test(self):
         if not re.match('^.*\.gdi', self.file_name, re.IGNORECASE):
             return False
 
         try:
-            self.parse()
+            self.tracks = self.parse()
         except GDIParseError:
             return False
 
@@ -65,7 +78,7 @@ class GDIHandler(BaseHandler):
         return tracks
 
     def get_info(self):
-        tracks = self.parse()
+        tracks = self.tracks or self.parse()
         for track in tracks:
             track['path'] = os.path.join(os.path.dirname(self.file_name), track['file_name'])
 
@@ -76,7 +89,7 @@ class GDIHandler(BaseHandler):
         else:
             mixed_mode = False
 
-        track_info = OrderedDict()
+        track_jobs = []
         for track in tracks:
             if mixed_mode and track == tracks[-1]:
                 continue
@@ -85,33 +98,136 @@ class GDIHandler(BaseHandler):
                 last_track = tracks[-1]
                 offset_gap = (last_track['sector'] - track['sector']) * 2352
                 track_name = 'Track {}+{}'.format(track['index'], last_track['index'])
+                track_files = [track['file_name'], last_track['file_name']]
 
                 file = ConcatenatedFile(file_names=[track['path'], last_track['path']],
-                                        offsets=[0, offset_gap])  # TODO handle different sector sizes
+                                        offsets=[0, offset_gap],  # TODO handle different sector sizes
+                                        opener=archive.open_file)
 
             else:
                 track_name = 'Track {}'.format(track['index'])
-                file = MmappedFile(track['path'])
+                track_files = [track['file_name']]
+                file = archive.open_file(track['path'])
+
+            track_jobs.append((track, track_name, track_files, file))
+
+        self.info['Tracks'] = self.analyze_tracks(track_jobs)
+
+    def analyze_tracks(self, track_jobs):
+        """
+        :param track_jobs: list of analyze_track() arguments (track, track name, track files, file), one per track
+        :return: OrderedDict of track name: track info
+        """
+        track_info = OrderedDict()
+
+        if config.jobs > 1 and len(track_jobs) > 1:
+            # The tracks are independent, analyze them at the same time. Their threads only coordinate: sector checks
+            # run in one process pool shared by all tracks, so there are never more than config.jobs of them, and
+            # reading and hashing mostly run outside of the GIL.
+            with ExitStack() as stack:
+                sector_executor = None
+                if not config.skip_sector_errors:
+                    sector_executor = stack.enter_context(ProcessPoolExecutor(max_workers=config.jobs))
+
+                    # Start worker processes now: they are forked, which is best done before threads are running. Up
+                    # to Python 3.8 all of them start with the first task. Later versions start them on demand, one
+                    # task each is likely to start more of them, but those that aren't are forked as the tracks run.
+                    for future in [sector_executor.submit(int) for _ in range(config.jobs)]:
+                        future.result()
+
+                track_executor = stack.enter_context(ThreadPoolExecutor(max_workers=min(len(track_jobs), config.jobs)))
+                futures = [track_executor.submit(stats.inherit(self.analyze_track), *job,
+                                                  sector_executor=sector_executor)
+                           for job in track_jobs]
+
+                try:
+                    for (_, track_name, _, _), future in zip(track_jobs, futures):
+                        track_info[track_name] = future.result()
+                        if events.streaming():
+                            events.emit('track', track=track_name, **events.track_summary(track_info[track_name]))
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+
+                    raise
+
+        else:
+            for job in track_jobs:
+                track_name = job[1]
+                track_info[track_name] = self.analyze_track(*job)
+                if events.streaming():
+                    events.emit('track', track=track_name, **events.track_summary(track_info[track_name]))
+
+        return track_info
+
+    def analyze_track(self, track, track_name, track_files, file, sector_executor=None):
+        """
+        :param file: file of the track, it is closed when done
+        :param sector_executor: process pool to check sectors of data tracks in
+        :return: info of the track
+        """
+        with stats.stage(track_name):
+            # Hashes of the track files, if requested. They are computed along with the track analysis.
+            raw_hashes = None
+            if config.hashes:
+                raw_hashes = {i: MultiHash(config.hashes) for i in range(len(track_files))}
 
             with file:
                 if track['type'] == 4:
-                    handler = DCDataTrackHandler(file=file, file_name=track['file_name'], sector_offset=track['sector'], track_name=track_name)
-                    if handler.test():
+                    handler = self.data_track_handler(track, track_name, file)
+                    if handler is not None:
+                        if handler.file is file:
+                            # The track files are hashed as the handler reads them.
+                            handler.raw_hashes = raw_hashes
+                        handler.executor = sector_executor
                         handler.get_info()
-                        track_info[track_name] = handler.info
+                        info = handler.info
                     else:
-                        track_info[track_name] = 'Data track in unknown format'
+                        info = 'Data track in unknown format'
 
                 elif track['type'] == 0:
-                    track_info[track_name] = 'Audio track'
+                    info = 'Audio track'
 
                 else:
-                    track_info[track_name] = 'Unknown'
+                    info = 'Unknown'
+
+                if raw_hashes is not None:
+                    info = self.add_track_hashes(info, file, track_files, raw_hashes)
+
+        return info
+
+    def data_track_handler(self, track, track_name, file):
+        """:return: handler of a data track, or None if the track is in an unknown format"""
+        handler = DCDataTrackHandler(file=file, file_name=track['file_name'], sector_offset=track['sector'],
+                                     track_name=track_name)
+
+        return handler if handler.test() else None
 
-        self.info['Tracks'] = track_info
+    @staticmethod
+    def add_track_hashes(info, file, track_files, raw_hashes):
+        """Add the hashes of the track files to the track info, hashing whatever the track handler didn't."""
+        hashes = OrderedDict()
+        for chunk, file_start, file_stop in file.ranges():
+            hash = raw_hashes[chunk]
+            if not hash.size:
+                for offset in range(file_start, file_stop, 1024*1024):
+                    hash.update(file.view(offset, min(offset + 1024*1024, file_stop)))
+
+            hashes[track_files[chunk]] = hash.hexdigests()
+
+        if not isinstance(info, dict):
+            info = OrderedDict([('Type', info)])
+
+        info['Hashes'] = hashes
+
+        return info
 
 
 class DCDataTrackHandler(ISO9660Handler):
+    # The hardware ID at the start of the user data of sector 0, in mode 1, mode 2 and 2048-byte sectors.
+    signatures = [Signature(0x10, b'SEGA SEGAKATANA '), Signature(0x18, b'SEGA SEGAKATANA '),
+                  Signature(0, b'SEGA SEGAKATANA ')]
+
     def test(self):
         if not super().test():
             return False
@@ -138,5 +254,6 @@ class DCDataTrackHandler(ISO9660Handler):
         header_info['Software name'] = self.unpack('string', 0x80, 16, 0)
 
         self.info['Header'] = header_info
+        events.emit('header', track=self.track_name, header=header_info)
 
         super().get_info()
@@ -3,18 +3,33 @@ Handle ISO 9660 disc image files.
 
 Format reference: http://wiki.osdev.org/ISO_9660
 """
+import binascii
+import json
 import os
+import random
 import re
 import struct
-from collections import OrderedDict, defaultdict
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from zlib import crc32
+from itertools import accumulate, chain
 import config
-from utils import print_status
-from .base_handler import BaseHandler
+import edc_ecc
+import events
+import stats
+from utils import MmappedFile, MultiHash, print_status, reopen
+from .base_handler import BaseHandler, Signature
 
 
 class ISO9660Handler(BaseHandler):
+    # The standard identifier of the first volume descriptor (sector 16) in mode 1, mode 2 and 2048-byte sectors.
+    signatures = [Signature(0x9311, b'CD001'), Signature(0x9319, b'CD001'), Signature(0x8001, b'CD001')]
+
     def __init__(self, sector_offset=0, track_name="", *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -26,6 +41,11 @@ class ISO9660Handler(BaseHandler):
         self.pvd_sector = None
 
         self._edc_table = None
+        self.batch_size = 1024  # Sectors per batch in find_sector_errors().
+        self.raw_hashes = None  # Hashes of the raw chunks of the file, see scan().
+        self.executor = None  # Process pool shared with other handlers, see checked_batches().
+        self.sector_cache = SectorCache(config.sector_cache_size) if config.sector_cache_size else None
+        self._layout = None
 
         self.skip_offset = None
         self.data_offset = None
@@ -76,8 +96,20 @@ class ISO9660Handler(BaseHandler):
 
         raise ValueError("Unknown disc format")
 
+    @property
+    def layout(self):
+        if self._layout is None:
+            self._layout = SectorLayout(self)
+
+        return self._layout
+
     def sector_form(self, sector):
-        if (self.read(0x12, 1, sector, raw=True)[0] & 0x20) == 0:
+        submode = self.layout.submode(sector)
+        if submode is None:
+            # Not within the file.
+            submode = self.read(0x12, 1, sector, raw=True)[0]
+
+        if (submode & 0x20) == 0:
             return 1
 
         else:
@@ -98,6 +130,97 @@ class ISO9660Handler(BaseHandler):
     def get_info(self):
         """Get volume information from the primary volume descriptor of the ISO 9660 image."""
 
+        with stats.stage('pvd'):
+            volume_info = self.find_volume_info()
+
+        # TODO: this is pretty horrible, refactor
+        extract_dir = None
+        extractor = None
+        directory_times = []
+        if config.extract is not None:
+            extract_dir = os.path.join(config.extract, volume_info['Name'], self.track_name)
+            os.makedirs(extract_dir, exist_ok=True)
+
+            # With 2048-byte sectors, the data of a file is contiguous in the image and can be copied from it.
+            copy = self.format == 'iso' and isinstance(self.file, MmappedFile)
+            extractor = Extractor(image=self.file if copy else None, track_name=self.track_name)
+
+        file_info = FileList()
+        streams = []
+        hashes = tuple(config.hashes or ('crc32',))
+
+        with stats.stage('files'):
+            for file in self.files(file_info):
+                if file['name'] == '':
+                    continue
+
+                extract_path = None
+                copy_offset = None
+                if config.extract is not None:
+                    path = os.path.join(extract_dir, file['path'].lstrip('/'))
+                    if file['is_directory']:
+                        os.makedirs(path, exist_ok=True)
+
+                        if isinstance(file['date'], datetime):
+                            # Save the directory modification time for later. If wew were to set it now,
+                            # it would be overridden by extracting files that are within it.
+                            timestamp = file['date'].timestamp()
+                            directory_times.append((path, timestamp))
+
+                    if not file['is_directory']:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        extract_path = path
+
+                        if extractor.image is not None:
+                            copy_offset = file['sector'] * self.sector_size + self.data_offset
+
+                streams.append(FileStream(file, extract_path=extract_path, track_name=self.track_name, hashes=hashes,
+                                          extractor=extractor, copy_offset=copy_offset))
+
+            if stats.enabled:
+                stats.count(entries=len(file_info))
+
+        # Read the image once, hashing (and extracting) files while checking sectors for errors. When only a sample
+        # of sectors is to be checked, it is checked separately.
+        sample = None if config.skip_sector_errors else config.verify
+        try:
+            with stats.stage('scan'):
+                sector_errors = self.scan(streams, check_errors=not config.skip_sector_errors and sample is None,
+                                          raw_hashes=self.raw_hashes)
+        finally:
+            if extractor is not None:
+                # The files are written during the scan, what is left is waiting for the last writes.
+                with stats.stage('extract'):
+                    extractor.close()
+
+                    if stats.enabled:
+                        stats.count(files_written=extractor.n_files, bytes_written=extractor.size)
+
+        if sample is not None:
+            with stats.stage('verify'):
+                self.info['Verification'], sector_errors = self.verify_sample(*sample, files=file_info)
+            events.emit('verification', track=self.track_name, verification=self.info['Verification'])
+
+        if config.extract is not None:
+            print_status("\n")
+            for path, timestamp in directory_times:
+                os.utime(path, (timestamp, timestamp))
+
+        self.info['Files'] = {'type': 'file_list', 'value': file_info}
+
+        if sector_errors:
+            self.info['Errors'] = sector_errors
+            events.emit_errors(self.track_name, sector_errors)
+
+        if stats.enabled and self.sector_cache is not None:
+            stats.count(sector_cache_hits=self.sector_cache.hits, sector_cache_misses=self.sector_cache.misses)
+
+    def find_volume_info(self):
+        """
+        Find the primary volume descriptor, and get the volume information from it.
+
+        :return: volume info
+        """
         # Find primary volume descriptor (vd_type == 1).
         pvd_sector = None
         for sector in range(0x10, 0x80):
@@ -139,104 +262,466 @@ class ISO9660Handler(BaseHandler):
         volume_info['Expiration date'] = self.unpack('iso_date_string', 847, 17, pvd_sector)
 
         self.info['Volume'] = volume_info
+        events.emit('volume', track=self.track_name, volume=volume_info)
 
-        # TODO: this is pretty horrible, refactor
-        extract_dir = None
-        directory_times = []
-        if config.extract is not None:
-            extract_dir = os.path.join(config.extract, volume_info['Name'], self.track_name)
-            os.makedirs(extract_dir, exist_ok=True)
+        return volume_info
 
-        file_info = OrderedDict()
+    def sector_ranges(self):
+        for _, file_start, file_stop in self.file.ranges():
+            yield file_start // self.sector_size, file_stop // self.sector_size
 
-        for file in self.files():
-            if file['name'] == '':
-                continue
+    def sectors(self):
+        for sector_start, sector_stop in self.sector_ranges():
+            yield from range(sector_start, sector_stop)
 
-            contents = self.read(0, file['size'], file['sector'])
-            file['crc32'] = '{:08x}'.format(crc32(contents))
+    def sector_count(self):
+        return len(self.file) // self.sector_size
 
-            if config.extract is not None:
-                path = os.path.join(extract_dir, file['path'].lstrip('/'))
-                if file['is_directory']:
-                    os.makedirs(path, exist_ok=True)
+    def find_sector_errors(self):
+        with stats.stage('find_sector_errors'):
+            if config.verify is not None:
+                return self.verify_sample(*config.verify)[1]
 
-                    if isinstance(file['date'], datetime):
-                        # Save the directory modification time for later. If wew were to set it now,
-                        # it would be overridden by extracting files that are within it.
-                        timestamp = file['date'].timestamp()
-                        directory_times.append((path, timestamp))
+            return self.scan()
 
-                if not file['is_directory']:
-                    os.makedirs(os.path.dirname(path), exist_ok=True)
+    def verify_sample(self, n, seed=0, files=None):
+        """
+        Quick verification: check a reproducible, uniformly random sample of n sectors, along with the sectors where
+        errors matter most: the system area and volume descriptors, the directory extents and the first and last
+        sectors of files. Only if any of them has errors, check all sectors.
 
-                    if self.track_name:
-                        display_name = ' '+self.track_name
-                    else:
-                        display_name = ''
+        :param seed: seed of the sample
+        :param files: FileList of the image (default: read from the directories, if the volume descriptor is known)
+        :return: (verification info, sector errors)
+        """
+        sampled = self.sample_sectors(n, seed)
+        targeted = self.targeted_sectors(files)
+        errors = self.check_sectors(sorted(set(sampled) | set(targeted)))
+
+        sampled_errors = sum(1 for sector in sampled if sector in errors)
+        targeted_errors = sum(1 for sector in targeted if sector in errors)
+        total = sum(stop - start for start, stop in self.sector_ranges())
+
+        info = OrderedDict()
+        info['Mode'] = 'sample of {} sectors (seed {})'.format(n, seed)
+        info['Sampled sectors'] = '{} of {}, {} with errors'.format(len(sampled), total, sampled_errors)
+        info['Targeted sectors'] = '{} (system area, directories, file boundaries), {} with errors'.format(
+            len(targeted), targeted_errors)
+
+        if sampled:
+            info['Error rate'] = '{:.3%} (95% upper bound: {:.3%})'.format(
+                sampled_errors / len(sampled), _wilson_upper_bound(sampled_errors, len(sampled)))
+
+        if errors:
+            info['Result'] = 'errors found, all sectors checked'
+            errors = self.scan()
+        else:
+            info['Result'] = 'no errors found'
 
-                    print_status('Extracting{}: {:<80}   '.format(display_name, file['path']))
+        return info, errors
 
-                    with open(path, "wb") as f:
-                        f.write(contents)
+    def sample_sectors(self, n, seed=0):
+        """
+        :return: sorted list of n sectors (or all of them, if there are fewer), chosen uniformly at random
+        """
+        ranges = list(self.sector_ranges())
+        total = sum(stop - start for start, stop in ranges)
+        indexes = sorted(random.Random(seed).sample(range(total), min(n, total)))
 
-                        if isinstance(file['date'], datetime):
-                            timestamp = file['date'].timestamp()
-                            os.utime(path, (timestamp, timestamp))
+        sectors = []
+        offset = 0
+        i = 0
+        for start, stop in ranges:
+            while i < len(indexes) and indexes[i] < offset + stop - start:
+                sectors.append(start + indexes[i] - offset)
+                i += 1
 
-            file_info[file['path']] = file
+            offset += stop - start
 
-        if config.extract is not None:
-            print_status("\n")
-            for path, timestamp in directory_times:
-                os.utime(path, (timestamp, timestamp))
+        return sectors
 
-        self.info['Files'] = {'type': 'file_list', 'value': file_info}
+    def targeted_sectors(self, files=None):
+        """
+        :return: sorted list of the sectors of the system area and volume descriptors, of directory extents and of the
+                 first and last sectors of files
+        """
+        sectors = set(range(16))
 
-        if not config.skip_sector_errors:
-            sector_errors = self.find_sector_errors()
-            if sector_errors:
-                self.info['Errors'] = sector_errors
+        # Volume descriptors, up to the terminator.
+        for sector in range(16, min(0x80, self.sector_count())):
+            if self.read(1, 5, sector) != b'CD001':
+                break
 
-    def sectors(self):
-        for _, file_start, file_stop in self.file.ranges():
-            sector_start = file_start // self.sector_size
-            sector_stop = file_stop // self.sector_size
+            sectors.add(sector)
+            if self.unpack('uint8', 0, 1, sector=sector) == 255:
+                break
 
-            yield from range(sector_start, sector_stop)
+        if files is None and self.pvd_sector is not None:
+            files = FileList()
+            for _ in self.files(files):
+                pass
 
-    def sector_count(self):
-        return len(self.file) // self.sector_size
+        if files is not None:
+            for index in range(len(files.parents)):
+                sector, size = files.sectors[index], files.sizes[index]
+                if files.flags[index] & 2:
+                    sectors.update(range(sector, sector + -(-size // 2048)))
+                elif size:
+                    sectors.add(sector)
+                    sectors.add(self.seek(size - 1, sector)[0])
 
-    def find_sector_errors(self):
+        ranges = list(self.sector_ranges())
+
+        return sorted(sector for sector in sectors if any(start <= sector < stop for start, stop in ranges))
+
+    def check_sectors(self, sectors):
+        """
+        Check the given sectors (a sorted list), in batches of consecutive sectors.
+
+        :return: sector errors (a dict of sector: error list)
+        """
         errors = defaultdict(list)
 
-        n_p = n_q = n_edc = 0
+        runs = []
+        for sector in sectors:
+            if runs and runs[-1][0] + runs[-1][1] == sector and runs[-1][1] < self.batch_size:
+                runs[-1][1] += 1
+            else:
+                runs.append([sector, 1])
+
+        checked = 0
+        for run_start, run_count in runs:
+            results = self.check_errors_batch(run_start, run_count)
+            if stats.enabled:
+                stats.count(sectors=run_count, bytes=run_count * self.sector_size)
 
-        for i, sector in enumerate(self.sectors()):
-            p, q, edc = self.check_errors(sector)
-            if not p:
-                errors[sector].append('p')
-                n_p += 1
+            for sector, (p, q, edc) in enumerate(results, run_start):
+                for ok, code in ((p, 'p'), (q, 'q'), (edc, 'edc')):
+                    if not ok:
+                        errors[sector].append(code)
 
-            if not q:
-                errors[sector].append('q')
-                n_q += 1
+            checked += run_count
+            print_status('Checking sample sector {} of {}... found errors in {} sectors   '.format(
+                checked, len(sectors), len(errors)))
 
-            if not edc:
-                errors[sector].append('edc')
-                n_edc += 1
+        if runs:
+            print_status('\n')
 
-            # Because this is so slow, show a status line.
-            if not i & 0x7f or i == self.sector_count()-1:
-                print_status('Checking sector {} of {} ({:.2f}%)... found {} P errors, {} Q errors, {} EDC errors   '.format(
-                    i+1, self.sector_count(), (i+1)/self.sector_count()*100, n_p, n_q, n_edc))
+        return errors
+
+    def checkpoint(self):
+        """
+        :return: Checkpoint of the sector checks, kept next to the (first) file of the image, or None if the image is
+                 not backed by files
+        """
+        file_names = getattr(self.file, 'file_names', None) or [getattr(self.file, 'file_name', None)]
+        if None in file_names or not all(os.path.isfile(file_name) for file_name in file_names):
+            return None  # E.g. a track in a zip file.
+
+        return Checkpoint(file_names[0] + '.rominfo-checkpoint', file_names,
+                          [self.format, self.sector_size, self.data_offset, self.sector_count()])
+
+    def save_checkpoint(self, checkpoint, next_sector, errors):
+        """
+        Save the progress of the sector checks (see Checkpoint.save()). Images are often on read-only media, if the
+        checkpoint can't be written the checks go on without it.
+
+        :return: checkpoint, or None if it couldn't be saved
+        """
+        try:
+            checkpoint.save(next_sector, errors)
+        except OSError as e:
+            print("\nCan't save the progress of the sector checks of {} ({}), going on without checkpoints".format(
+                self.file_name, e), file=sys.stderr)
+            return None
 
-        print_status('\n')  # Print newlines.
+        return checkpoint
+
+    def scan(self, streams=(), check_errors=True, raw_hashes=None):
+        """
+        Read the image once, in sector order. Each batch of sectors is checked for errors (unless check_errors is
+        False) and the user data of each sector is fed to the streams of the files which own it, so that file hashes
+        don't need another pass over the image. Parts of files outside of the scanned sectors are read directly.
+
+        :param streams: FileStream objects of the files to read
+        :param raw_hashes: dict of chunk index (as in file.ranges()) to MultiHash, fed with the raw chunk data
+        :return: sector errors (a dict of sector: error list), or None if check_errors is False
+        """
+        pending = deque(sorted((stream for stream in streams if stream.remaining), key=lambda stream: stream.sector))
+        active = []
+        unfinished = []
+        errors = None
+
+        # How far each chunk has been hashed.
+        hashed = {chunk: file_start for chunk, file_start, _ in self.file.ranges() if raw_hashes and chunk in raw_hashes}
+
+        # Sectors before resume_sector were checked by an earlier, interrupted run.
+        checkpoint = None
+        resume_sector = 0
+        if check_errors:
+            errors = defaultdict(list)
+            checkpoint = self.checkpoint() if config.checkpoint else None
+            if checkpoint is not None:
+                resume_sector = checkpoint.load(errors)
+            elif config.time_limit is not None:
+                # Checks stopped at the time limit couldn't be resumed.
+                print("Can't save the progress of the sector checks of {}, the time limit doesn't apply".format(
+                    self.file_name), file=sys.stderr)
+
+            n_p, n_q, n_edc = (sum(code in codes for codes in errors.values()) for code in ('p', 'q', 'edc'))
+            i = 0
+
+        verified = resume_sector  # Sectors before this one are checked, and their errors recorded.
+        last_save = time.monotonic()
+        deadline = None if config.time_limit is None else last_save + config.time_limit
+
+        try:
+            if check_errors or hashed:
+                for chunk, batch_start, batch_count, data, results in self.checked_batches(check_errors,
+                                                                                           resume_sector):
+                    if results is not None:
+                        for sector, (p, q, edc) in enumerate(results, batch_start):
+                            if not p:
+                                errors[sector].append('p')
+                                n_p += 1
+
+                            if not q:
+                                errors[sector].append('q')
+                                n_q += 1
+
+                            if not edc:
+                                errors[sector].append('edc')
+                                n_edc += 1
+
+                    batch_stop = batch_start + batch_count
+                    if check_errors:
+                        verified = max(verified, batch_stop)
+
+                    if stats.enabled:
+                        stats.count(sectors=batch_count, bytes=batch_count * self.sector_size)
+
+                    while pending and pending[0].sector < batch_stop:
+                        active.append(pending.popleft())
+
+                    if data is None and (active or hashed.get(chunk) == batch_start * self.sector_size):
+                        data = self.read_raw(batch_start * self.sector_size, batch_count * self.sector_size, view=True)
+
+                    if hashed.get(chunk) == batch_start * self.sector_size:
+                        raw_hashes[chunk].update(data)
+                        hashed[chunk] += len(data)
+
+                    if active:
+                        still_active = []
+                        for stream in active:
+                            if stream.sector < batch_start:
+                                # The file continues outside of the scanned sectors.
+                                unfinished.append(stream)
+                                continue
+
+                            while stream.remaining and stream.sector < batch_stop:
+                                stream.feed_sector(self.batch_user_data(data, stream.sector - batch_start))
+
+                            if stream.remaining:
+                                still_active.append(stream)
+                            else:
+                                stream.finish()
+
+                        active = still_active
+
+                    if check_errors:
+                        i += batch_count
+
+                        # Because this is so slow, show a status line.
+                        print_status('Checking sector {} of {} ({:.2f}%)... found {} P errors, {} Q errors, {} EDC errors   '.format(
+                            i, self.sector_count(), i/self.sector_count()*100, n_p, n_q, n_edc))
+
+                    if checkpoint is not None:
+                        now = time.monotonic()
+                        if now - last_save >= config.checkpoint_interval:
+                            checkpoint = self.save_checkpoint(checkpoint, verified, errors)
+                            last_save = now
+
+                        # Stop once out of time, but not before making progress (nor if it can't be resumed).
+                        if (checkpoint is not None and deadline is not None and now >= deadline and
+                                resume_sector < verified and verified < self.sector_count()):
+                            raise SystemExit('Stopped checking sectors of {} at sector {} of {}, run again to '
+                                             'resume'.format(self.file_name, verified, self.sector_count()))
+
+                if check_errors:
+                    print_status('\n')  # Print newlines.
+
+        except BaseException:
+            if checkpoint is not None:
+                print_status('\n')
+                self.save_checkpoint(checkpoint, verified, errors)
+
+            raise
+
+        if checkpoint is not None:
+            checkpoint.remove()
+
+        for stream in unfinished + active + list(pending):
+            if stats.enabled:
+                stats.count(bytes=stream.remaining)
+
+            for piece in self.iter_read(0, stream.remaining, stream.sector):
+                stream.write(piece)
+
+        for stream in streams:
+            stream.finish()
+
+        # Hash whatever was not covered by whole sectors.
+        for chunk, _, file_stop in self.file.ranges():
+            if chunk in hashed:
+                for offset in range(hashed[chunk], file_stop, self.batch_size * self.sector_size):
+                    raw_hashes[chunk].update(self.read_raw(offset, min(self.batch_size * self.sector_size,
+                                                                       file_stop - offset), view=True))
 
         return errors
 
-    def read_raw(self, offset, size):
+    def batch_user_data(self, data, index):
+        """Return the user data of the index-th sector in a batch of raw sectors."""
+        start = index * self.sector_size + self.data_offset
+
+        if self.format == 'mode2' and data[index * self.sector_size + 0x12] & 0x20:
+            return data[start:start + 2324]
+
+        return data[start:start + 2048]
+
+    def batches(self):
+        """
+        Split the sectors of every chunk of the file into contiguous batches.
+
+        :return: generator of (chunk index, first sector, sector count)
+        """
+        for chunk, file_start, file_stop in self.file.ranges():
+            sector_start, sector_stop = file_start // self.sector_size, file_stop // self.sector_size
+
+            for batch_start in range(sector_start, sector_stop, self.batch_size):
+                yield chunk, batch_start, min(self.batch_size, sector_stop - batch_start)
+
+    def checked_batches(self, check_errors=True, start=0):
+        """
+        Read and check all batches of sectors, in order. With config.jobs > 1 the batches are checked by worker
+        processes, which open the image themselves, so no sector data has to be sent to them (and the data is not
+        read by this process). The processes are those of self.executor if it is set, otherwise a pool of its own.
+
+        :param start: don't check (nor read) the batches before this sector
+        :return: generator of (chunk index, first sector, sector count, raw sector data or None,
+                 check_errors_batch() results or None if the batch is not checked)
+        """
+        # Worker processes read the image themselves, which is only worth it if they can read their batches directly.
+        parallel = hasattr(self.file, 'open_args') and getattr(self.file, 'random_access', True)
+        if not check_errors or config.jobs <= 1 or not parallel:
+            for chunk, batch_start, batch_count in self.batches():
+                if check_errors and batch_start + batch_count <= start:
+                    yield chunk, batch_start, batch_count, None, None
+                    continue
+
+                data = self.read_raw(batch_start * self.sector_size, batch_count * self.sector_size, view=True)
+                results = self.check_errors_batch(batch_start, batch_count, data) if check_errors else None
+
+                yield chunk, batch_start, batch_count, data, results
+
+            return
+
+        state = (type(self), self.file.open_args(), self.file_name,
+                 self.format, self.sector_size, self.skip_offset, self.data_offset)
+
+        executor = self.executor or ProcessPoolExecutor(max_workers=config.jobs)
+        try:
+            # Keep a few batches per worker in flight, so that results can be collected in order.
+            pending = deque()
+            for chunk, batch_start, batch_count in self.batches():
+                if batch_start + batch_count <= start:
+                    future = None
+                else:
+                    future = executor.submit(_check_errors_batch, state, batch_start, batch_count)
+                pending.append((chunk, batch_start, batch_count, future))
+
+                if len(pending) > 2 * config.jobs:
+                    chunk, batch_start, batch_count, future = pending.popleft()
+                    yield chunk, batch_start, batch_count, None, future and future.result()
+
+            while pending:
+                chunk, batch_start, batch_count, future = pending.popleft()
+                yield chunk, batch_start, batch_count, None, future and future.result()
+
+        finally:
+            if executor is not self.executor:
+                executor.shutdown()
+            else:
+                # Don't leave work of a stopped scan in the shared pool.
+                for _, _, _, future in pending:
+                    if future is not None:
+                        future.cancel()
+
+    def check_errors_batch(self, sector, count, data=None):
+        """
+        Check EDC and ECC of count consecutive sectors, starting at the given sector. The result is the same as
+        calling check_errors() on each sector, but the codes are computed for the whole batch at once (see edc_ecc).
+
+        :param data: raw sector data of the batch, if it was already read
+        :return: list of (ecc_p_valid, ecc_q_valid, edc_valid) tuples, one per sector
+        """
+        results = [(True, True, True)] * count
+
+        if self.format not in ('mode1', 'mode2'):
+            return results
+
+        if data is None:
+            data = self.read_raw(sector * self.sector_size, count * self.sector_size, view=True)
+
+        # Mode 2 sectors have different layouts depending on their form, so check each form separately.
+        if self.format == 'mode2':
+            forms = data[0x12::self.sector_size]
+            groups = [[i for i in range(count) if not forms[i] & 0x20],
+                      [i for i in range(count) if forms[i] & 0x20]]
+        else:
+            groups = [list(range(count))]
+
+        for group in groups:
+            if not group:
+                continue
+
+            if len(group) == count:
+                group_data = data
+            else:
+                group_data = b''.join([data[i*self.sector_size:(i+1)*self.sector_size] for i in group])
+
+            for i, result in zip(group, self._check_errors_group(group_data, len(group), sector + group[0])):
+                results[i] = result
+
+        return results
+
+    def _check_errors_group(self, data, count, first_sector):
+        """Check a batch of raw sectors which all have the same layout as first_sector."""
+        stride = self.sector_size
+        bad_p = bad_q = bad_edc = ()
+
+        edc_offset = self.edc_offset(first_sector)
+        if edc_offset is not None:
+            computed = edc_ecc.edc(data, count, self.skip_offset, edc_offset, stride)
+            stored = [struct.unpack_from('<I', data, i*stride + edc_offset)[0] for i in range(count)]
+
+            bad_edc = {i for i in range(count) if stored[i] != 0 and computed[i] != stored[i]}
+
+        ecc_offset = self.ecc_offset(first_sector)
+        if ecc_offset is not None:
+            zero_address = (self.format == 'mode2')
+
+            stored_p = edc_ecc.transpose(data, count, range(ecc_offset, ecc_offset + 86*2), stride)
+            stored_q = edc_ecc.transpose(data, count, range(ecc_offset + 86*2, ecc_offset + 86*2 + 52*2), stride)
+
+            bad_p = edc_ecc.mismatches(edc_ecc.ecc_p(data, count, stride, zero_address), stored_p, count)
+            bad_q = edc_ecc.mismatches(edc_ecc.ecc_q(data, count, stride, zero_address), stored_q, count)
+
+        return [(i not in bad_p, i not in bad_q, i not in bad_edc) for i in range(count)]
+
+    def read_raw(self, offset, size, view=False):
+        if view:
+            return super().read_view(offset, size)
+
         return super().read(offset, size)
 
     def read(self, offset, size, sector=0, raw=False):
@@ -244,32 +729,64 @@ class ISO9660Handler(BaseHandler):
             offset = offset + sector * self.sector_size
             return self.read_raw(offset, size)
 
-        # Walk to the actual sector. Sectors can have
-        # different sizes so we can't just calculate this.
-        sector_no = sector
-        while offset > self.data_size(sector_no):
-            offset -= self.data_size(sector_no)
-            sector_no += 1
+        if self.sector_cache is not None and size <= 2048:
+            # A small read, of metadata: fields of the same sector are read one after another.
+            sector_no, start = self.seek(offset, sector)
+            data_size, data = self.sector_cache.get(sector_no, self.cache_sector)
+            if start + size <= data_size:
+                return data[start:start + size]
+
+        return b''.join(self.iter_read(offset, size, sector))
+
+    def cache_sector(self, sector):
+        """:return: (user data size, user data) of a sector, for the sector cache"""
+        return self.data_size(sector), bytes(self.read_sector(sector, view=True))
+
+    def iter_read(self, offset, size, sector=0):
+        """
+        Read user data like read(), but yield it in pieces of at most one sector, so that large files can be
+        processed without holding them in memory. The pieces are memoryviews of the file, so nothing is copied.
+        """
+        sector_no, offset = self.seek(offset, sector)
 
-        chunks = []
         while size > 0:
-            sector = self.read_sector(sector_no)
+            sector = self.read_sector(sector_no, view=True)
             chunk_size = min(self.data_size(sector_no)-offset, size)
 
-            chunks.append(sector[offset:offset+chunk_size])
+            yield sector[offset:offset+chunk_size]
 
             sector_no += 1
             size -= chunk_size
             offset = 0
 
-        return b''.join(chunks)
+    def seek(self, offset, sector=0):
+        """
+        Find where user data at offset (counted from the start of the given sector) is.
+
+        :return: (sector, offset within the sector)
+        """
+        if self.format in ('mode1', 'iso'):
+            return sector + offset // 2048, offset % 2048
 
-    def read_sector(self, sector, raw=False):
+        if self.format == 'mode2':
+            position = self.layout.seek(sector, offset)
+            if position is not None:
+                return position
+
+        # Walk to the actual sector. Sectors can have
+        # different sizes so we can't just calculate this.
+        while offset > self.data_size(sector):
+            offset -= self.data_size(sector)
+            sector += 1
+
+        return sector, offset
+
+    def read_sector(self, sector, raw=False, view=False):
         if raw:
-            return self.read_raw(sector*self.sector_size, self.sector_size)
+            return self.read_raw(sector*self.sector_size, self.sector_size, view=view)
 
         else:
-            return self.read_raw(sector * self.sector_size + self.data_offset, self.data_size(sector))
+            return self.read_raw(sector * self.sector_size + self.data_offset, self.data_size(sector), view=view)
 
     def unpack(self, value_type, offset, size, sector, raw=False):
         format_dict = {
@@ -320,47 +837,78 @@ class ISO9660Handler(BaseHandler):
         elif value_type == 'string':
             return value.decode('ascii')
 
-    def files(self, sector=None, size=None, path=''):
-        offset = 0
+    def files(self, table=None, sector=None, size=None, parent=-1):
+        """
+        Walk the directory tree, starting with the root directory record.
+
+        :param table: FileList to add the records to (a new one by default)
+        :return: generator of DirectoryEntry objects
+        """
+        if table is None:
+            table = FileList()
+
         if sector is None:
             # Root directory record.
-            sector = self.pvd_sector
-            offset = 156
+            record = self.decode_record(self.read(0, 2048, self.pvd_sector), 156, table)
 
-        else:
-            # Skip self and parent records.
-            r_self = self.unpack_record(offset, sector)
-            offset += r_self['record_size']
-
-            parent = self.unpack_record(offset, sector)
-            offset += parent['record_size']
-
-        size_left = size
-        while size is None or offset < size_left:
-            record = self.unpack_record(offset, sector)
-
-            if record['record_size'] == 0:
-                if size is not None:
-                    size_left -= self.data_size(sector)
-                offset = 0
-                sector += 1
-                continue
+            yield record
 
-            if sector != self.pvd_sector:
-                record['path'] = path + '/' + record['name']
+            if record['is_directory']:
+                yield from self.files(table, record.sector, record.size, record.index)
 
-            else:
-                record['path'] = path
+            return
+
+        # Read the whole directory extent at once. Records don't cross sector boundaries, the rest of a sector
+        # after the last record is zero-filled.
+        data = self.read(0, -(-size // 2048) * 2048, sector)
+        if stats.enabled:
+            stats.count(sectors=len(data) // 2048, bytes=len(data))
+
+        # Skip self and parent records.
+        offset = data[0] if size else 0
+        offset += data[offset] if size else 0
+
+        while offset < size:
+            if data[offset] == 0:
+                offset = (offset // 2048 + 1) * 2048
+                continue
+
+            record = self.decode_record(data, offset, table, parent)
 
             yield record
 
-            if record['is_directory']:
-                yield from self.files(sector=record['sector'], size=record['size'], path=record['path'])
+            if record.flags & 2:
+                yield from self.files(table, record.sector, record.size, record.index)
 
-            offset += record['record_size']
+            offset += record.record_size
 
-            if sector == self.pvd_sector:
-                break
+    def decode_record(self, data, offset, table=None, parent=-1):
+        """
+        Decode the directory record at offset in data, which must contain the whole record (of non-zero size), and
+        add it to table. Gives the same fields as unpack_record(), which decodes the record field by field.
+
+        :param table: FileList to add the record to (a new one by default)
+        :param parent: index of the directory record containing the record
+        :return: DirectoryEntry
+        """
+        if table is None:
+            table = FileList()
+
+        (record_size, sector, size, year, month, day, hour, minute, second,
+         flag_bits, name_size) = _record_struct.unpack_from(data, offset)
+
+        name = bytes(data[offset+33:offset+33+name_size]).decode('ascii').strip()
+
+        if name == '\x00':
+            name = ''
+
+        # An invalid date fails here, rather than carrying over into the other fields of the packed date.
+        datetime(year+1900, month, day, hour, minute, second)
+
+        index = table.add(parent, name.replace(';1', ''), sector - self.sector_offset, size, record_size, flag_bits,
+                          table.pack_date(year+1900, month, day, hour, minute, second))
+
+        return DirectoryEntry(table, index)
 
     def unpack_record(self, offset, sector):
         record = {}
@@ -551,8 +1099,749 @@ class ISO9660Handler(BaseHandler):
         return edc
 
 
+# The fixed part of a directory record, up to the file identifier: record length, extent location (little endian),
+# data length (little endian), recording date and time (without the time zone), file flags and identifier length.
+# (http://wiki.osdev.org/ISO_9660#Directories)
+_record_struct = struct.Struct('<BxI4xI4x6BxB6xB')
+
+_record_flags = ((0, 'is_hidden'), (2, 'is_directory'), (4, 'is_associated'), (8, 'has_extended_format'),
+                 (16, 'has_extended_permissions'), (128, 'is_not_final'))
+_record_flag_bits = {text: binary for binary, text in _record_flags}
+_record_attributes = {'record_size', 'sector', 'size', 'date', 'name', 'path'}
+
+_digest_sizes = {'crc32': 4, 'md5': 16, 'sha1': 20}
+
+
+class FileList:
+    """
+    The directory records of an image, in directory order, stored column-wise in arrays.
+
+    Images can have hundreds of thousands of files, and a dict per record (with a datetime, a path string and hex
+    digests) adds up to hundreds of megabytes. Here a record takes a few dozen bytes: names are kept in one buffer,
+    paths are built from the parent records, dates are packed integers and digests are stored as raw bytes. Records
+    are accessed through DirectoryEntry views, which are created on demand.
+
+    Behaves like a read-only OrderedDict of path: DirectoryEntry. The root directory record is stored, as the parent of
+    the top level records, but not listed (see listed()).
+    """
+
+    def __init__(self):
+        self.parents = array('i')
+        self.name_offsets = array('I', [0])
+        self.names = bytearray()
+        self.sectors = array('q')
+        self.sizes = array('I')
+        self.record_sizes = bytearray()
+        self.flags = bytearray()
+        self.dates = array('Q')
+
+        self.algorithms = ()
+        self.digests = {}  # algorithm: bytearray of raw digests
+        self.hashed = bytearray()
+
+        self._listed = None
+
+    def add(self, parent, name, sector, size, record_size, flags, date):
+        """
+        Add a record.
+
+        :param parent: index of the parent directory record, or -1 for the root directory
+        :param date: packed date (see pack_date())
+        :return: index of the record
+        """
+        self.parents.append(parent)
+        self.names += name.encode('ascii')
+        self.name_offsets.append(len(self.names))
+        self.sectors.append(sector)
+        self.sizes.append(size)
+        self.record_sizes.append(record_size)
+        self.flags.append(flags)
+        self.dates.append(date)
+        self.hashed.append(0)
+        self._listed = None
+
+        for algorithm in self.algorithms:
+            self.digests[algorithm] += bytes(_digest_sizes[algorithm])
+
+        return len(self.parents) - 1
+
+    @staticmethod
+    def pack_date(year, month, day, hour, minute, second):
+        return (((((year << 4 | month) << 5 | day) << 5 | hour) << 6 | minute) << 6) | second
+
+    def name(self, index):
+        return self.names[self.name_offsets[index]:self.name_offsets[index+1]].decode('ascii')
+
+    def path(self, index):
+        names = []
+        while self.parents[index] != -1:
+            names.append(self.name(index))
+            index = self.parents[index]
+
+        names.append(self.name(index))
+
+        return '/'.join(reversed(names))
+
+    def longest_path(self):
+        """Length of the longest path, computed from the name lengths without building the paths."""
+        lengths = array('I')
+        longest = 0
+        for index, parent in enumerate(self.parents):
+            length = self.name_offsets[index+1] - self.name_offsets[index]
+            if parent != -1:
+                # Parents are added before their children.
+                length += lengths[parent] + 1
+                longest = max(longest, length)
+
+            lengths.append(length)
+
+        return longest
+
+    def date(self, index):
+        packed = self.dates[index]
+
+        return datetime(packed >> 26, packed >> 22 & 0xf, packed >> 17 & 0x1f, packed >> 12 & 0x1f,
+                        packed >> 6 & 0x3f, packed & 0x3f)  # TODO timezone
+
+    def hashes(self, index):
+        """:return: list of (algorithm, hex digest) pairs"""
+        if not self.hashed[index]:
+            return []
+
+        hashes = []
+        for algorithm in self.algorithms:
+            size = _digest_sizes[algorithm]
+            digest = self.digests[algorithm][index*size:(index+1)*size]
+            hashes.append((algorithm, binascii.hexlify(digest).decode('ascii')))
+
+        return hashes
+
+    def set_hashes(self, index, digests):
+        """
+        :param digests: dict of algorithm: hex digest (see MultiHash.hexdigests())
+        """
+        if tuple(digests) != self.algorithms:
+            if self.algorithms:
+                raise ValueError('All files must have the same hashes')
+
+            self.algorithms = tuple(digests)
+            self.digests = {algorithm: bytearray(_digest_sizes[algorithm] * len(self.parents))
+                            for algorithm in self.algorithms}
+
+        for algorithm, digest in digests.items():
+            size = _digest_sizes[algorithm]
+            self.digests[algorithm][index*size:(index+1)*size] = bytes.fromhex(digest)
+
+        self.hashed[index] = 1
+
+    def listed(self):
+        """
+        Indexes of the listed records, as in a dict of path: record: records without a name (such as the root
+        directory) are left out, and a path with several records (e.g. the extents of a multi-extent file) is listed
+        at its first record, with its last one.
+
+        :return: array of indexes
+        """
+        if self._listed is None:
+            listed = array('i')
+            first_records = {}  # (first record of the parent path, name): first record of the path
+            same_path = array('i')  # First record of the path of each record
+            positions = {}  # first record of a path: position in listed
+
+            for index, parent in enumerate(self.parents):
+                name = bytes(self.names[self.name_offsets[index]:self.name_offsets[index+1]])
+                first = first_records.setdefault((same_path[parent] if parent != -1 else -1, name), index)
+                same_path.append(first)
+
+                if parent == -1 or not name:
+                    continue
+
+                if first in positions:
+                    listed[positions[first]] = index
+                else:
+                    positions[first] = len(listed)
+                    listed.append(index)
+
+            self._listed = listed
+
+        return self._listed
+
+    def values(self):
+        return (DirectoryEntry(self, index) for index in self.listed())
+
+    def keys(self):
+        return (entry.path for entry in self.values())
+
+    def items(self):
+        return ((entry.path, entry) for entry in self.values())
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return len(self.listed())
+
+    def __getitem__(self, path):
+        # Linear, paths are not indexed to save memory. Entries are only looked up by path in tests.
+        for entry in self.values():
+            if entry.path == path:
+                return entry
+
+        raise KeyError(path)
+
+    def __contains__(self, path):
+        return any(entry.path == path for entry in self.values())
+
+    def __eq__(self, other):
+        if not hasattr(other, 'items'):
+            return NotImplemented
+
+        return list(self.items()) == list(other.items())
+
+    __hash__ = None
+
+
+class DirectoryEntry:
+    """
+    A record of a FileList. Behaves like the record dicts of unpack_record(), with the file hashes added, and the 'path'
+    key for the records in a directory.
+    """
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def name(self):
+        return self.table.name(self.index)
+
+    @property
+    def path(self):
+        return self.table.path(self.index)
+
+    @property
+    def sector(self):
+        return self.table.sectors[self.index]
+
+    @property
+    def size(self):
+        return self.table.sizes[self.index]
+
+    @property
+    def record_size(self):
+        return self.table.record_sizes[self.index]
+
+    @property
+    def flags(self):
+        return self.table.flags[self.index]
+
+    @property
+    def date(self):
+        return self.table.date(self.index)
+
+    def keys(self):
+        keys = ['record_size', 'sector', 'size']
+
+        for binary, text in _record_flags:
+            if self.flags & binary or text == 'is_directory':
+                keys.append(text)
+
+        keys += ['date', 'name']
+        if self.table.parents[self.index] != -1:
+            keys.append('path')
+        keys += [algorithm for algorithm, _ in self.table.hashes(self.index)]
+
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __getitem__(self, key):
+        if key in _record_attributes:
+            return getattr(self, key)
+
+        if key in _record_flag_bits:
+            if self.flags & _record_flag_bits[key]:
+                return True
+            if key == 'is_directory':
+                return False
+
+        for algorithm, digest in self.table.hashes(self.index):
+            if algorithm == key:
+                return digest
+
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, digests):
+        """Set file hashes, from a dict of algorithm: hex digest (see MultiHash.hexdigests())."""
+        self.table.set_hashes(self.index, digests)
+
+    def __eq__(self, other):
+        if not hasattr(other, 'items'):
+            return NotImplemented
+
+        return dict(self.items()) == dict(other.items())
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'DirectoryEntry({!r})'.format(OrderedDict(self.items()))
+
+
+def _wilson_upper_bound(errors, n, z=1.96):
+    """Upper bound of the Wilson score interval of a proportion: errors out of n (95% confidence by default)."""
+    p = errors / n
+    center = p + z*z / (2*n)
+    margin = z * ((p*(1 - p) + z*z / (4*n)) / n) ** 0.5
 
+    return min(1.0, (center + margin) / (1 + z*z / n))
 
 
+class Checkpoint:
+    """
+    Progress of the sector checks of an image, saved to a sidecar file, so that checks that were interrupted (or
+    stopped after config.time_limit) can be resumed by the next run.
 
+    The image files and the way sectors are read are saved along with the progress, so that a checkpoint of a different
+    image (or of a changed one) is not used.
+    """
 
+    def __init__(self, path, file_names, settings):
+        self.path = path
+        self.image = {'files': [[os.path.abspath(file_name), os.stat(file_name).st_size, os.stat(file_name).st_mtime_ns]
+                                for file_name in file_names],
+                      'settings': settings}
+
+    def load(self, errors):
+        """
+        Add the saved errors to errors (a dict of sector: error list).
+
+        :return: the first sector that is not checked yet (0 without a valid checkpoint)
+        """
+        try:
+            with open(self.path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return 0
+
+        if checkpoint.get('image') != self.image:
+            return 0
+
+        for sector, codes in checkpoint['errors']:
+            errors[sector] = codes
+
+        return checkpoint['next_sector']
+
+    def save(self, next_sector, errors):
+        """
+        :param next_sector: the first sector that is not checked yet, errors after it are not saved
+        """
+        checkpoint = {
+            'image': self.image,
+            'next_sector': next_sector,
+            'errors': [[sector, codes] for sector, codes in errors.items() if sector < next_sector],
+        }
+
+        # Write the file atomically, an interruption must not leave a truncated checkpoint behind.
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(checkpoint, f)
+
+        os.replace(temporary_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class SectorCache:
+    """
+    LRU cache of sectors, for the small reads of metadata parsing (volume descriptors, headers, directory records):
+    each sector is read, and its user data extracted, once rather than once per field.
+    """
+
+    def __init__(self, size):
+        """
+        :param size: number of sectors to keep
+        """
+        self.size = size
+        self.sectors = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sector, read):
+        """
+        :param read: function reading a sector that isn't cached
+        """
+        try:
+            value = self.sectors[sector]
+        except KeyError:
+            self.misses += 1
+
+            value = self.sectors[sector] = read(sector)
+            if len(self.sectors) > self.size:
+                self.sectors.popitem(last=False)
+
+            return value
+
+        self.hits += 1
+        self.sectors.move_to_end(sector)
+
+        return value
+
+
+class SectorLayout:
+    """
+    Index of Mode 2 sector forms (and thus user data sizes), so that user data offsets can be mapped to sectors
+    without reading the subheader of every sector on the way. The index is built lazily, in blocks of sectors, each
+    from a single strided read of the subheaders.
+    """
+    block_size = 1024
+
+    def __init__(self, handler):
+        self.file = handler.file
+        self.sector_size = handler.sector_size
+
+        ranges = list(handler.sector_ranges())
+        self.starts = [start for start, _ in ranges]
+        self.stops = [stop for _, stop in ranges]
+
+        # First sector of block: (last sector, submodes, cumulative user data sizes or None if they're all 2048).
+        self.blocks = {}
+
+    def block(self, sector):
+        """Return (first sector, last sector, submodes, cumulative sizes) of the block of the sector, if any."""
+        index = bisect_right(self.starts, sector) - 1
+        if index < 0 or sector >= self.stops[index]:
+            return None
+
+        start = self.starts[index]
+        first = start + (sector - start) // self.block_size * self.block_size
+
+        if first not in self.blocks:
+            last = min(first + self.block_size, self.stops[index])
+            submodes = self.file[first*self.sector_size + 0x12:(last-1)*self.sector_size + 0x13:self.sector_size]
+
+            cumulative = None
+            if any(submode & 0x20 for submode in submodes):
+                sizes = (2324 if submode & 0x20 else 2048 for submode in submodes)
+                cumulative = array('L', accumulate(chain([0], sizes)))
+
+            self.blocks[first] = (last, submodes, cumulative)
+
+        last, submodes, cumulative = self.blocks[first]
+
+        return first, last, submodes, cumulative
+
+    def submode(self, sector):
+        """Return the subheader submode byte of the sector, or None if the sector is not within the file."""
+        block = self.block(sector)
+        if block is None:
+            return None
+
+        first, _, submodes, _ = block
+
+        return submodes[sector - first]
+
+    def seek(self, sector, offset):
+        """See ISO9660Handler.seek(). Returns None if the offset is not within the file."""
+        while True:
+            block = self.block(sector)
+            if block is None:
+                return None
+
+            first, last, _, cumulative = block
+
+            if cumulative is None:
+                if offset < (last - sector) * 2048:
+                    return sector + offset // 2048, offset % 2048
+
+                offset -= (last - sector) * 2048
+
+            else:
+                target = cumulative[sector - first] + offset
+                if target < cumulative[-1]:
+                    index = bisect_right(cumulative, target) - 1
+                    return first + index, target - cumulative[index]
+
+                offset = target - cumulative[-1]
+
+            sector = last
+
+
+class FileStream:
+    """
+    Compute the hashes of a file (and extract it) from its user data, which is fed in order, usually a sector at a time.
+    """
+    __slots__ = ('file', 'sector', 'remaining', 'hash', 'extract_path', 'extractor', 'copy_offset', 'track_name',
+                 'output', 'finished')
+
+    def __init__(self, file, extract_path=None, track_name='', hashes=('crc32',), extractor=None, copy_offset=None):
+        """
+        :param extractor: Extractor writing the file to extract_path
+        :param copy_offset: offset of the file data in the image, if it is contiguous there: it is then copied from
+                            the image rather than written from the data fed
+        """
+        self.file = file
+        self.sector = file['sector']  # The next sector to feed.
+        self.remaining = file['size']
+        self.hash = MultiHash(hashes)
+
+        self.extract_path = extract_path
+        self.extractor = extractor
+        self.copy_offset = copy_offset
+        self.track_name = track_name
+        self.output = None
+        self.finished = False
+
+    def feed_sector(self, data):
+        self.write(data)
+        self.sector += 1
+
+    def write(self, data):
+        if self.extract_path is not None and self.output is None:
+            self.open()
+
+        data = data[:self.remaining]
+        self.remaining -= len(data)
+
+        self.hash.update(data)
+        if self.output is not None and self.copy_offset is None:
+            self.output.write(data)
+
+    def open(self):
+        self.output = self.extractor.open(self.extract_path, self.file['size'])
+
+    def finish(self):
+        if self.finished:
+            return
+
+        self.finished = True
+        self.file.update(self.hash.hexdigests())
+        events.emit_file(self.track_name, self.file)
+
+        if self.extract_path is not None:
+            if self.output is None:
+                self.open()
+
+            if self.copy_offset is not None:
+                self.output.copy(self.copy_offset, self.file['size'])
+
+            timestamp = None
+            if isinstance(self.file['date'], datetime):
+                timestamp = self.file['date'].timestamp()
+
+            self.output.close(timestamp)
+
+
+class Extractor:
+    """
+    Write extracted files in the background, from a pool of threads, so that writing overlaps with reading the image,
+    hashing and checking sectors. Files are preallocated and written in large blocks. Files which are contiguous in
+    the image (with 2048-byte sectors) are copied from it by the OS where possible (copy_file_range()), without going
+    through this process.
+    """
+    threads = 4
+    block_size = 4 * 2**20  # Data is written in blocks of this size.
+    max_pending = 64 * 2**20  # At most this much data waits to be written.
+
+    def __init__(self, image=None, track_name=''):
+        """
+        :param image: MmappedFile of the image, to copy files from
+        """
+        self.image = image
+        self.track_name = track_name
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+
+        self.pending = deque()  # (future, size of its data)
+        self.pending_size = 0
+
+        self.n_files = 0
+        self.size = 0
+        self.start = time.perf_counter()
+        self.last_status = self.start
+
+    def open(self, path, size):
+        """:return: ExtractedFile"""
+        self.n_files += 1
+
+        return ExtractedFile(self, path, size)
+
+    def submit(self, function, *args, data_size=0, size=0):
+        """
+        Run a write in the background.
+
+        :param data_size: size of the data held until the write is done
+        :param size: bytes written
+        """
+        future = self.executor.submit(function, *args)
+        self.pending.append((future, data_size))
+        self.pending_size += data_size
+        self.size += size
+
+        # Raise errors of finished writes, and wait for writes when too much data is waiting.
+        while self.pending and (self.pending[0][0].done() or self.pending_size > self.max_pending):
+            done, data_size = self.pending.popleft()
+            done.result()
+            self.pending_size -= data_size
+
+        now = time.perf_counter()
+        if now - self.last_status >= 0.5:
+            self.last_status = now
+            print_status('Extracting{}: {} files, {:.1f} MB ({:.1f} MB/s)   '.format(
+                self.display_name(), self.n_files, self.size / 2**20, self.size / 2**20 / (now - self.start)))
+
+        return future
+
+    def close(self):
+        """Wait for all writes to be done."""
+        try:
+            while self.pending:
+                self.pending.popleft()[0].result()
+        finally:
+            self.executor.shutdown()
+
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        print_status('Extracted{}: {} files, {:.1f} MB in {:.1f}s ({:.1f} MB/s)   '.format(
+            self.display_name(), self.n_files, self.size / 2**20, elapsed, self.size / 2**20 / elapsed))
+
+    def display_name(self):
+        return ' ' + self.track_name if self.track_name else ''
+
+
+class ExtractedFile:
+    """
+    A file written by an Extractor. Each write is at its own offset, so they don't have to be done in order; they are
+    serialized by a lock.
+    """
+
+    def __init__(self, extractor, path, size):
+        self.extractor = extractor
+        self.path = path
+
+        self.output = open(path, 'wb', buffering=0)
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.output.fileno(), 0, size)
+            except OSError:
+                # Not supported by the file system.
+                pass
+
+        self.lock = threading.Lock()
+        self.futures = []
+        self.buffer = bytearray()
+        self.length = 0  # Of the data written (or buffered), the file is truncated to it in the end.
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.extractor.block_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        data, self.buffer = self.buffer, bytearray()
+        self.futures.append(self.extractor.submit(self.write_at, self.length, data, data_size=len(data),
+                                                  size=len(data)))
+        self.length += len(data)
+
+    def copy(self, offset, size):
+        """Copy size bytes at offset of the image, or up to the end of the image."""
+        size = max(0, min(size, len(self.extractor.image) - offset))
+        self.futures.append(self.extractor.submit(self.copy_at, self.length, offset, size, size=size))
+        self.length += size
+
+    def close(self, timestamp=None):
+        """Close the file once its writes are done, and set its modification time."""
+        self.flush()
+        self.extractor.submit(self.close_when_written, timestamp)
+
+    def write_at(self, position, data):
+        view = memoryview(data)
+        with self.lock:
+            self.output.seek(position)
+            while view:
+                view = view[self.output.write(view):]
+
+    def copy_at(self, position, offset, size):
+        image = self.extractor.image
+        with self.lock:
+            while size > 0:
+                copied = _copy_range(image, offset, self.output, position, size)
+                if not copied:
+                    break
+
+                position += copied
+                offset += copied
+                size -= copied
+
+    def close_when_written(self, timestamp):
+        # The writes were submitted before, so they are already running (or done) in other threads.
+        for future in self.futures:
+            future.result()
+
+        with self.output:
+            self.output.truncate(self.length)
+
+        if timestamp is not None:
+            os.utime(self.path, (timestamp, timestamp))
+
+
+def _copy_range(image, offset, output, position, size):
+    """
+    Copy data of the image file to the output file, within the OS if possible.
+
+    :return: bytes copied
+    """
+    size = min(size, 2**30)
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            copied = os.copy_file_range(image.file.fileno(), output.fileno(), size, offset, position)
+            if copied:
+                return copied
+        except OSError:
+            # E.g. between file systems, with older kernels.
+            pass
+
+    chunk = image[offset:offset + min(size, Extractor.block_size)]
+    data = memoryview(chunk)
+    output.seek(position)
+    while data:
+        data = data[output.write(data):]
+
+    return len(chunk)
+
+
+_worker_files = {}
+
+
+def _check_errors_batch(state, sector, count):
+    """Run ISO9660Handler.check_errors_batch() in a worker process."""
+    handler_class, open_args, file_name, format, sector_size, skip_offset, data_offset = state
+
+    key = repr(open_args)
+    if key not in _worker_files:
+        _worker_files[key] = reopen(open_args)
+
+    handler = handler_class(file=_worker_files[key], file_name=file_name)
+    handler.format = format
+    handler.sector_size = sector_size
+    handler.skip_offset = skip_offset
+    handler.data_offset = data_offset
+
+    return handler.check_errors_batch(sector, count)
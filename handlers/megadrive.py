@@ -1,10 +1,12 @@
 import re
-from .base_handler import BaseHandler
+from .base_handler import BaseHandler, Signature
 
 
 class MegadriveHandler(BaseHandler):
+    signatures = [Signature(0x100, re.compile(b'sega mega drive|sega genesis', re.I), 0x10)]
+
     def test(self):
-        if re.search(b'sega mega drive|sega genesis', self.file[0x100:0x110], re.I):
+        if re.search(b'sega mega drive|sega genesis', self.read(0x100, 0x10), re.I):
             print('Type: Megadrive ROM')
             return True
 
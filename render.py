@@ -0,0 +1,124 @@
+"""
+Text and wiki output.
+
+The info is written straight to a stream as it is walked, in a single pass, rather than built up as a string: file
+lists can have hundreds of thousands of entries.
+"""
+from itertools import chain
+import config
+
+
+def is_file_list(obj):
+    return isinstance(obj, dict) and obj.get('type', '') == 'file_list'
+
+
+def longest_path(files):
+    if hasattr(files, 'longest_path'):
+        # FileList, computed without building the paths.
+        return files.longest_path()
+
+    return max((len(path) for path in files.keys()), default=0)
+
+
+def file_digests(file):
+    """:return: list of (algorithm, hex digest) pairs of a file list entry"""
+    digests = []
+    for name in config.hash_algorithms:
+        digest = file.get(name)
+        if digest is not None:
+            digests.append((name, digest))
+
+    return digests
+
+
+def write_text(obj, out, indent=0):
+    """
+    Write info as indented text.
+
+    :param out: text stream
+    """
+    padding = ' ' * indent * 2
+
+    if not isinstance(obj, dict):
+        out.write('{}{}'.format(padding, obj))
+
+    elif is_file_list(obj):
+        files = obj['value']
+        path_padding = min(40, longest_path(files) + 1)
+
+        for file in files.values():
+            digests = ''.join('{}: {}, '.format(name, digest) for name, digest in file_digests(file))
+            out.write('{}{:<{}}({}, {}sector: {}, {} bytes)\n'.format(padding, file['path'], path_padding,
+                                                                      file['date'], digests,
+                                                                      file['sector'], file['size']))
+
+    else:
+        for key, value in obj.items():
+            if _is_multiline(value):
+                out.write('{}{}:\n'.format(padding, key))
+                write_text(value, out, indent + 1)
+                out.write('\n')
+            elif isinstance(value, dict):
+                # Empty.
+                out.write('{}{}: \n'.format(padding, key))
+            else:
+                out.write('{}{}: {}\n'.format(padding, key, str(value).lstrip()))
+
+
+def _is_multiline(value):
+    """Whether the text of a value spans several lines, and so goes below its key rather than next to it."""
+    if is_file_list(value):
+        return len(value['value']) > 0
+    elif isinstance(value, dict):
+        return len(value) > 0
+    else:
+        return '\n' in str(value)
+
+
+def write_wiki(obj, out, level=2):
+    """
+    Write info as MediaWiki markup: nested dicts become sections, values a bulleted list and file lists tables.
+
+    :param out: text stream
+    :param level: heading level of the sections
+    """
+    for key, value in obj.items():
+        if is_file_list(value):
+            out.write('{0} {1} {0}\n'.format('=' * level, key))
+            write_wiki_file_list(value['value'], out)
+        elif isinstance(value, dict):
+            out.write('{0} {1} {0}\n'.format('=' * level, key))
+            write_wiki(value, out, level + 1)
+        else:
+            out.write("* '''{}:''' {}\n".format(key, wiki_escape(value)))
+
+
+def write_wiki_file_list(files, out):
+    entries = iter(files.values())
+    first = next(entries, None)
+    if first is None:
+        return
+
+    algorithms = [name for name, _ in file_digests(first)]
+
+    out.write('{| class="wikitable sortable"\n')
+    out.write('! Path !! Date !! {}Sector !! Size\n'.format(''.join(name.upper() + ' !! ' for name in algorithms)))
+
+    for file in chain([first], entries):
+        digests = dict(file_digests(file))
+        out.write('|-\n| {} || {} || {}{} || {}\n'.format(
+            wiki_escape(file['path']), file['date'], ''.join(digests.get(name, '') + ' || ' for name in algorithms),
+            file['sector'], file['size']))
+
+    out.write('|}\n')
+
+
+def wiki_escape(value):
+    if isinstance(value, (list, tuple)):
+        value = ', '.join(str(item) for item in value)
+
+    text = str(value)
+    if any(c in text for c in '[]{}|<>') or "''" in text or text.startswith(('*', '#', ':', ';', '=', ' ')):
+        return '<nowiki>{}</nowiki>'.format(text)
+
+    return text
@@ -1,16 +1,27 @@
 #!/usr/bin/env python3
+import sys
+import archive
+import batch
 import config
 from analyze import analyze_file
-from utils import MmappedFile
 
 
 def main(args=None):
     config.parse_args(args=args)
 
-    for filename in config.files:
-        with MmappedFile(filename) as file:
+    if len(config.files) == 1 and config.files_from is None:
+        # A single file. Errors are fatal, and the jobs (if any) check its sectors.
+        filename = config.files[0]
+        with archive.open_file(filename) as file:
             analyze_file(file, filename)
 
+        return 0
+
+    if batch.run(batch.file_names(), jobs=config.jobs, ordered=not config.unordered):
+        return 1
+
+    return 0
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
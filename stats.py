@@ -0,0 +1,142 @@
+"""
+Instrumentation of the stages of an analysis (--stats): wall and CPU time, call counts and counters such as the bytes
+read and sectors visited, per stage.
+
+Stages nest, and a stage is recorded under its path, e.g. analyze_file/get_info/Track 3+5/scan. The counters of a
+stage include those of the stages within it. CPU time is that of the whole process (all of its threads), it doesn't
+include worker processes.
+
+Instrumentation is off by default. Stages are only entered a few times per image, but counters are updated from loops
+over batches of sectors, so callers check enabled before calling count(). Besides the output of --stats, listeners
+(see enable()) are told about every stage as it ends.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+enabled = False
+
+_listeners = []
+_stages = OrderedDict()  # path: Stage
+_lock = threading.Lock()
+
+# The stages a thread is in, as a tuple of (path, Stage).
+_local = threading.local()
+
+
+class Stage:
+    __slots__ = ('calls', 'wall', 'cpu', 'counters')
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.counters = OrderedDict()
+
+    def as_dict(self):
+        figures = OrderedDict([('calls', self.calls), ('wall', round(self.wall, 6)), ('cpu', round(self.cpu, 6))])
+        figures.update(self.counters)
+
+        return figures
+
+
+def enable(listener=None):
+    """
+    Start recording stages.
+
+    :param listener: function called with (path, figures) whenever a stage ends, figures being a dict as in collect()
+    """
+    global enabled
+
+    enabled = True
+    if listener is not None and listener not in _listeners:
+        _listeners.append(listener)
+
+
+def disable():
+    global enabled
+
+    enabled = False
+    del _listeners[:]
+
+
+def reset():
+    """Forget the recorded stages, e.g. before the next image."""
+    with _lock:
+        _stages.clear()
+
+
+def collect():
+    """
+    :return: OrderedDict of stage path: figures (calls, wall and CPU seconds, counters), in the order the stages were
+             first entered
+    """
+    with _lock:
+        return OrderedDict((path, stage.as_dict()) for path, stage in _stages.items())
+
+
+def current():
+    return getattr(_local, 'stack', ())
+
+
+@contextmanager
+def stage(name):
+    """Record the time spent in the with block as a stage within the current one."""
+    if not enabled:
+        yield
+        return
+
+    outer = current()
+    path = outer[-1][0] + '/' + name if outer else name
+
+    with _lock:
+        record = _stages.get(path)
+        if record is None:
+            record = _stages[path] = Stage()
+
+    _local.stack = outer + ((path, record),)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        _local.stack = outer
+
+        with _lock:
+            record.calls += 1
+            record.wall += wall
+            record.cpu += cpu
+            figures = record.as_dict()
+
+        for listener in _listeners:
+            listener(path, figures)
+
+
+def count(**counters):
+    """Add to the counters of the current stage (and of the stages it is in)."""
+    with _lock:
+        for _, record in current():
+            for name, value in counters.items():
+                record.counters[name] = record.counters.get(name, 0) + value
+
+
+def inherit(function):
+    """
+    Wrap a function to be run in another thread (e.g. by a thread pool), so that its stages are recorded within the
+    current stage of this thread.
+    """
+    if not enabled:
+        return function
+
+    stack = current()
+
+    def run(*args, **kwargs):
+        outer = current()
+        _local.stack = stack
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.stack = outer
+
+    return run
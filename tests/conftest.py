@@ -0,0 +1,34 @@
+import pytest
+
+import archive
+import ecm
+from analyze import find_handler, pretty_print
+from archive import ArchiveFile, open_file
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    # Archives are read through many blocks, seek points and decoder snapshots, and few blocks are cached.
+    monkeypatch.setattr(ArchiveFile, 'block_size', 4096)
+    monkeypatch.setattr(ArchiveFile, 'cached_blocks', 2)
+    monkeypatch.setattr(ArchiveFile, 'snapshot_interval', 16384)
+    monkeypatch.setattr(ecm.EcmDecoder, 'batch_size', 3)
+    monkeypatch.setattr(archive, '_indexes', {})
+
+
+def compare_with_raw(path, compressed_path):
+    """
+    Analyze an image and its compressed copy, which must give the same output.
+
+    :return: the output, as text
+    """
+    outputs = []
+    for file_name in (path, compressed_path):
+        with open_file(file_name) as file:
+            handler = find_handler(file, getattr(file, 'image_name', file_name))
+            handler.get_info()
+            outputs.append(pretty_print(handler.info))
+
+    assert outputs[0] == outputs[1]
+
+    return outputs[0]
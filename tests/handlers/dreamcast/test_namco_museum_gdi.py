@@ -1,3 +1,5 @@
+import os
+
 import pytest
 
 import config
@@ -23,3 +25,34 @@ def test_namco_gdi():
 
         assert pretty_print(handler.info) == expected_output
 
+
+def test_parallel_tracks(tmpdir, monkeypatch):
+    # The fixture without track 5, so that tracks 1 and 3 are separate data tracks.
+    directory = "tests/handlers/dreamcast/namco_museum"
+    with open(os.path.join(directory, "disc.gdi")) as f:
+        lines = f.read().splitlines()
+
+    file_name = str(tmpdir.join("disc.gdi"))
+    with open(file_name, "w") as f:
+        f.write("\n".join(["4"] + lines[1:5]) + "\n")
+
+    for line in lines[1:5]:
+        track_file = line.split()[4]
+        os.symlink(os.path.abspath(os.path.join(directory, track_file)), str(tmpdir.join(track_file)))
+
+    monkeypatch.setattr(config, 'skip_sector_errors', False)
+    monkeypatch.setattr(config, 'hashes', ('crc32', 'md5'))
+
+    outputs = []
+    for jobs in (1, 2):
+        monkeypatch.setattr(config, 'jobs', jobs)
+
+        with MmappedFile(file_name) as file:
+            handler = GDIHandler(file=file, file_name=file_name)
+            assert handler.test()
+            handler.get_info()
+
+        outputs.append(pretty_print(handler.info))
+
+    assert list(handler.info['Tracks']) == ['Track 1', 'Track 2', 'Track 3', 'Track 4']
+    assert outputs[0] == outputs[1]
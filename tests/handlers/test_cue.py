@@ -0,0 +1,103 @@
+import os
+import zlib
+
+import config
+
+from analyze import pretty_print
+from benchmarks.synthetic import build_iso, raw_image
+from handlers.cue import CueHandler
+from handlers.dreamcast import DCDataTrackHandler
+from utils import MmappedFile
+
+DIRECTORY = "tests/handlers/dreamcast/namco_museum"
+
+
+def analyze(path):
+    with MmappedFile(path) as file:
+        handler = CueHandler(file=file, file_name=path)
+        assert handler.test()
+        handler.get_info()
+
+    return handler.info
+
+
+def test_split_and_single_file(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'skip_sector_errors', False)
+    monkeypatch.setattr(config, 'hashes', ('crc32',))
+
+    # Tracks 1 and 2 of the GDI fixture, in a file each and in a single file.
+    with open(os.path.join(DIRECTORY, 'track01.bin'), 'rb') as f:
+        track1 = f.read()
+    with open(os.path.join(DIRECTORY, 'track02.raw'), 'rb') as f:
+        track2 = f.read()
+
+    for name, data in (('track01.bin', track1), ('track02.bin', track2), ('disc.bin', track1 + track2)):
+        tmpdir.join(name).write_binary(data)
+
+    tmpdir.join('split.cue').write('FILE "track01.bin" BINARY\n'
+                                   '  TRACK 01 MODE1/2352\n'
+                                   '    INDEX 01 00:00:00\n'
+                                   'FILE "track02.bin" BINARY\n'
+                                   '  TRACK 02 AUDIO\n'
+                                   '    INDEX 00 00:00:00\n'
+                                   '    INDEX 01 00:02:00\n')
+    tmpdir.join('single.cue').write('REM COMMENT "single file"\n'
+                                    'FILE "disc.bin" BINARY\n'
+                                    '  TRACK 01 MODE1/2352\n'
+                                    '    INDEX 01 00:00:00\n'
+                                    '  TRACK 02 AUDIO\n'
+                                    '    INDEX 00 00:08:06\n'
+                                    '    INDEX 01 00:10:06\n')
+
+    split = analyze(str(tmpdir.join('split.cue')))
+    single = analyze(str(tmpdir.join('single.cue')))
+
+    # The hashes of the tracks are those of the split files, only their names differ.
+    assert list(single['Tracks']['Track 2']['Hashes']) == ['disc.bin [1425312:2662464]']
+    for track_name in ('Track 1', 'Track 2'):
+        assert list(split['Tracks'][track_name]['Hashes'].values()) == \
+               list(single['Tracks'][track_name]['Hashes'].values())
+        del split['Tracks'][track_name]['Hashes'], single['Tracks'][track_name]['Hashes']
+
+    assert pretty_print(split) == pretty_print(single)
+
+    # The data track is analyzed as on its own.
+    path = str(tmpdir.join('track01.bin'))
+    with MmappedFile(path) as file:
+        handler = DCDataTrackHandler(file=file, file_name=path)
+        assert handler.test()
+        handler.get_info()
+
+    assert pretty_print(single['Tracks']['Track 1']) == pretty_print(handler.info)
+
+
+def test_pregap(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'skip_sector_errors', False)
+    monkeypatch.setattr(config, 'hashes', ('crc32',))
+
+    # An audio track, then a data track starting at sector 100 + 150, after its pregap.
+    audio = (bytes(range(256)) * 1000)[:100 * 2352]
+    pregap = bytes(150 * 2352)
+    data = raw_image(build_iso(20, (0, 10000), seed=3, sector_base=250), first_sector=250, errors=[20])
+
+    tmpdir.join('disc.bin').write_binary(audio + pregap + data)
+    tmpdir.join('disc.cue').write('FILE "disc.bin" BINARY\n'
+                                  '  TRACK 01 AUDIO\n'
+                                  '    INDEX 01 00:00:00\n'
+                                  '  TRACK 02 MODE1/2352\n'
+                                  '    INDEX 00 00:01:25\n'
+                                  '    INDEX 01 00:03:25\n')
+
+    outputs = []
+    for jobs in (1, 2):
+        monkeypatch.setattr(config, 'jobs', jobs)
+        info = analyze(str(tmpdir.join('disc.cue')))
+        outputs.append(pretty_print(info))
+
+    assert outputs[0] == outputs[1]
+
+    track = info['Tracks']['Track 2']
+    assert len(track['Files']['value']) == 20
+    assert list(track['Errors']) == [20]
+    assert track['Hashes']['disc.bin [235200:{}]'.format(len(audio + pregap + data))]['crc32'] == \
+        '{:08x}'.format(zlib.crc32(pregap + data))
@@ -0,0 +1,371 @@
+import hashlib
+import os
+import zipfile
+from collections import OrderedDict
+from datetime import datetime
+
+import pytest
+
+import archive
+import config
+
+from benchmarks.synthetic import build_iso
+from handlers.dreamcast import DCDataTrackHandler
+from handlers.iso9660 import Checkpoint, Extractor, FileList, ISO9660Handler, SectorCache
+from utils import FileSlice, MmappedFile
+
+TRACK = "tests/handlers/dreamcast/namco_museum/track01.bin"
+
+
+def corrupted_track(tmpdir):
+    with open(TRACK, 'rb') as f:
+        data = bytearray(f.read())
+
+    for sector in (3, 150, 151, 400, 605):
+        data[sector*2352 + (sector * 7) % 2340 + 12] ^= 0x55
+
+    path = str(tmpdir.join('track01.bin'))
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    return path
+
+
+def find_sector_errors(path, jobs):
+    config.jobs = jobs
+    try:
+        with MmappedFile(path) as file:
+            handler = ISO9660Handler(file=file, file_name=path)
+            assert handler.test()
+            handler.batch_size = 50
+
+            return handler.find_sector_errors()
+    finally:
+        config.jobs = 1
+
+
+def test_parallel_sector_errors(tmpdir):
+    path = corrupted_track(tmpdir)
+
+    errors = find_sector_errors(path, jobs=1)
+    assert sorted(errors) == [3, 150, 151, 400, 605]
+
+    for jobs in (2, 3):
+        assert find_sector_errors(path, jobs=jobs) == errors
+
+
+def file_list(path, batch_size, jobs, skip_sector_errors):
+    config.jobs = jobs
+    config.skip_sector_errors = skip_sector_errors
+    try:
+        with MmappedFile(path) as file:
+            handler = ISO9660Handler(file=file, file_name=path)
+            assert handler.test()
+            handler.batch_size = batch_size
+            handler.get_info()
+
+            return handler.info['Files']['value'], handler.info.get('Errors')
+    finally:
+        config.jobs = 1
+        config.skip_sector_errors = False
+
+
+def test_fused_scan(tmpdir):
+    path = corrupted_track(tmpdir)
+
+    files, errors = file_list(path, batch_size=1024, jobs=1, skip_sector_errors=True)
+    assert errors is None
+    assert files['/WARNING.DA']['crc32'] != 'd9c0ac53'  # Corrupted.
+
+    for batch_size, jobs in ((7, 1), (50, 2)):
+        assert file_list(path, batch_size, jobs, skip_sector_errors=False) == (files, find_sector_errors(path, 1))
+
+
+def test_iter_read():
+    with MmappedFile(TRACK) as file:
+        handler = ISO9660Handler(file=file, file_name=TRACK)
+        assert handler.test()
+
+        chunks = list(handler.iter_read(1000, 883648, 24))
+
+    # The user data of Mode 1 sectors, sliced from the raw track.
+    with open(TRACK, 'rb') as f:
+        raw = f.read()
+    user_data = b''.join(raw[sector * 2352 + 16:sector * 2352 + 16 + 2048] for sector in range(24, 24 + 432))
+
+    assert max(len(chunk) for chunk in chunks) == 2048
+    assert b''.join(chunks) == user_data[1000:1000 + 883648]
+
+
+def test_file_hashes():
+    config.hashes = ['crc32', 'md5', 'sha1']
+    try:
+        files, _ = file_list(TRACK, batch_size=100, jobs=1, skip_sector_errors=False)
+    finally:
+        config.hashes = None
+
+    with MmappedFile(TRACK) as file:
+        handler = ISO9660Handler(file=file, file_name=TRACK)
+        assert handler.test()
+        contents = handler.read(0, 883648, 24)
+
+    assert files['/WARNING.DA']['crc32'] == 'd9c0ac53'
+    assert files['/WARNING.DA']['md5'] == hashlib.md5(contents).hexdigest()
+    assert files['/WARNING.DA']['sha1'] == hashlib.sha1(contents).hexdigest()
+
+
+def test_mode2_seek(tmpdir):
+    # Mixed form 1 and form 2 sectors, with their sector number in every user data byte.
+    forms = [1]*1500 + [2, 1, 1]*300 + [2]*700
+    user_data = []
+    sectors = []
+    for i, form in enumerate(forms):
+        size = 2048 if form == 1 else 2324
+        sector = bytearray(2352)
+        sector[0x12] = 0x20 if form == 2 else 0x08
+        sector[0x18:0x18+size] = bytes([i % 251]) * size
+
+        sectors.append(sector)
+        user_data.append(sector[0x18:0x18+size])
+
+    path = str(tmpdir.join('mode2.bin'))
+    with open(path, 'wb') as f:
+        f.write(b''.join(sectors))
+
+    with MmappedFile(path) as file:
+        handler = ISO9660Handler(file=file, file_name=path)
+        handler.format = 'mode2'
+        handler.sector_size = 2352
+        handler.data_offset = 0x18
+
+        for sector, offset, size in ((0, 0, 10), (10, 5000, 3000), (1400, 300000, 9000), (1499, 2048, 2324),
+                                     (1800, 1000000, 100000), (2900, 1000, 400000)):
+            expected = b''.join(user_data[sector:])[offset:offset+size]
+
+            assert handler.read(offset, size, sector) == expected
+
+
+def test_decode_record(tmpdir):
+    path = str(tmpdir.join('synthetic.iso'))
+    with open(path, 'wb') as f:
+        f.write(build_iso(500, file_size=(0, 5000), depth=2, per_directory=12))
+
+    with MmappedFile(path) as file:
+        handler = ISO9660Handler(file=file, file_name=path)
+        assert handler.test()
+        handler.pvd_sector = 16
+
+        files = list(handler.files())
+        assert len([f for f in files if not f['is_directory']]) == 500
+
+        # Every record decodes the same as with unpack_record().
+        for record in files[1:]:
+            if record['is_directory']:
+                sector, offset = record['sector'], 0
+                while sector < record['sector'] + record['size'] // 2048:
+                    unpacked = handler.unpack_record(offset, sector)
+                    if unpacked['record_size'] == 0:
+                        sector, offset = sector + 1, 0
+                        continue
+
+                    assert handler.decode_record(handler.read(0, 2048, sector), offset) == unpacked
+                    offset += unpacked['record_size']
+
+        # A record with an invalid date (minute 70) fails to decode, as with unpack_record().
+        data = bytearray(handler.read(0, 2048, files[1]['sector']))
+        data[22] = 70
+        with pytest.raises(ValueError):
+            handler.decode_record(data, 0)
+
+
+def test_file_list():
+    table = FileList()
+    root = table.add(-1, '', 18, 2048, 34, 2, FileList.pack_date(2017, 1, 14, 12, 30, 15))
+    directory = table.add(root, 'DATA', 19, 2048, 38, 2, FileList.pack_date(1999, 12, 31, 23, 59, 59))
+    table.add(directory, 'FILE.BIN', 20, 5, 42, 0, FileList.pack_date(2000, 2, 29, 0, 0, 0))
+
+    for index in (directory, directory + 1):
+        table.set_hashes(index, OrderedDict([('sha1', '{:040x}'.format(index)), ('crc32', '0000000a')]))
+
+    assert len(table) == 2
+    assert list(table) == ['/DATA', '/DATA/FILE.BIN']
+    assert dict(table['/DATA/FILE.BIN'].items()) == {
+        'record_size': 42, 'sector': 20, 'size': 5, 'is_directory': False, 'date': datetime(2000, 2, 29),
+        'name': 'FILE.BIN', 'path': '/DATA/FILE.BIN', 'sha1': '{:040x}'.format(2), 'crc32': '0000000a'}
+    assert table['/DATA']['date'] == datetime(1999, 12, 31, 23, 59, 59)
+    assert 'md5' not in table['/DATA']
+
+    # Records without a name aren't listed, and the extents of a multi-extent file are listed once, with the last one.
+    table.add(directory, '', 21, 0, 34, 0, 0)
+    table.add(root, 'BIG.BIN', 30, 4096, 40, 0x80, 0)
+    other = table.add(directory, 'OTHER.BIN', 31, 1, 42, 0, 0)
+    table.add(root, 'BIG.BIN', 32, 100, 40, 0, 0)
+
+    assert list(table) == ['/DATA', '/DATA/FILE.BIN', '/BIG.BIN', '/DATA/OTHER.BIN']
+    assert table['/BIG.BIN'].sector == 32
+    assert table['/DATA/OTHER.BIN'].index == other
+
+
+def test_checkpoint_resume(tmpdir):
+    path = corrupted_track(tmpdir)
+    expected_files, expected_errors = file_list(path, batch_size=50, jobs=1, skip_sector_errors=False)
+
+    for jobs in (1, 2):
+        config.checkpoint = True
+        config.time_limit = 0  # Stop after every batch.
+        try:
+            runs = 0
+            while True:
+                runs += 1
+                try:
+                    files, errors = file_list(path, batch_size=50, jobs=jobs, skip_sector_errors=False)
+                    break
+                except SystemExit as e:
+                    assert 'run again to resume' in str(e)
+                    assert os.path.exists(path + '.rominfo-checkpoint')
+        finally:
+            config.checkpoint = False
+            config.time_limit = None
+
+        assert runs == 13  # 606 sectors, 50 per batch.
+        assert list(errors.items()) == list(expected_errors.items())
+        assert files == expected_files
+        assert not os.path.exists(path + '.rominfo-checkpoint')
+
+
+
+def test_checkpoint_read_only(tmpdir, monkeypatch, capsys):
+    path = corrupted_track(tmpdir)
+    expected_files, expected_errors = file_list(path, batch_size=50, jobs=1, skip_sector_errors=False)
+
+    # The directory of the image is read-only: the checks go on without checkpoints, and without a time limit.
+    def save(*args):
+        raise PermissionError(13, 'Permission denied')
+
+    monkeypatch.setattr(Checkpoint, 'save', save)
+    monkeypatch.setattr(config, 'checkpoint', True)
+    monkeypatch.setattr(config, 'checkpoint_interval', 0)
+    monkeypatch.setattr(config, 'time_limit', 0)
+
+    files, errors = file_list(path, batch_size=50, jobs=1, skip_sector_errors=False)
+    assert list(errors.items()) == list(expected_errors.items())
+    assert files == expected_files
+    assert "Can't save the progress" in capsys.readouterr()[1]
+
+    # Interruptions aren't replaced by the error.
+    monkeypatch.setattr(config, 'checkpoint_interval', 60)
+    monkeypatch.setattr(ISO9660Handler, 'batch_user_data', None)
+    with pytest.raises(TypeError):
+        file_list(path, batch_size=50, jobs=1, skip_sector_errors=False)
+
+
+def test_time_limit_without_checkpoint(tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(config, 'checkpoint', True)
+    monkeypatch.setattr(config, 'time_limit', 0)
+    monkeypatch.setattr(archive, '_indexes', {})
+
+    path = corrupted_track(tmpdir)
+    zip_path = str(tmpdir.join('game.zip'))
+    with zipfile.ZipFile(zip_path, 'w') as f:
+        f.write(path, 'track01.bin')
+
+    # A track in a zip file (as in a GDI) has no checkpoint, so the checks can't be stopped.
+    member = os.path.join(zip_path, 'track01.bin')
+    with FileSlice(member, 0, os.path.getsize(path), opener=archive.open_file) as file:
+        handler = ISO9660Handler(file=file, file_name=member)
+        assert handler.test()
+        handler.batch_size = 50
+        assert sorted(handler.scan()) == [3, 150, 151, 400, 605]
+
+    assert "the time limit doesn't apply" in capsys.readouterr()[1]
+
+
+def test_verify_sample(tmpdir):
+    config.verify = (100, 1)
+    try:
+        files, errors = file_list(TRACK, batch_size=50, jobs=1, skip_sector_errors=False)
+        assert errors is None
+
+        with MmappedFile(TRACK) as file:
+            handler = ISO9660Handler(file=file, file_name=TRACK)
+            assert handler.test()
+
+            sample = handler.sample_sectors(100, seed=1)
+            assert len(sample) == 100 and sample == sorted(set(sample))
+            assert handler.sample_sectors(100, seed=1) == sample
+            assert handler.sample_sectors(100, seed=2) != sample
+            assert handler.sample_sectors(1000) == list(range(606))
+
+            handler.get_info()
+            assert handler.info['Verification']['Result'] == 'no errors found'
+            assert handler.info['Verification']['Sampled sectors'] == '100 of 606, 0 with errors'
+
+        # Errors in the sample, or in the system area, lead to a full check.
+        path = corrupted_track(tmpdir)
+        expected = find_sector_errors(path, jobs=1)
+        for sample_size in (0, 300):
+            config.verify = (sample_size, 0)
+            assert find_sector_errors(path, jobs=1) == expected
+    finally:
+        config.verify = None
+
+
+def test_extract(tmpdir, monkeypatch):
+    iso = str(tmpdir.join('synthetic.iso'))
+    with open(iso, 'wb') as f:
+        f.write(build_iso(30, file_size=(0, 20000), depth=1, per_directory=10))
+
+    # Several blocks per file, and few pending blocks at a time.
+    monkeypatch.setattr(Extractor, 'block_size', 4096)
+    monkeypatch.setattr(Extractor, 'max_pending', 8192)
+    monkeypatch.setattr(config, 'skip_sector_errors', True)
+
+    # Files of the track are written from their data, files of the ISO image (2048-byte sectors) are copied.
+    for path in (TRACK, iso):
+        output = str(tmpdir.join('output', os.path.basename(path)))
+        monkeypatch.setattr(config, 'extract', output)
+
+        with MmappedFile(path) as file:
+            handler = ISO9660Handler(file=file, file_name=path)
+            assert handler.test()
+            handler.get_info()
+
+            for entry in handler.info['Files']['value'].values():
+                extracted = os.path.join(output, handler.info['Volume']['Name'], entry['path'].lstrip('/'))
+                if entry['is_directory']:
+                    assert os.path.isdir(extracted)
+                    continue
+
+                with open(extracted, 'rb') as f:
+                    assert f.read() == handler.read(0, entry['size'], entry['sector'])
+
+                assert os.path.getmtime(extracted) == entry['date'].timestamp()
+
+
+def test_sector_cache(monkeypatch):
+    cache = SectorCache(2)
+    reads = []
+    read = lambda sector: reads.append(sector) or sector * 10
+
+    assert [cache.get(sector, read) for sector in (1, 2, 1, 3, 2, 1)] == [10, 20, 10, 30, 20, 10]
+    assert reads == [1, 2, 3, 2, 1]  # 2 is evicted by 3, being the least recently used, then 1 by 2.
+    assert (cache.hits, cache.misses) == (1, 5)
+
+    monkeypatch.setattr(config, 'skip_sector_errors', True)
+
+    infos = []
+    for size in (0, 256):
+        monkeypatch.setattr(config, 'sector_cache_size', size)
+
+        with MmappedFile(TRACK) as file:
+            handler = DCDataTrackHandler(file=file, file_name=TRACK)
+            assert handler.test()
+            handler.get_info()
+
+        infos.append(handler.info)
+
+    assert infos[0] == infos[1]
+
+    # The header and the volume descriptors are read one field at a time.
+    assert handler.sector_cache.misses <= 3
+    assert handler.sector_cache.hits >= 20
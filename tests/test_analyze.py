@@ -0,0 +1,49 @@
+import pytest
+
+from analyze import SignatureTable, find_handler
+from handlers import handlers
+from handlers.dreamcast import DCDataTrackHandler, GDIHandler
+from handlers.iso9660 import ISO9660Handler
+from handlers.megadrive import MegadriveHandler
+from utils import MmappedFile
+
+TRACK = 'tests/handlers/dreamcast/namco_museum/track01.bin'
+GDI = 'tests/handlers/dreamcast/namco_museum/disc.gdi'
+
+
+def test_signature_table():
+    table = SignatureTable(handlers)
+
+    with MmappedFile(TRACK) as file:
+        header = file[0:table.header_size]
+        assert table.candidates(header, TRACK) == [DCDataTrackHandler, ISO9660Handler]
+
+    with MmappedFile(GDI) as file:
+        assert table.candidates(file[0:table.header_size], GDI) == [GDIHandler]
+
+    rom = bytearray(0x200)
+    rom[0x100:0x110] = b'SEGA GENESIS    '
+    assert table.candidates(bytes(rom), 'game.bin') == [MegadriveHandler]
+    assert table.candidates(bytes(0x10000), 'unknown.bin') == []
+
+
+def test_find_handler(tmpdir, monkeypatch):
+    with MmappedFile(TRACK) as file:
+        handler = find_handler(file, TRACK)
+        assert isinstance(handler, DCDataTrackHandler)
+        assert handler.format == 'mode1'
+
+        # The handler reads the start of the file from the header that was read for detection.
+        assert handler.header is not None
+        assert handler.read(0, 16) == b'SEGA SEGAKATANA '
+
+    path = str(tmpdir.join('unknown.bin'))
+    with open(path, 'wb') as f:
+        f.write(bytes(0x10000))
+
+    # No handler is even created for a file that matches no signature.
+    for handler_class in handlers:
+        monkeypatch.setattr(handler_class, 'test', pytest.fail)
+
+    with MmappedFile(path) as file:
+        assert find_handler(file, path) is None
@@ -0,0 +1,176 @@
+import gzip
+import lzma
+import os
+import random
+import zipfile
+
+import pytest
+
+import archive
+import config
+from analyze import find_handler
+from archive import ArchiveFile, open_file
+from benchmarks.synthetic import build_gdi, build_iso, raw_image
+from conftest import compare_with_raw
+from handlers import iso9660
+from utils import MmappedFile
+
+
+def random_data(size, seed=0):
+    # Compressible, but not too much.
+    rng = random.Random(seed)
+    return bytes(rng.choice(b'abcdefgh') for _ in range(size))
+
+
+def check_reads(file, data):
+    assert len(file) == len(data)
+
+    rng = random.Random(1)
+    for _ in range(200):
+        start = rng.randrange(len(data))
+        stop = start + rng.randrange(10000)
+        assert file[start:stop] == data[start:stop]
+
+    # A sequential scan, and reads going back.
+    for start in range(0, len(data), 2352):
+        assert bytes(file.view(start, start + 2352)) == data[start:start + 2352]
+    assert file[len(data) - 10:len(data) + 10] == data[-10:]
+    assert file[5] == data[5]
+    assert file[0:100:3] == data[0:100:3]
+
+
+def test_gzip(tmpdir, small_blocks):
+    data = random_data(100000)
+
+    # A single member, and several members (as made by bgzip).
+    for name, compressed in (('single.iso.gz', gzip.compress(data)),
+                             ('members.iso.gz', b''.join(gzip.compress(data[i:i + 30000])
+                                                         for i in range(0, len(data), 30000)))):
+        path = str(tmpdir.join(name))
+        with open(path, 'wb') as f:
+            f.write(compressed)
+
+        with open_file(path) as file:
+            assert isinstance(file, ArchiveFile)
+            assert file.image_name == path[:-3]
+            check_reads(file, data)
+
+            points = [point[0] for point in file.index['points']]
+
+        assert points == ([0] if name == 'single.iso.gz' else [0, 30000, 60000, 90000])
+
+
+def test_xz(tmpdir, small_blocks):
+    data = random_data(100000)
+
+    # Each stream has a seek point, and streams may be padded.
+    path = str(tmpdir.join('disc.bin.xz'))
+    with open(path, 'wb') as f:
+        f.write(lzma.compress(data[:40000]) + bytes(8) + lzma.compress(data[40000:]))
+
+    with open_file(path) as file:
+        check_reads(file, data)
+        assert [point[0] for point in file.index['points']] == [0, 40000]
+
+
+def test_zip(tmpdir, small_blocks):
+    data = random_data(50000)
+
+    path = str(tmpdir.join('game.zip'))
+    with zipfile.ZipFile(path, 'w') as f:
+        f.writestr('readme.txt', b'hello')
+        f.writestr('disc/stored.iso', data, zipfile.ZIP_STORED)
+        f.writestr('disc/deflated.iso', data[::-1], zipfile.ZIP_DEFLATED)
+
+    with open_file(path) as file:
+        assert file.member == 'disc/stored.iso'  # The largest file.
+        check_reads(file, data)
+
+    with open_file(os.path.join(path, 'disc', 'deflated.iso')) as file:
+        assert file.image_name == path + '/disc/deflated.iso'
+        check_reads(file, data[::-1])
+
+    with pytest.raises(SystemExit):
+        with open_file(os.path.join(path, 'missing.iso')):
+            pass
+
+
+def test_persisted_index(tmpdir, small_blocks, monkeypatch):
+    monkeypatch.setattr(config, 'cache', True)
+    monkeypatch.setattr(config, 'cache_dir', str(tmpdir.join('cache')))
+
+    data = random_data(20000)
+    path = str(tmpdir.join('disc.iso.gz'))
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(data[:10000]) + gzip.compress(data[10000:]))
+
+    with open_file(path) as file:
+        index = file.index
+
+    assert os.listdir(str(tmpdir.join('cache', 'index')))
+
+    # The saved index is used, without decompressing the whole file again.
+    monkeypatch.setattr(archive, '_indexes', {})
+    monkeypatch.setattr(ArchiveFile, 'gzip_index', None)
+    with open_file(path) as file:
+        assert file.index == index
+        assert file[9990:10010] == data[9990:10010]
+
+
+def test_iso(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'hashes', ('crc32',))
+    monkeypatch.setattr(archive, '_indexes', {})
+
+    data = raw_image(build_iso(30, (0, 20000), seed=4), errors=[25])
+    path = str(tmpdir.join('disc.bin'))
+    with open(path, 'wb') as f:
+        f.write(data)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, 1))
+
+    assert 'Errors' in compare_with_raw(path, path + '.gz')
+
+
+def test_parallel_checks(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'jobs', 2)
+    monkeypatch.setattr(archive, '_indexes', {})
+
+    data = raw_image(build_iso(10, (0, 5000), seed=4), errors=[5])
+    path = str(tmpdir.join('disc.bin'))
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, 1))
+    with open(path + '.xz', 'wb') as f:
+        f.write(lzma.compress(data))
+
+    with open_file(path + '.xz') as file:
+        assert file.random_access
+
+    # Worker processes would decode a gzip file from its start again, its sectors are checked as it is decoded.
+    def no_workers(*args, **kwargs):
+        raise AssertionError('Worker processes started')
+
+    monkeypatch.setattr(iso9660, 'ProcessPoolExecutor', no_workers)
+    with open_file(path + '.gz') as file:
+        assert not file.random_access
+
+        handler = find_handler(file, file.image_name)
+        assert list(handler.find_sector_errors()) == [5]
+
+
+def test_gdi_in_zip(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'hashes', ('crc32',))
+    monkeypatch.setattr(archive, '_indexes', {})
+
+    directory = tmpdir.mkdir('disc')
+    gdi = build_gdi(str(directory), 40, (0, 5000), depth=1, per_directory=10, seed=5, errors=[70], audio_sectors=20)
+
+    path = str(tmpdir.join('game.zip'))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as f:
+        for name in sorted(os.listdir(str(directory))):
+            f.write(str(directory.join(name)), name)
+
+    assert len(compare_with_raw(gdi, path).splitlines()) > 40
+
+    # A plain file is still opened as it is.
+    with open_file(gdi) as file:
+        assert isinstance(file, MmappedFile)
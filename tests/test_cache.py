@@ -0,0 +1,100 @@
+import os
+import shutil
+import zipfile
+
+import cache
+from cache import ResultCache
+from rominfo import main
+
+TRACK = 'tests/handlers/dreamcast/namco_museum/track01.bin'
+
+
+def make_image(tmpdir, name='image.bin', data=b'\x00' * 4096):
+    path = str(tmpdir.join(name))
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    return path
+
+
+def test_cache_invalidation(tmpdir, monkeypatch):
+    image = make_image(tmpdir)
+    track = make_image(tmpdir, 'track.bin')
+
+    with ResultCache(str(tmpdir.join('cache')), with_fingerprint=True) as result_cache:
+        result_cache.put(image, {'Files': [1, 2, 3]}, [image, track])
+        assert result_cache.get(image) == {'Files': [1, 2, 3]}
+
+        # A file read to produce the result changed.
+        os.utime(track, ns=(0, 0))
+        assert result_cache.get(image) is None
+
+        result_cache.put(image, {'Files': []}, [track])
+        assert result_cache.get(image) == {'Files': []}
+
+        # Same size and modification time, different contents.
+        stat = os.stat(image)
+        with open(image, 'r+b') as f:
+            f.write(b'\x01')
+        os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert result_cache.get(image) is None
+
+        # Different version of the code.
+        result_cache.put(image, {'Files': []}, [])
+        monkeypatch.setattr(cache, '_version', 'other')
+        assert result_cache.get(image) is None
+
+
+def test_zip_member(tmpdir):
+    # The image isn't a path on disk, the zip file is.
+    path = str(tmpdir.join('game.zip'))
+    with zipfile.ZipFile(path, 'w') as f:
+        f.writestr('disc.gdi', b'1')
+    image = os.path.join(path, 'disc.gdi')
+
+    with ResultCache(str(tmpdir.join('cache'))) as result_cache:
+        result_cache.put(image, {'Files': []}, [path])
+        assert result_cache.get(image) == {'Files': []}
+        assert result_cache.get(path) is None
+
+        os.utime(path, ns=(0, 0))
+        assert result_cache.get(image) is None
+
+
+def test_cache_eviction(tmpdir):
+    images = [make_image(tmpdir, 'image{}.bin'.format(i)) for i in range(4)]
+    info = {'Data': os.urandom(1000)}
+
+    with ResultCache(str(tmpdir.join('cache')), max_size=2500) as result_cache:
+        for image in images[:2]:
+            result_cache.put(image, info, [])
+
+        # Use the first one, so that the second one is the least recently used.
+        assert result_cache.get(images[0]) == info
+
+        result_cache.put(images[2], info, [])
+        assert result_cache.get(images[0]) == info
+        assert result_cache.get(images[1]) is None
+        assert result_cache.get(images[2]) == info
+
+
+def test_cached_output(tmpdir, capsys, monkeypatch):
+    track = str(tmpdir.join('track01.bin'))
+    shutil.copy(TRACK, track)
+    args = [track, '--cache-dir', str(tmpdir.join('cache'))]
+
+    main(args + ['--no-cache'])
+    expected, _ = capsys.readouterr()
+
+    main(args)
+    assert capsys.readouterr()[0] == expected
+
+    # Cache hit: the image isn't analyzed again.
+    monkeypatch.setattr('analyze.find_handler', None)
+    for output_format in ('text', 'json'):
+        main(args + ['-f', output_format])
+
+    out, err = capsys.readouterr()
+    assert out.startswith(expected)
+    assert '"Files": {"type": "file_list"' in out
+    assert 'Checking sector' not in err
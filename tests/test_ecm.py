@@ -0,0 +1,109 @@
+import os
+import random
+
+import pytest
+
+import archive
+import config
+import ecm
+import edc_ecc
+from archive import ArchiveFile, open_file
+from benchmarks.synthetic import SYNC, build_gdi, build_iso, ecm_checksum, ecm_image, raw_image
+from conftest import compare_with_raw
+
+
+def form2_sectors(count, seed=0):
+    rng = random.Random(seed)
+    sectors = bytearray()
+    for i in range(count):
+        subheader = bytes([1, 0, 0x20, 0]) * 2
+        sectors += SYNC + bytes([0, 2, i, 2]) + subheader + rng.getrandbits(8 * 2324).to_bytes(2324, 'little') + \
+            bytes(4)
+
+    edc_ecc.encode(sectors, count, mode=2, form=2)
+
+    return bytes(sectors)
+
+
+def test_decode(tmpdir, small_blocks):
+    # Sectors of every type, a sector with an invalid EDC (stored as it is), and bytes which aren't sectors.
+    iso = build_iso(10, (0, 3000), seed=1)
+    image = raw_image(iso, errors=[3]) + raw_image(iso[:10 * 2048], mode=2) + form2_sectors(5) + b'audio' * 1000
+
+    data = ecm_image(image)
+    types = set()
+    offset = 4
+    while True:
+        record_type, count, offset = ecm.read_record(data, offset)
+        if record_type is None:
+            break
+
+        types.add(record_type)
+        offset += count * ecm.STORED_SIZES[record_type]
+
+    assert types == {0, 1, 2, 3}
+    assert offset + 4 == len(data)
+    assert data[-4:] == ecm_checksum(image).to_bytes(4, 'little')
+
+    path = str(tmpdir.join('disc.bin.ecm'))
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    with open_file(path) as file:
+        assert file.image_name == str(tmpdir.join('disc.bin'))
+        assert len(file) == len(image)
+        assert file[:] == image
+
+        rng = random.Random(2)
+        for _ in range(200):
+            start = rng.randrange(len(image))
+            stop = start + rng.randrange(3 * 2352)
+            assert file[start:stop] == image[start:stop]
+
+        # There are seek points about every block, within records.
+        points = file.index['points']
+        assert all(b[0] - a[0] < ArchiveFile.block_size + 2352 for a, b in zip(points, points[1:]))
+
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    archive._indexes.clear()
+
+    with pytest.raises(SystemExit):
+        with open_file(path):
+            pass
+
+
+def test_mode2_iso(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'hashes', ('crc32',))
+    monkeypatch.setattr(archive, '_indexes', {})
+
+    # Mode 2 Form 1 sectors, which ECM stores without their headers.
+    image = raw_image(build_iso(40, (0, 20000), seed=6), mode=2, errors=[30])
+    path = str(tmpdir.join('disc.bin'))
+    with open(path, 'wb') as f:
+        f.write(image)
+    with open(path + '.ecm', 'wb') as f:
+        f.write(ecm_image(image))
+
+    assert 'Errors' in compare_with_raw(path, path + '.ecm')
+
+
+def test_gdi_tracks(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'hashes', ('crc32',))
+    monkeypatch.setattr(archive, '_indexes', {})
+
+    raw_gdi = build_gdi(str(tmpdir.mkdir('raw')), 40, (0, 5000), depth=1, per_directory=10, seed=7, errors=[70],
+                        audio_sectors=20)
+
+    # The data tracks of the high-density area are found compressed, next to the GDI.
+    directory = tmpdir.mkdir('ecm')
+    for name in os.listdir(os.path.dirname(raw_gdi)):
+        with open(os.path.join(os.path.dirname(raw_gdi), name), 'rb') as f:
+            data = f.read()
+
+        if name in ('track03.bin', 'track05.bin'):
+            name, data = name + '.ecm', ecm_image(data)
+
+        directory.join(name).write_binary(data)
+
+    compare_with_raw(raw_gdi, str(directory.join(os.path.basename(raw_gdi))))
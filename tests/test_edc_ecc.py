@@ -0,0 +1,125 @@
+import random
+
+import edc_ecc
+from handlers.iso9660 import ISO9660Handler
+
+TRACK = "tests/handlers/dreamcast/namco_museum/track01.bin"
+SECTOR_SIZE = 2352
+
+
+class BytesFile(bytes):
+    """In-memory image."""
+    def ranges(self):
+        yield 0, 0, len(self)
+
+
+def make_handler(data, format):
+    handler = ISO9660Handler(file=BytesFile(data), file_name='test.bin')
+    handler.format = format
+    handler.sector_size = SECTOR_SIZE
+    handler.skip_offset = 0x10 if format == 'mode2' else 0
+    handler.data_offset = 0x18 if format == 'mode2' else 0x10
+
+    return handler
+
+
+def mode2_sectors(user_data, forms):
+    """Build raw Mode 2 sectors (with valid EDC and ECC) around the given user data."""
+    sectors = []
+    for i, form in enumerate(forms):
+        sector = bytearray(SECTOR_SIZE)
+        sector[0:12] = b'\x00' + b'\xff'*10 + b'\x00'
+        sector[0x0c:0x10] = bytes([0, 2, i % 75, 2])
+        sector[0x10:0x18] = bytes([0, 0, 0x20 if form == 2 else 0x08, 0]) * 2
+
+        size = 2324 if form == 2 else 2048
+        sector[0x18:0x18+size] = user_data[i*2048:i*2048+size].ljust(size, b'\x00')
+        edc_offset = 0x18 + size
+        sector[edc_offset:edc_offset+4] = edc_ecc.edc(bytes(sector), 1, 0x10, edc_offset)[0].to_bytes(4, 'little')
+
+        if form == 1:
+            sector[0x81c:0x8c8] = edc_ecc.ecc_p(bytes(sector), 1, zero_address=True)
+            sector[0x8c8:0x930] = edc_ecc.ecc_q(bytes(sector), 1, zero_address=True)
+
+        sectors.append(bytes(sector))
+
+    return b''.join(sectors)
+
+
+def corrupt(data, seed):
+    """Flip bytes in the data, EDC, P and Q areas of some sectors."""
+    data = bytearray(data)
+    rng = random.Random(seed)
+    count = len(data) // SECTOR_SIZE
+
+    for sector in rng.sample(range(count), count // 4):
+        for _ in range(rng.randint(1, 3)):
+            offset = rng.choice([rng.randrange(0x10, 0x810), rng.randrange(0x810, 0x818),
+                                 rng.randrange(0x81c, 0x8c8), rng.randrange(0x8c8, 0x930)])
+            data[sector*SECTOR_SIZE + offset] ^= rng.randrange(1, 256)
+
+    # A zero EDC is always valid.
+    data[5*SECTOR_SIZE+0x810:5*SECTOR_SIZE+0x814] = b'\x00'*4
+
+    return bytes(data)
+
+
+def assert_same_as_reference(handler, count):
+    expected = [handler.check_errors(sector) for sector in range(count)]
+
+    assert handler.check_errors_batch(0, count) == expected
+
+
+def test_mode1():
+    with open(TRACK, 'rb') as f:
+        data = f.read(64 * SECTOR_SIZE)
+
+    handler = make_handler(corrupt(data, seed=1), 'mode1')
+    assert_same_as_reference(handler, 64)
+    assert not all(all(result) for result in handler.check_errors_batch(0, 64))
+
+    assert all(all(result) for result in make_handler(data, 'mode1').check_errors_batch(0, 64))
+
+
+def test_mode2():
+    with open(TRACK, 'rb') as f:
+        user_data = f.read(48 * 2048)
+
+    forms = [1]*16 + [2, 1]*8 + [2]*16
+    data = mode2_sectors(user_data, forms)
+
+    handler = make_handler(data, 'mode2')
+    assert handler.check_errors_batch(0, 48) == [(True, True, True)] * 48
+
+    handler = make_handler(corrupt(data, seed=2), 'mode2')
+    assert_same_as_reference(handler, 48)
+
+
+def test_encode():
+    with open(TRACK, 'rb') as f:
+        data = f.read(64 * SECTOR_SIZE)
+
+    # Clear the codes and compute them again.
+    buf = bytearray(data)
+    for sector in range(64):
+        buf[sector*SECTOR_SIZE+0x810:(sector+1)*SECTOR_SIZE] = bytes(SECTOR_SIZE - 0x810)
+
+    edc_ecc.encode(buf, 64)
+    assert bytes(buf) == data
+
+    with open(TRACK, 'rb') as f:
+        user_data = f.read(48 * 2048)
+
+    forms = [1]*16 + [2, 1]*8 + [2]*16
+    data = mode2_sectors(user_data, forms)
+
+    buf = bytearray(data)
+    for i, form in enumerate(forms):
+        if form == 1:
+            buf[i*SECTOR_SIZE+0x818:(i+1)*SECTOR_SIZE] = bytes(SECTOR_SIZE - 0x818)
+            edc_ecc.encode(memoryview(buf)[i*SECTOR_SIZE:(i+1)*SECTOR_SIZE], 1, mode=2)
+        else:
+            buf[i*SECTOR_SIZE+0x92c:(i+1)*SECTOR_SIZE] = bytes(4)
+            edc_ecc.encode(memoryview(buf)[i*SECTOR_SIZE:(i+1)*SECTOR_SIZE], 1, mode=2, form=2)
+
+    assert bytes(buf) == data
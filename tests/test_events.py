@@ -0,0 +1,44 @@
+import json
+import shutil
+
+from events import error_ranges
+from rominfo import main
+
+TRACK = 'tests/handlers/dreamcast/namco_museum/track01.bin'
+
+
+def test_error_ranges():
+    errors = {5: ['p'], 6: ['p'], 7: ['p', 'q'], 8: ['p', 'q'], 10: ['p', 'q'], 3: ['edc']}
+
+    assert list(error_ranges(errors)) == [(3, 3, ['edc']), (5, 6, ['p']), (7, 8, ['p', 'q']), (10, 10, ['p', 'q'])]
+    assert list(error_ranges({})) == []
+
+
+def test_ndjson(tmpdir, capsys):
+    track = str(tmpdir.join('track01.bin'))
+    shutil.copy(TRACK, track)
+    args = [track, '--cache-dir', str(tmpdir.join('cache'))]
+
+    main(args + ['-f', 'json', '--no-cache'])
+    info = json.loads(capsys.readouterr()[0])
+
+    main(args + ['-f', 'ndjson'])
+    out, _ = capsys.readouterr()
+    lines = out.splitlines()
+    events = [json.loads(line) for line in lines]
+
+    assert [event['event'] for event in events if event['event'] != 'file'] == ['image', 'header', 'volume', 'end']
+    assert all(event['image'] == track for event in events)
+
+    assert events[1]['header'] == info['Header']
+    assert events[2]['volume'] == info['Volume']
+
+    files = {event.pop('path'): event for event in events if event['event'] == 'file'}
+    assert sorted(files) == sorted(info['Files']['value'])
+    for path, event in files.items():
+        assert event.pop('event') == 'file' and event.pop('image') == track and event.pop('track') == ''
+        assert dict(event, path=path) == info['Files']['value'][path]
+
+    # A cached image has the same events.
+    main(args + ['-f', 'ndjson'])
+    assert sorted(capsys.readouterr()[0].splitlines()) == sorted(lines)
@@ -1,4 +1,10 @@
+import os
+
 import pytest
+
+import batch
+import config
+from benchmarks.synthetic import build_gdi
 from rominfo import main
 
 
@@ -25,3 +31,36 @@ def test_file_not_found():
         main(['file/does/not/exist.bin'])
 
     assert 'No such file' in str(excinfo.value)
+
+
+TRACK = 'tests/handlers/dreamcast/namco_museum/track01.bin'
+
+
+def test_batch(capsys, tmpdir):
+    main([TRACK, '--skip-sector-errors', '--no-cache'])
+    single, _ = capsys.readouterr()
+
+    file_list = tmpdir.join('files.txt')
+    file_list.write('{0}\nfile/does/not/exist.bin\n\n{0}\n'.format(TRACK))
+
+    for args in ([], ['--jobs', '2'], ['--jobs', '2', '--unordered']):
+        assert main(['--files-from', str(file_list), '--skip-sector-errors', '--no-cache'] + args) == 1
+
+        out, err = capsys.readouterr()
+
+        # Results are complete and, unless unordered, in order; the failure doesn't stop the batch.
+        assert out == single * 2
+        assert 'file/does/not/exist.bin: [Errno 2] No such file' in err
+        assert 'Analyzed 3 images' in err
+        assert '1 failed' in err
+
+
+def test_batch_size(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'cache', False)
+
+    # The size of an image is that of all its files, not just of its GDI sheet.
+    gdi = build_gdi(str(tmpdir), 20, (0, 5000), seed=3)
+    result = batch.analyze(gdi)
+
+    assert result.error is None
+    assert result.size == sum(os.path.getsize(str(path)) for path in tmpdir.listdir())
@@ -0,0 +1,63 @@
+import io
+from collections import OrderedDict
+
+import render
+from handlers.iso9660 import FileList
+
+
+def file_list():
+    files = FileList()
+    date = FileList.pack_date(2017, 1, 14, 12, 30, 15)
+    root = files.add(-1, '', 18, 2048, 34, 2, date)
+    directory = files.add(root, 'DIR', 19, 2048, 36, 2, date)
+    index = files.add(directory, 'FILE.BIN;1', 20, 5, 42, 0, date)
+    files.set_hashes(index, {'crc32': '01234567'})
+    files.set_hashes(directory, {'crc32': '89abcdef'})
+
+    return files
+
+
+def test_write_text():
+    info = OrderedDict([
+        ('Volume', OrderedDict([('Name', '  NAME'), ('Empty', OrderedDict())])),
+        ('Notes', 'two\nlines'),
+        ('Files', {'type': 'file_list', 'value': file_list()}),
+    ])
+
+    out = io.StringIO()
+    render.write_text(info, out)
+
+    assert out.getvalue() == (
+        'Volume:\n'
+        '  Name: NAME\n'
+        '  Empty: \n'
+        '\n'
+        'Notes:\n'
+        '  two\nlines\n'
+        'Files:\n'
+        '  /DIR            (2017-01-14 12:30:15, crc32: 89abcdef, sector: 19, 2048 bytes)\n'
+        '  /DIR/FILE.BIN;1 (2017-01-14 12:30:15, crc32: 01234567, sector: 20, 5 bytes)\n'
+        '\n'
+    )
+
+
+def test_write_wiki():
+    info = OrderedDict([
+        ('Volume', OrderedDict([('Name', 'NAME'), ('Set', '[SET]')])),
+        ('Files', {'type': 'file_list', 'value': file_list()}),
+    ])
+
+    out = io.StringIO()
+    render.write_wiki(info, out)
+
+    assert out.getvalue() == (
+        '== Volume ==\n'
+        "* '''Name:''' NAME\n"
+        "* '''Set:''' <nowiki>[SET]</nowiki>\n"
+        '== Files ==\n'
+        '{| class="wikitable sortable"\n'
+        '! Path !! Date !! CRC32 !! Sector !! Size\n'
+        '|-\n| /DIR || 2017-01-14 12:30:15 || 89abcdef || 19 || 2048\n'
+        '|-\n| /DIR/FILE.BIN;1 || 2017-01-14 12:30:15 || 01234567 || 20 || 5\n'
+        '|}\n'
+    )
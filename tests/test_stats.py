@@ -0,0 +1,58 @@
+import json
+import threading
+
+import stats
+from rominfo import main
+
+TRACK = 'tests/handlers/dreamcast/namco_museum/track01.bin'
+
+
+def in_thread():
+    with stats.stage('thread'):
+        stats.count(bytes=5)
+
+
+def test_stages():
+    ended = []
+    stats.enable(lambda path, figures: ended.append((path, figures['calls'])))
+    stats.reset()
+    try:
+        with stats.stage('outer'):
+            for _ in range(2):
+                with stats.stage('inner'):
+                    stats.count(bytes=10, sectors=1)
+
+            # A stage in another thread is recorded within the stage the function was wrapped in.
+            thread = threading.Thread(target=stats.inherit(in_thread))
+            thread.start()
+            thread.join()
+
+        figures = stats.collect()
+    finally:
+        stats.disable()
+
+    assert list(figures) == ['outer', 'outer/inner', 'outer/thread']
+    assert figures['outer']['bytes'] == 25
+    assert figures['outer/inner']['calls'] == 2
+    assert figures['outer/inner']['sectors'] == 2
+    assert figures['outer']['wall'] >= figures['outer/inner']['wall']
+    assert ended == [('outer/inner', 1), ('outer/inner', 2), ('outer/thread', 1), ('outer', 1)]
+
+    # Nothing is recorded when disabled.
+    with stats.stage('outer'):
+        assert stats.current() == ()
+
+
+def test_stats_output(capsys):
+    try:
+        main([TRACK, '-f', 'json', '--no-cache', '--stats'])
+    finally:
+        stats.disable()
+
+    lines = capsys.readouterr()[0].splitlines()
+    assert len(lines) == 2
+
+    figures = json.loads(lines[1])['Stats']
+    assert figures['analyze_file/get_info/scan']['sectors'] == 606
+    assert figures['analyze_file/get_info/files']['entries'] == len(json.loads(lines[0])['Files']['value'])
+    assert 'analyze_file/detect' in figures
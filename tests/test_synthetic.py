@@ -0,0 +1,38 @@
+import config
+from analyze import find_handler
+from benchmarks.synthetic import build_gdi, build_iso, raw_image
+from utils import MmappedFile
+
+
+def test_raw_image(tmpdir):
+    data = build_iso(30, (0, 5000), depth=1, per_directory=10, seed=1)
+
+    for mode, format in ((1, 'mode1'), (2, 'mode2')):
+        path = str(tmpdir.join(format + '.bin'))
+        with open(path, 'wb') as f:
+            f.write(raw_image(data, mode, errors=[20, 25]))
+
+        with MmappedFile(path) as file:
+            handler = find_handler(file, path)
+            assert handler.format == format
+            assert sorted(handler.find_sector_errors()) == [20, 25]
+
+
+def test_gdi(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'skip_sector_errors', False)
+    path = build_gdi(str(tmpdir), 20, (0, 10000), seed=2, errors=[20], audio_sectors=10)
+
+    with MmappedFile(path) as file:
+        handler = find_handler(file, path)
+        handler.get_info()
+
+    tracks = handler.info['Tracks']
+    assert list(tracks) == ['Track 1', 'Track 2', 'Track 3+5', 'Track 4']
+
+    # Half of the files are in track 5, past track 3 and the audio track 4.
+    files = tracks['Track 3+5']['Files']['value']
+    track3_sectors = tmpdir.join('track03.bin').size() // 2352
+    assert len(files) == 20
+    assert sum(entry['sector'] >= track3_sectors + 10 for entry in files.values()) == 10
+    assert list(tracks['Track 3+5']['Errors']) == [20]
+    assert 'Errors' not in tracks['Track 1']
@@ -0,0 +1,99 @@
+import io
+import sys
+
+import pytest
+
+from utils import ConcatenatedFile, FileSlice, redirect_output, reopen
+
+
+def concatenated_file(tmpdir, gaps='error'):
+    """Chunks b'abcd' at 4 and b'efgh' at 8 and b'ij' at 16: a gap before the first chunk and between the last two."""
+    file_names = []
+    for name, data in (('a.bin', b'abcd'), ('b.bin', b'efgh'), ('c.bin', b'ij')):
+        path = str(tmpdir.join(name))
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        file_names.append(path)
+
+    # Offsets don't have to be in order.
+    return ConcatenatedFile(file_names=[file_names[2], file_names[0], file_names[1]], offsets=[16, 4, 8], gaps=gaps)
+
+
+def test_concatenated_file(tmpdir):
+    with concatenated_file(tmpdir) as file:
+        assert list(file.ranges()) == [(0, 4, 8), (1, 8, 12), (2, 16, 18)]
+        assert len(file) == 10
+
+        assert file[5:7] == b'bc'
+        assert file[4] == ord('a')
+        assert bytes(file.view(9, 12)) == b'fgh'
+
+        # Reads spanning chunks.
+        assert file[6:10] == b'cdef'
+        assert file[4:12:2] == b'aceg'
+        assert [bytes(view) for view in file.views(6, 10)] == [b'cd', b'ef']
+        assert bytes(file.view(7, 9)) == b'de'
+
+        # Reads past the end stop at the end of the last chunk.
+        assert file[17:30] == b'j'
+
+        with pytest.raises(ValueError):
+            file[10:17]
+        with pytest.raises(ValueError):
+            file[0:5]
+
+
+def test_concatenated_file_gaps(tmpdir):
+    with concatenated_file(tmpdir, gaps='zero') as file:
+        assert file[:] == b'\x00' * 4 + b'abcdefgh' + b'\x00' * 4 + b'ij'
+        assert [bytes(view) for view in file.views(10, 17)] == [b'gh', b'\x00' * 4, b'i']
+
+        # Worker processes open the file with the same chunks and gap policy.
+        copy = reopen(file.open_args())
+        try:
+            assert copy[10:17] == b'gh\x00\x00\x00\x00i'
+        finally:
+            copy.__exit__(None, None, None)
+
+
+def test_file_slice(tmpdir):
+    path = str(tmpdir.join('disc.bin'))
+    with open(path, 'wb') as f:
+        f.write(b'abcdefghij')
+
+    with FileSlice(path, 2, 8) as file:
+        assert len(file) == 6
+        assert list(file.ranges()) == [(0, 0, 6)]
+        assert file[:] == b'cdefgh'
+        assert file[1:3] == b'de'
+        assert file[4:20] == b'gh'
+        assert file[0] == ord('c')
+        assert bytes(file.view(2, 4)) == b'ef'
+
+        inner = file.slice(3)
+        assert inner[:] == b'fgh'
+
+        copy = reopen(inner.open_args())
+        try:
+            assert copy[:] == b'fgh'
+        finally:
+            copy.__exit__(None, None, None)
+
+    # The slice ends at the end of the file.
+    with FileSlice(path, 8, 20) as file:
+        assert file[:] == b'ij'
+
+
+def test_redirect_output():
+    stdout, stderr = sys.stdout, sys.stderr
+    output = io.StringIO()
+
+    with pytest.raises(KeyError):
+        with redirect_output(output):
+            print('captured')
+            assert sys.stderr is stderr
+            raise KeyError()
+
+    assert output.getvalue() == 'captured\n'
+    assert (sys.stdout, sys.stderr) == (stdout, stderr)
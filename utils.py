@@ -1,5 +1,15 @@
+import contextlib
+import hashlib
 import mmap
+import os
 import sys
+from bisect import bisect_right
+from collections import OrderedDict
+from zlib import crc32
+
+
+# Paths of the files opened with MmappedFile, when recording them (see cache.OpenedFiles).
+opened_files = None
 
 
 class MmappedFile:
@@ -10,8 +20,13 @@ class MmappedFile:
             raise SystemExit(e)
 
         self.file_name = file_name
+        if opened_files is not None:
+            opened_files.append(file_name)
+
         self.mmap = None
         self.mmap_access = mmap_access
+        self._view = None
+        self.kwargs = dict(kwargs, open_mode=open_mode, mmap_access=mmap_access)
 
     def __enter__(self):
         self.file.__enter__()
@@ -33,13 +48,32 @@ class MmappedFile:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.mmap.close()
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+
+        try:
+            self.mmap.close()
+        except BufferError:
+            # Views returned by view() are still alive. The mapping is closed once they are garbage collected.
+            pass
 
         return self.file.__exit__(exc_type, exc_val, exc_tb)
 
     def __getitem__(self, key):
         return self.mmap.__getitem__(key)
 
+    def view(self, start, stop):
+        """Return a memoryview of the data between start and stop, without copying it."""
+        if self._view is None:
+            self._view = memoryview(self.mmap)
+
+        return self._view[start:stop]
+
+    def open_args(self):
+        """Arguments for opening the same file again in another process (see reopen())."""
+        return MmappedFile, (self.file_name,), self.kwargs
+
     def ranges(self):
         yield 0, 0, len(self)
 
@@ -48,14 +82,28 @@ class MmappedFile:
 
 
 class ConcatenatedFile:
-    def __init__(self, file_names, offsets, **kwargs):
-        self.file_names = file_names
+    """
+    Files (chunks) placed at offsets of a single address space, such as the two parts of the high density area of a
+    GDI. Reads can span chunks. Reads of the gaps between chunks raise ValueError, or return zeros if gaps is 'zero'.
+    """
+
+    def __init__(self, file_names, offsets, gaps='error', opener=MmappedFile, **kwargs):
+        """
+        :param opener: function opening a chunk, e.g. archive.open_file() for chunks which may be compressed
+        """
+        if gaps not in ('error', 'zero'):
+            raise ValueError('Unknown gap policy: {}'.format(gaps))
+
+        chunks = sorted(zip(offsets, file_names))
+        self.file_names = [file_name for _, file_name in chunks]
+        self.offsets = [offset for offset, _ in chunks]
+        self.gaps = gaps
+        self.opener = opener
         self.files = []
-        self.offsets = offsets[:]
-        self.offsets.sort()
+        self.kwargs = kwargs
 
         for file_name in self.file_names:
-            file = MmappedFile(file_name, **kwargs)
+            file = opener(file_name, **kwargs)
             self.files.append(file)
 
     def __enter__(self):
@@ -66,6 +114,13 @@ class ConcatenatedFile:
 
             self.lengths.append(len(file))
 
+        self.stops = [offset + length for offset, length in zip(self.offsets, self.lengths)]
+        for stop, next_offset in zip(self.stops, self.offsets[1:]):
+            if stop > next_offset:
+                raise ValueError('Chunks overlap')
+
+        return self
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         # TODO deal with exc_type, exc_val and exc_tb
         for file in self.files:
@@ -73,36 +128,85 @@ class ConcatenatedFile:
 
     def __getitem__(self, key):
         if isinstance(key, slice):
-            start, stop, step = key.start, key.stop, key.step
-            if start is None:
-                start = 0
+            start, stop = self.bounds(key.start, key.stop)
+
+            chunk = self.chunk(start)
+            if chunk >= 0 and stop <= self.stops[chunk]:
+                return self.files[chunk][start - self.offsets[chunk]:stop - self.offsets[chunk]:key.step]
+
+            return b''.join(self.views(start, stop))[::key.step]
+
+        return self[key:key + 1][0]
 
-            if stop is None:
-                stop = self.offsets[-1] + self.lengths[-1]
+    def view(self, start, stop):
+        """
+        Return a memoryview of the data between start and stop. It doesn't copy the data, unless the range spans
+        several chunks.
+        """
+        start, stop = self.bounds(start, stop)
 
-            # Find start
-            found = False
-            file_start = file_stop = None
+        chunk = self.chunk(start)
+        if chunk >= 0 and stop <= self.stops[chunk]:
+            return self.files[chunk].view(start - self.offsets[chunk], stop - self.offsets[chunk])
+
+        return memoryview(b''.join(self.views(start, stop)))
+
+    def views(self, start, stop):
+        """
+        Vectored read: the data between start and stop as a list of memoryviews, one per chunk (or gap) of the range,
+        in order. Chunk data is not copied.
+        """
+        start, stop = self.bounds(start, stop)
+
+        views = []
+        chunk = self.chunk(start)
+        position = start
+        while position < stop:
+            if chunk + 1 < len(self.offsets) and position >= self.offsets[chunk + 1]:
+                chunk += 1
+
+            if chunk >= 0 and position < self.stops[chunk]:
+                end = min(stop, self.stops[chunk])
+                views.append(self.files[chunk].view(position - self.offsets[chunk], end - self.offsets[chunk]))
+            else:
+                end = min(stop, self.offsets[chunk + 1])
+                views.append(self.gap(position, end))
 
-            for file, file_start, file_stop in reversed(list(self.ranges())):
-                if start >= file_start:
-                    if file_stop < stop:
-                        # print(key, self.offsets, self.lengths, offset+length, stop)
-                        raise ValueError("Reads must be within a single chunk")
+            position = end
 
-                    found = True
-                    break
+        return views
 
-            if not found:
-                raise ValueError("No chunk containing range")
+    def gap(self, start, stop):
+        if self.gaps == 'zero':
+            return memoryview(bytes(stop - start))
 
-            start = start - file_start
-            stop = stop - file_start
-            return self.files[file][start:stop:step]
+        raise ValueError('No chunk containing range {}-{} (between chunks)'.format(start, stop))
+
+    def bounds(self, start, stop):
+        """:return: (start, stop) of a read, with defaults filled in and stop limited to the end of the last chunk"""
+        if start is None:
+            start = 0
+
+        if stop is None or stop > self.stops[-1]:
+            stop = self.stops[-1]
+
+        return start, max(start, stop)
+
+    def chunk(self, position):
+        """:return: index of the last chunk starting at or before position, or -1 if there is none"""
+        return bisect_right(self.offsets, position) - 1
+
+    @property
+    def random_access(self):
+        return all(getattr(file, 'random_access', True) for file in self.files)
+
+    def open_args(self):
+        """Arguments for opening the same file again in another process (see reopen())."""
+        return ConcatenatedFile, (self.file_names, self.offsets), dict(self.kwargs, gaps=self.gaps, opener=self.opener)
 
     def ranges(self):
         for i in range(len(self.files)):
-            yield i, self.offsets[i], self.offsets[i]+self.lengths[i]
+            yield i, self.offsets[i], self.stops[i]
 
     def __len__(self):
         length = sum(self.lengths)
@@ -110,5 +214,171 @@ class ConcatenatedFile:
         return length
 
 
+class FileSlice:
+    """
+    A range of a file, such as a track of a CUE sheet's BIN file which holds several tracks, read as if it were the
+    whole file. Reads are served from a mapping of the file, nothing is copied.
+    """
+
+    def __init__(self, file_name, start=0, stop=None, opener=MmappedFile, **kwargs):
+        """
+        :param opener: function opening the file, e.g. archive.open_file() for files which may be compressed
+        """
+        self.file = opener(file_name, **kwargs)
+        self.file_name = file_name
+        self.start = start
+        self.stop = stop
+        self.opener = opener
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        self.file.__enter__()
+
+        # The slice ends at the end of the file, at the latest.
+        self.end = len(self.file) if self.stop is None else min(self.stop, len(self.file))
+        self.end = max(self.end, self.start)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self.file.__exit__(exc_type, exc_val, exc_tb)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = self.bounds(key.start, key.stop)
+
+            return self.file[start:stop:key.step]
+
+        if not 0 <= key < len(self):
+            raise IndexError('index out of range')
+
+        return self.file[self.start + key]
+
+    def view(self, start, stop):
+        start, stop = self.bounds(start, stop)
+
+        return self.file.view(start, stop)
+
+    def bounds(self, start, stop):
+        """:return: (start, stop) of a read within the slice, as offsets of the file"""
+        start = 0 if start is None else min(start, len(self))
+        stop = len(self) if stop is None else max(start, min(stop, len(self)))
+
+        return self.start + start, self.start + stop
+
+    def slice(self, start, stop=None):
+        """
+        :return: a slice of this (open) slice, sharing its mapping. It is only valid while this slice is open, and isn't
+                 opened or closed itself.
+        """
+        file_slice = FileSlice.__new__(FileSlice)
+        file_slice.file = self.file
+        file_slice.file_name = self.file_name
+        file_slice.start = self.start + start
+        file_slice.stop = self.end if stop is None else self.start + stop
+        file_slice.opener = self.opener
+        file_slice.kwargs = self.kwargs
+        file_slice.end = max(file_slice.start, min(file_slice.stop, self.end))
+
+        return file_slice
+
+    @property
+    def random_access(self):
+        return getattr(self.file, 'random_access', True)
+
+    def open_args(self):
+        """Arguments for opening the same file again in another process (see reopen())."""
+        return FileSlice, (self.file_name, self.start, self.end), dict(self.kwargs, opener=self.opener)
+
+    def ranges(self):
+        yield 0, 0, len(self)
+
+    def __len__(self):
+        return self.end - self.start
+
+
+def split_path(file_name):
+    """
+    :return: (path of the file on disk, member name or None), e.g. ('game.zip', 'disc.gdi') for game.zip/disc.gdi
+    """
+    path = file_name
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path or not parent:
+            return file_name, None
+
+        path = parent
+
+    if path == file_name or not os.path.isfile(path):
+        return file_name, None
+
+    return path, os.path.relpath(file_name, path).replace(os.sep, '/')
+
+
+def reopen(open_args):
+    """Open a file described by open_args() and enter its context. Closing it is left to the caller."""
+    file_class, args, kwargs = open_args
+    file = file_class(*args, **kwargs)
+    file.__enter__()
+
+    return file
+
+
+class MultiHash:
+    """Compute several digests (crc32, md5, sha1) of the same data, which is fed once."""
+    __slots__ = ('algorithms', 'size', 'crc', 'hashes')
+
+    def __init__(self, algorithms):
+        self.algorithms = tuple(algorithms)  # Shared when given a tuple, there can be one MultiHash per file.
+        self.size = 0
+        self.crc = 0
+        self.hashes = {name: hashlib.new(name) for name in self.algorithms if name != 'crc32'}
+
+    def update(self, data):
+        self.size += len(data)
+
+        if 'crc32' in self.algorithms:
+            self.crc = crc32(data, self.crc)
+
+        for digest in self.hashes.values():
+            digest.update(data)
+
+    def hexdigests(self):
+        digests = OrderedDict()
+        for name in self.algorithms:
+            if name == 'crc32':
+                digests[name] = '{:08x}'.format(self.crc)
+            else:
+                digests[name] = self.hashes[name].hexdigest()
+
+        return digests
+
+
+def json_default(obj):
+    # Dict-like objects, such as file lists and their entries.
+    if hasattr(obj, 'items'):
+        return OrderedDict(obj.items())
+
+    return str(obj)
+
+
 def print_status(status):
     print('\r'+status, file=sys.stderr, end=" ")
+
+
+@contextlib.contextmanager
+def redirect_output(stdout=None, stderr=None):
+    """
+    Redirect sys.stdout and sys.stderr to other files, within the context (as contextlib.redirect_stdout() and
+    redirect_stderr() do, from Python 3.4 and 3.5 on).
+
+    :param stdout: file to write the output to, or None to leave it as it is
+    :param stderr: likewise, for errors
+    """
+    previous = sys.stdout, sys.stderr
+    sys.stdout = stdout or sys.stdout
+    sys.stderr = stderr or sys.stderr
+    try:
+        yield
+    finally:
+        sys.stdout, sys.stderr = previous